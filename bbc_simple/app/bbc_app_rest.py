@@ -188,7 +188,8 @@ async def insert_transaction(request):
         return json_response({'error': 'No response'}, 400)
     bbcapp.unregister_from_core()
     msg = {'result': 'success',
-           'transaction_id': retmsg[KeyType.transaction_id].hex()}
+           'transaction_id': retmsg[KeyType.transaction_id].hex(),
+           'index_sequence': retmsg.get(KeyType.index_sequence, None)}
     flog.debug(msg)
     return json_response(msg, 200)
 
@@ -204,9 +205,10 @@ async def search_transaction(request):
         bbcapp.set_user_id(source_user_id)
         bbcapp.register_to_core()
         txid = get_id_binary(json_data, 'transaction_id')
+        deep = json_data.get('deep', False)
     except:
         return json_response({'error': 'invalid request'}, 500)
-    retmsg = bbcapp.search_transaction(txid)
+    retmsg = bbcapp.search_transaction(txid, deep=deep)
     if retmsg is None:
         return json_response({'error': 'No response'}, 400)
 
@@ -232,10 +234,18 @@ async def search_transaction_with_condition(request):
         asset_id = get_id_binary(json_data, 'asset_id')
         user_id = get_id_binary(json_data, 'user_id')
         count = json_data.get('count', 1)
+        direction = json_data.get('direction', 0)
+        cursor = get_id_binary(json_data, 'cursor')
+        index_sequence = json_data.get('index_sequence', None)
+        deep = json_data.get('deep', False)
+        since = json_data.get('since', None)
+        until = json_data.get('until', None)
     except:
         return json_response({'error': 'invalid request'}, 500)
     retmsg = bbcapp.search_transaction_with_condition(asset_group_id=asset_group_id, asset_id=asset_id,
-                                                      user_id=user_id, count=count)
+                                                      user_id=user_id, direction=direction, count=count,
+                                                      cursor=cursor, index_sequence=index_sequence, deep=deep,
+                                                      since=since, until=until)
     if retmsg is None:
         return json_response({'error': 'No response'}, 400)
 
@@ -251,7 +261,8 @@ async def search_transaction_with_condition(request):
             tx_ng.append(get_encoded_bson_txobj(txdat))
     msg = {'result': 'success',
            'transaction_bsons': tx_ok,
-           'transaction_compromised_bsons': tx_ng
+           'transaction_compromised_bsons': tx_ng,
+           'cursor': retmsg[KeyType.cursor].hex() if KeyType.cursor in retmsg else None
            }
     flog.debug(msg)
     return json_response(msg, 200)
@@ -354,18 +354,35 @@ class BBcAppClient:
         self._send_msg(dat)
         return True
 
-    def request_insert_completion_notification(self, asset_group_id, domain_id=None, src_user_id=None):
+    def request_insert_completion_notification(self, asset_group_id, domain_id=None, src_user_id=None,
+                                               coalesce=False, filter_user_id=None, filter_asset_id=None):
         """Request notification when a transaction has been inserted (as a copy of transaction)
 
+        If coalesce is True, the transactions of the asset group inserted in a short window ("coalesce_window" and
+        "coalesce_max_batch" in "insert_notification" of the domain config of the core) are notified in a
+        NOTIFY_INSERTED having the list of transaction_ids (KeyType.transaction_id_list) instead of
+        KeyType.transaction_id.
+        With filter_user_id/filter_asset_id, only the transactions having a matching asset in the asset group are
+        notified. The filters are evaluated by the core.
+
         Args:
             asset_group_id (bytes): asset_group_id for requesting notification about insertion
             domain_id(bytes): target domain_id
             src_user_id(bytes): user_id of the sender
+            coalesce (bool): If True, request the coalesced notification
+            filter_user_id (bytes): user_id of the owner of the asset to watch (None: any user)
+            filter_asset_id (bytes): asset_id to watch (None: any asset)
         Returns:
             bytes: query_id
         """
         dat = self._make_message_structure(MsgType.REQUEST_INSERT_NOTIFICATION, domain_id=domain_id, src_user_id=src_user_id)
         dat[KeyType.asset_group_id] = asset_group_id[:self.id_length]
+        if coalesce:
+            dat[KeyType.coalesce_notification] = True
+        if filter_user_id is not None:
+            dat[KeyType.user_id] = filter_user_id[:self.id_length]
+        if filter_asset_id is not None:
+            dat[KeyType.asset_id] = filter_asset_id[:self.id_length]
         return self._send_msg(dat)
 
     def cancel_insert_completion_notification(self, asset_group_id, domain_id=None, src_user_id=None):
@@ -489,10 +506,13 @@ class BBcAppClient:
         return self._send_msg(dat)
 
     def search_transaction_with_condition(self, asset_group_id=None, asset_id=None, user_id=None, direction=0, count=1,
-                                          domain_id=None, src_user_id=None):
+                                          domain_id=None, src_user_id=None, cursor=None, index_sequence=None,
+                                          deep=False, since=None, until=None):
         """Search transaction data by asset_group_id/asset_id/user_id
 
         If multiple conditions are specified, they are considered as AND condition.
+        If more transactions match the conditions, the response has KeyType.cursor. Give it to this method with
+        the same conditions to get the next page.
 
         Args:
             asset_group_id (bytes): asset_group_id in BBcEvent and BBcRelations
@@ -502,6 +522,11 @@ class BBcAppClient:
             count (int): the number of transactions to retrieve
             domain_id(bytes): target domain_id
             src_user_id(bytes): user_id of the sender
+            cursor (bytes): KeyType.cursor in the previous response (the direction is taken from the cursor)
+            index_sequence (int): KeyType.index_sequence in RESPONSE_INSERT to read the inserted transaction
+            deep (bool): If True, archived transactions are also searched
+            since (int): transactions with timestamp (unix time) >= since are retrieved
+            until (int): transactions with timestamp (unix time) < until are retrieved
         Returns:
             bytes: query_id
         """
@@ -514,31 +539,142 @@ class BBcAppClient:
             dat[KeyType.user_id] = user_id[:self.id_length]
         dat[KeyType.direction] = direction
         dat[KeyType.count] = count
+        if cursor is not None:
+            dat[KeyType.cursor] = cursor
+        if index_sequence is not None:
+            dat[KeyType.index_sequence] = index_sequence
+        if deep:
+            dat[KeyType.deep] = True
+        if since is not None:
+            dat[KeyType.since] = since
+        if until is not None:
+            dat[KeyType.until] = until
+
+        if self.use_query_id_based_message_wait:
+            qid = self._send_msg(dat)
+            return self.callback.sync_by_queryid(qid, timeout=self.timeout)
+        return self._send_msg(dat)
+
+    def search_transaction_by_body_field(self, asset_group_id, field, value=None, lower=None, upper=None, direction=0,
+                                         count=1, domain_id=None, src_user_id=None, cursor=None, index_sequence=None):
+        """Search transaction data by a field of the dict asset bodies
+
+        The field must be declared for the asset_group_id in "body_index" of the domain config of the core.
+        The response is RESPONSE_SEARCH_BY_BODY_FIELD in the same format as RESPONSE_SEARCH_WITH_CONDITIONS.
+
+        Args:
+            asset_group_id (bytes): asset_group_id in BBcEvent and BBcRelations
+            field (str): field name in the asset body (nested fields are given as "a.b")
+            value (int|float|str|bytes): value of the field
+            lower (int|float|str|bytes): lower bound of the value (inclusive, ignored if value is given)
+            upper (int|float|str|bytes): upper bound of the value (inclusive, ignored if value is given)
+            direction (int): 0: descend, 1: ascend
+            count (int): the number of transactions to retrieve
+            domain_id(bytes): target domain_id
+            src_user_id(bytes): user_id of the sender
+            cursor (bytes): KeyType.cursor in the previous response (the direction is taken from the cursor)
+            index_sequence (int): KeyType.index_sequence in RESPONSE_INSERT to read the inserted transaction
+        Returns:
+            bytes: query_id
+        """
+        dat = self._make_message_structure(MsgType.REQUEST_SEARCH_BY_BODY_FIELD, domain_id=domain_id,
+                                           src_user_id=src_user_id)
+        dat[KeyType.asset_group_id] = asset_group_id[:self.id_length]
+        dat[KeyType.body_field] = field
+        for key, val in [(KeyType.body_value, value), (KeyType.body_lower, lower), (KeyType.body_upper, upper)]:
+            if val is not None:
+                dat[key] = val
+        dat[KeyType.direction] = direction
+        dat[KeyType.count] = count
+        if cursor is not None:
+            dat[KeyType.cursor] = cursor
+        if index_sequence is not None:
+            dat[KeyType.index_sequence] = index_sequence
 
         if self.use_query_id_based_message_wait:
             qid = self._send_msg(dat)
             return self.callback.sync_by_queryid(qid, timeout=self.timeout)
         return self._send_msg(dat)
 
-    def search_transaction(self, transaction_id, domain_id=None, src_user_id=None):
+    def get_head(self, asset_group_id, user_id, domain_id=None, src_user_id=None):
+        """Get the latest transaction of the asset group of the user
+
+        The response is RESPONSE_GET_HEAD with KeyType.transaction_id, KeyType.asset_id and KeyType.transaction_data
+        (the same as RESPONSE_SEARCH_TRANSACTION). This is cheaper than search_transaction_with_condition() with
+        count=1.
+
+        Args:
+            asset_group_id (bytes): asset_group_id in BBcEvent and BBcRelations
+            user_id (bytes): user_id in BBcAsset that means the owner of the asset
+            domain_id(bytes): target domain_id
+            src_user_id(bytes): user_id of the sender
+        Returns:
+            bytes: query_id
+        """
+        dat = self._make_message_structure(MsgType.REQUEST_GET_HEAD, domain_id=domain_id, src_user_id=src_user_id)
+        dat[KeyType.asset_group_id] = asset_group_id[:self.id_length]
+        dat[KeyType.user_id] = user_id[:self.id_length]
+
+        if self.use_query_id_based_message_wait:
+            qid = self._send_msg(dat)
+            return self.callback.sync_by_queryid(qid, timeout=self.timeout)
+        return self._send_msg(dat)
+
+    def read_change_feed(self, token=None, count=100, include_data=False, wait=0, domain_id=None, src_user_id=None):
+        """Read a batch of the transactions inserted into the domain (change feed)
+
+        The response is RESPONSE_CHANGE_FEED with KeyType.change_feed (list of [sequence, transaction_id,
+        list of asset_group_ids] (+ [transaction_data] if include_data)) and KeyType.cursor (the resume token).
+        Call this again with the returned token after processing the batch to get the next one.
+        The feed must be enabled by "change_feed" in the domain config of the core.
+
+        Args:
+            token (bytes): resume token in the previous response (None: from the oldest entry in the feed)
+            count (int): the maximum number of entries in the batch
+            include_data (bool): If True, the entries include the serialized transactions
+            wait (float): seconds for the core to wait for an insert if no entry is available
+            domain_id(bytes): target domain_id
+            src_user_id(bytes): user_id of the sender
+        Returns:
+            bytes: query_id
+        """
+        dat = self._make_message_structure(MsgType.REQUEST_CHANGE_FEED, domain_id=domain_id, src_user_id=src_user_id)
+        if token is not None:
+            dat[KeyType.cursor] = token
+        dat[KeyType.count] = count
+        if include_data:
+            dat[KeyType.include_transaction_data] = True
+        if wait > 0:
+            dat[KeyType.feed_wait] = wait
+
+        if self.use_query_id_based_message_wait:
+            qid = self._send_msg(dat)
+            return self.callback.sync_by_queryid(qid, timeout=self.timeout)
+        return self._send_msg(dat)
+
+    def search_transaction(self, transaction_id, domain_id=None, src_user_id=None, deep=False):
         """Search request for a transaction
 
         Args:
             transaction_id (bytes): the target transaction to retrieve
             domain_id(bytes): target domain_id
             src_user_id(bytes): user_id of the sender
+            deep (bool): If True, archived transactions are also searched
         Returns:
             bytes: query_id
         """
         dat = self._make_message_structure(MsgType.REQUEST_SEARCH_TRANSACTION, domain_id=domain_id, src_user_id=src_user_id)
         dat[KeyType.transaction_id] = transaction_id[:self.id_length]
+        if deep:
+            dat[KeyType.deep] = True
 
         if self.use_query_id_based_message_wait:
             qid = self._send_msg(dat)
             return self.callback.sync_by_queryid(qid, timeout=self.timeout)
         return self._send_msg(dat)
 
-    def count_transactions(self, asset_group_id=None, asset_id=None, user_id=None, domain_id=None, src_user_id=None):
+    def count_transactions(self, asset_group_id=None, asset_id=None, user_id=None, domain_id=None, src_user_id=None,
+                           index_sequence=None, since=None, until=None):
         """Count transactions that matches the given conditions
 
         If multiple conditions are specified, they are considered as AND condition.
@@ -549,6 +685,9 @@ class BBcAppClient:
             user_id (bytes): user_id in BBcAsset that means the owner of the asset
             domain_id(bytes): target domain_id
             src_user_id(bytes): user_id of the sender
+            index_sequence (int): KeyType.index_sequence in RESPONSE_INSERT to count the inserted transaction
+            since (int): transactions with timestamp (unix time) >= since are counted
+            until (int): transactions with timestamp (unix time) < until are counted
         Returns:
             int: the number of transactions
         """
@@ -559,6 +698,12 @@ class BBcAppClient:
             dat[KeyType.asset_id] = asset_id
         if user_id is not None:
             dat[KeyType.user_id] = user_id
+        if index_sequence is not None:
+            dat[KeyType.index_sequence] = index_sequence
+        if since is not None:
+            dat[KeyType.since] = since
+        if until is not None:
+            dat[KeyType.until] = until
 
         if self.use_query_id_based_message_wait:
             qid = self._send_msg(dat)
@@ -724,6 +869,12 @@ class Callback:
             self.proc_resp_search_transaction(dat)
         elif dat[KeyType.command] == MsgType.RESPONSE_SEARCH_WITH_CONDITIONS:
             self.proc_resp_search_with_condition(dat)
+        elif dat[KeyType.command] == MsgType.RESPONSE_GET_HEAD:
+            self.proc_resp_search_transaction(dat)
+        elif dat[KeyType.command] == MsgType.RESPONSE_CHANGE_FEED:
+            self.proc_resp_change_feed(dat)
+        elif dat[KeyType.command] == MsgType.RESPONSE_SEARCH_BY_BODY_FIELD:
+            self.proc_resp_search_with_condition(dat)
         elif dat[KeyType.command] == MsgType.RESPONSE_COUNT_TRANSACTIONS:
             self.proc_resp_count_transactions(dat)
         elif dat[KeyType.command] == MsgType.RESPONSE_TRAVERSE_TRANSACTIONS:
@@ -882,6 +1033,16 @@ class Callback:
         """
         self.queue.put(dat)
 
+    def proc_resp_change_feed(self, dat):
+        """Callback for message RESPONSE_CHANGE_FEED
+
+        This method should be overridden if you want to process the message asynchronously.
+
+        Args:
+            dat (dict): received message
+        """
+        self.queue.put(dat)
+
     def proc_resp_traverse_transactions(self, dat):
         """Callback for message RESPONSE_TRAVERSE_TRANSACTIONS
 
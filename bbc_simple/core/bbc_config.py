@@ -16,6 +16,7 @@ from bbc_simple.core import bbclib
 
 DEFAULT_WORKING_DIR = '.bbc_simple'
 DEFAULT_CONFIG_FILE = 'config.json'
+ZDICT_DIR = 'zdict'
 DEFAULT_CORE_PORT = 9000
 
 TIMEOUT_TIMER = 3
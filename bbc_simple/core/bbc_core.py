@@ -37,7 +37,7 @@ from bbc_simple.core.bbc_config import BBcConfig
 from bbc_simple.core.bbc_error import *
 from bbc_simple.logger.fluent_logger import initialize_logger
 
-from bbc_simple.core.bbc_config import DEFAULT_CORE_PORT
+from bbc_simple.core.bbc_config import DEFAULT_CORE_PORT, ZDICT_DIR
 
 
 VERSION = "bbc_simple v0.1"
@@ -98,6 +98,11 @@ class BBcCoreService:
         self.ipv6 = ipv6
         self.logger.debug("config = %s" % conf)
         self.networking = bbc_network.BBcNetwork(self.config, core=self)
+        zdict_dir = os.path.join(self.config.working_dir, ZDICT_DIR)
+        self.networking.fetch_zdicts(zdict_dir)
+        self.logger.info("preset dictionaries: %s" % bbclib.load_zdicts(zdict_dir))
+        # -- a dictionary distributed after the startup is fetched when a transaction using it arrives
+        bbclib.set_zdict_loader(lambda dict_id: self.networking.fetch_zdict(zdict_dir, dict_id))
         for domain_id_str in conf['domains'].keys():
             domain_id = bbclib.convert_idstring_to_bytes(domain_id_str)
             c = self.config.get_domain_config(domain_id)
@@ -110,6 +115,8 @@ class BBcCoreService:
     def quit_program(self):
         """Processes when quiting program"""
         self.config.update_config()
+        for domain_id in self.networking.domains:
+            self.networking.domains[domain_id]['data'].save_txid_filter()
         os._exit(0)
 
     def _start_server(self, port):
@@ -230,7 +237,8 @@ class BBcCoreService:
                 return False, None
             retmsg = _make_message_structure(domain_id, MsgType.RESPONSE_SEARCH_TRANSACTION,
                                             dat[KeyType.source_user_id], dat[KeyType.query_id])
-            txinfo = self._search_transaction_by_txid(domain_id, dat[KeyType.transaction_id])
+            txinfo = self._search_transaction_by_txid(domain_id, dat[KeyType.transaction_id],
+                                                      deep=dat.get(KeyType.deep, False))
             if txinfo is None:
                 if not self._error_reply(msg=retmsg, err_code=ENOTRANSACTION, txt="Cannot find transaction"):
                     user_message_routing.direct_send_to_user(socket, retmsg)
@@ -251,7 +259,12 @@ class BBcCoreService:
                                                             asset_id=dat.get(KeyType.asset_id, None),
                                                             user_id=dat.get(KeyType.user_id, None),
                                                             count=dat.get(KeyType.count, 1),
-                                                            direction=dat.get(KeyType.direction, 0))
+                                                            direction=dat.get(KeyType.direction, 0),
+                                                            cursor=dat.get(KeyType.cursor, None),
+                                                            index_sequence=dat.get(KeyType.index_sequence, None),
+                                                            deep=dat.get(KeyType.deep, False),
+                                                            since=dat.get(KeyType.since, None),
+                                                            until=dat.get(KeyType.until, None))
             if txinfo is None or KeyType.transactions not in txinfo:
                 if not self._error_reply(msg=retmsg, err_code=ENOTRANSACTION, txt="Cannot find transaction"):
                     user_message_routing.direct_send_to_user(socket, retmsg)
@@ -267,10 +280,66 @@ class BBcCoreService:
                                              dat[KeyType.source_user_id], dat[KeyType.query_id])
             count = self.count_transactions(domain_id, asset_group_id=dat.get(KeyType.asset_group_id, None),
                                             asset_id=dat.get(KeyType.asset_id, None),
-                                            user_id=dat.get(KeyType.user_id, None))
+                                            user_id=dat.get(KeyType.user_id, None),
+                                            index_sequence=dat.get(KeyType.index_sequence, None),
+                                            since=dat.get(KeyType.since, None),
+                                            until=dat.get(KeyType.until, None))
             retmsg[KeyType.count] = count
             umr.send_message_to_user(retmsg)
 
+        elif cmd == MsgType.REQUEST_GET_HEAD:
+            if not self._param_check([KeyType.domain_id, KeyType.asset_group_id, KeyType.user_id], dat):
+                self.logger.debug("REQUEST_GET_HEAD: bad format")
+                return False, None
+            retmsg = _make_message_structure(domain_id, MsgType.RESPONSE_GET_HEAD,
+                                             dat[KeyType.source_user_id], dat[KeyType.query_id])
+            txinfo = self.get_head(domain_id, dat[KeyType.asset_group_id], dat[KeyType.user_id])
+            if txinfo is None:
+                if not self._error_reply(msg=retmsg, err_code=ENOTRANSACTION, txt="Cannot find transaction"):
+                    user_message_routing.direct_send_to_user(socket, retmsg)
+                return False, None
+            if KeyType.compromised_transaction_data in txinfo:
+                retmsg[KeyType.status] = EBADTRANSACTION
+            retmsg.update(txinfo)
+            umr.send_message_to_user(retmsg)
+
+        elif cmd == MsgType.REQUEST_SEARCH_BY_BODY_FIELD:
+            if not self._param_check([KeyType.domain_id, KeyType.asset_group_id, KeyType.body_field], dat):
+                self.logger.debug("REQUEST_SEARCH_BY_BODY_FIELD: bad format")
+                return False, None
+            retmsg = _make_message_structure(domain_id, MsgType.RESPONSE_SEARCH_BY_BODY_FIELD,
+                                             dat[KeyType.source_user_id], dat[KeyType.query_id])
+            txinfo = self.search_transaction_by_body_field(domain_id, dat[KeyType.asset_group_id],
+                                                           dat[KeyType.body_field],
+                                                           value=dat.get(KeyType.body_value, None),
+                                                           lower=dat.get(KeyType.body_lower, None),
+                                                           upper=dat.get(KeyType.body_upper, None),
+                                                           count=dat.get(KeyType.count, 1),
+                                                           direction=dat.get(KeyType.direction, 0),
+                                                           cursor=dat.get(KeyType.cursor, None),
+                                                           index_sequence=dat.get(KeyType.index_sequence, None))
+            if txinfo is None or KeyType.transactions not in txinfo:
+                if not self._error_reply(msg=retmsg, err_code=ENOTRANSACTION, txt="Cannot find transaction"):
+                    user_message_routing.direct_send_to_user(socket, retmsg)
+            else:
+                retmsg.update(txinfo)
+                umr.send_message_to_user(retmsg)
+
+        elif cmd == MsgType.REQUEST_CHANGE_FEED:
+            if not self._param_check([KeyType.domain_id], dat):
+                self.logger.debug("REQUEST_CHANGE_FEED: bad format")
+                return False, None
+            retmsg = _make_message_structure(domain_id, MsgType.RESPONSE_CHANGE_FEED,
+                                             dat[KeyType.source_user_id], dat[KeyType.query_id])
+            wait = self._change_feed_wait(domain_id, dat.get(KeyType.feed_wait, 0))
+            args = (socket, umr, retmsg, domain_id, dat.get(KeyType.cursor, None), dat.get(KeyType.count, 100),
+                    dat.get(KeyType.include_transaction_data, False), wait)
+            if wait > 0:
+                # -- a long poll must not block the other requests from the client, so the reply is sent by a greenlet
+                gevent.spawn(self._reply_change_feed, *args)
+            else:
+                self._reply_change_feed(*args)
+
         elif cmd == MsgType.REQUEST_TRAVERSE_TRANSACTIONS:
             if not self._param_check([KeyType.domain_id, KeyType.transaction_id,
                                      KeyType.direction, KeyType.hop_count], dat):
@@ -363,7 +432,10 @@ class BBcCoreService:
             return True, None
 
         elif cmd == MsgType.REQUEST_INSERT_NOTIFICATION:
-            umr.register_notification(dat[KeyType.asset_group_id], dat[KeyType.source_user_id])
+            umr.register_notification(dat[KeyType.asset_group_id], dat[KeyType.source_user_id],
+                                      coalesce=dat.get(KeyType.coalesce_notification, False),
+                                      filter_user_id=dat.get(KeyType.user_id, None),
+                                      filter_asset_id=dat.get(KeyType.asset_id, None))
 
         elif cmd == MsgType.CANCEL_INSERT_NOTIFICATION:
             umr.unregister_notification(dat[KeyType.asset_group_id], dat[KeyType.source_user_id])
@@ -460,17 +532,18 @@ class BBcCoreService:
     def validate_transaction(self, txdata):
         """Validate transaction by verifying signature
 
+        Only the index fields and signatures are decoded (see bbclib.scan_transaction).
+
         Args:
             txdata (bytes): serialized transaction data
         Returns:
-            BBcTransaction: if validation fails, None returns.
+            BBcTransactionIndex: if validation fails, None returns.
         """
-        txobj = BBcTransaction()
-        if not txobj.deserialize(txdata):
+        txobj = bbclib.scan_transaction(txdata)
+        if txobj is None:
             self.stats.update_stats_increment("transaction", "invalid", 1)
             self.logger.error("Fail to deserialize transaction data")
             return None
-        txobj.digest()
 
         flag, valid_asset, invalid_asset = bbclib.validate_transaction_object(txobj)
         if flag:
@@ -486,7 +559,7 @@ class BBcCoreService:
             domain_id (bytes): target domain_id
             txdata (bytes): serialized transaction data
         Returns:
-            dict|str: inserted transaction_id or error message
+            dict|str: inserted transaction_id (and index_sequence in the deferred indexing mode) or error message
         """
         self.stats.update_stats_increment("transaction", "insert_count", 1)
         if domain_id is None:
@@ -501,33 +574,55 @@ class BBcCoreService:
         self.logger.debug("[node:%s] insert_transaction %s" %
                           (self.networking.domains[domain_id]['name'], binascii.b2a_hex(txobj.transaction_id[:4])))
 
-        asset_group_ids = self.networking.domains[domain_id]['data'].insert_transaction(txdata, txobj=txobj)
+        dh = self.networking.domains[domain_id]['data']
+        asset_group_ids = dh.insert_transaction(txdata, txobj=txobj)
         if asset_group_ids is None:
             self.stats.update_stats_increment("transaction", "insert_fail_count", 1)
             self.logger.error("[%s] Fail to insert a transaction into the ledger" % self.networking.domains[domain_id]['name'])
             return "Failed to insert a transaction into the ledger"
 
-        self.send_inserted_notification(domain_id, asset_group_ids, txobj.transaction_id)
+        self.send_inserted_notification(domain_id, asset_group_ids, txobj.transaction_id,
+                                        asset_info=dh.get_asset_info(txobj))
 
+        if dh.deferred_indexing:
+            return {KeyType.transaction_id: txobj.transaction_id, KeyType.index_sequence: dh.last_index_sequence}
         return {KeyType.transaction_id: txobj.transaction_id}
 
-    def send_inserted_notification(self, domain_id, asset_group_ids, transaction_id):
+    def send_inserted_notification(self, domain_id, asset_group_ids, transaction_id, asset_info=None):
         """Broadcast NOTIFY_INSERTED
 
+        The broadcast is skipped if no node has a subscriber of the asset groups, unless the other cores need it
+        to update their Bloom filters of transaction_ids (i.e., the filter is not exclusive). With asset_info, the
+        subscribers' user_id/asset_id filters are evaluated by the receiving nodes (see UserMessageRouting).
+
         Args:
             domain_id (bytes): target domain_id
             asset_group_ids (list): list of asset_group_ids
             transaction_id (bytes): transaction_id that has just inserted
+            asset_info (list): list of (asset_group_id, asset_id, user_id) in the transaction
         """
+        dh = self.networking.domains[domain_id]['data']
+        other_filters = dh.txid_filter is not None and not dh.txid_filter_exclusive
+        if not other_filters and not self.networking.has_notification_subscribers(domain_id, asset_group_ids):
+            self.stats.update_stats_increment("transaction", "notification_skipped", 1)
+            return
         msg = bytearray()
         msg.extend(int(len(transaction_id)).to_bytes(1, 'big'))
         msg.extend(int(len(domain_id)).to_bytes(1, 'big'))
         msg.extend(transaction_id)
         msg.extend(domain_id)
-        msg.extend(int(len(asset_group_ids)).to_bytes(1, 'big'))
-        for asset_group_id in asset_group_ids:
-            msg.extend(asset_group_id)
-        self.networking.broadcast_notification_message(domain_id=domain_id, msg=bytes(msg))
+        if asset_info is None:
+            msg.extend(int(len(asset_group_ids)).to_bytes(1, 'big'))
+            for asset_group_id in asset_group_ids:
+                msg.extend(asset_group_id)
+            self.networking.broadcast_notification_message(domain_id=domain_id, msg=bytes(msg))
+            return
+        msg.extend(to_2byte(len(asset_info)))
+        for info in asset_info:
+            for value in info:
+                msg.extend(int(len(value)).to_bytes(1, 'big'))
+                msg.extend(value)
+        self.networking.broadcast_notification_message(domain_id=domain_id, msg=bytes(msg), with_asset_info=True)
 
     def _distribute_transaction_to_gather_signatures(self, domain_id, dat):
         """Request to distribute sign_request to users
@@ -554,12 +649,13 @@ class BBcCoreService:
             umr.send_message_to_user(msg)
         return True
 
-    def _search_transaction_by_txid(self, domain_id, transaction_id):
+    def _search_transaction_by_txid(self, domain_id, transaction_id, deep=False):
         """Search transaction_data by transaction_id
 
         Args:
             domain_id (bytes): target domain_id
             transaction_id (bytes): transaction_id to search
+            deep (bool): If True, archived transactions are also searched
         Returns:
             dict: dictionary having transaction_id, serialized transaction data, asset files
         """
@@ -572,7 +668,7 @@ class BBcCoreService:
             return None
 
         dh = self.networking.domains[domain_id]['data']
-        ret_txobj = dh.search_transaction(transaction_id=transaction_id)
+        ret_txobj = dh.search_transaction(transaction_id=transaction_id, deep=deep)
         if ret_txobj is None or len(ret_txobj) == 0:
             return None
 
@@ -586,11 +682,81 @@ class BBcCoreService:
             del response_info[KeyType.compromised_transactions]
         return response_info
 
+    def get_head(self, domain_id, asset_group_id, user_id):
+        """Get the latest transaction of the asset group of the user
+
+        This reads the head maintained by DataHandler instead of searching asset_info_table with count=1.
+
+        Args:
+            domain_id (bytes): target domain_id
+            asset_group_id (bytes): asset_group_id
+            user_id (bytes): user_id of the asset owner
+        Returns:
+            dict: dictionary having transaction_id, asset_id and serialized transaction data
+        """
+        if domain_id is None:
+            self.logger.error("No such domain")
+            return None
+
+        dh = self.networking.domains[domain_id]['data']
+        transaction_id, asset_id = dh.get_head(asset_group_id, user_id)
+        if transaction_id is None:
+            return None
+        response_info = self._search_transaction_by_txid(domain_id, transaction_id)
+        if response_info is None:
+            return None
+        response_info[KeyType.asset_id] = asset_id
+        return response_info
+
+    def _change_feed_wait(self, domain_id, wait):
+        """Clamp the long poll time requested by a client to "max_wait" of the change_feed config of the domain"""
+        if domain_id is None or domain_id not in self.networking.domains:
+            return 0
+        return max(0, min(wait, self.networking.domains[domain_id]['data'].change_feed_max_wait))
+
+    def _reply_change_feed(self, socket, umr, retmsg, domain_id, token, count, include_data, wait):
+        """Send a batch of the change feed to the client (see read_change_feed())"""
+        feed = self.read_change_feed(domain_id, token=token, count=count, include_data=include_data, wait=wait)
+        if feed is None:
+            if not self._error_reply(msg=retmsg, err_code=EINVALID_COMMAND, txt="Cannot read change feed"):
+                user_message_routing.direct_send_to_user(socket, retmsg)
+            return
+        retmsg.update(feed)
+        umr.send_message_to_user(retmsg)
+
+    def read_change_feed(self, domain_id, token=None, count=100, include_data=False, wait=0):
+        """Read a batch of the transactions inserted into the domain after the position given by the token
+
+        Flow control is by the client: it receives at most count entries per request and sends the next request
+        with the returned token when it has processed them. So a slow consumer is never flooded, and it can resume
+        from the last token after reconnecting.
+
+        Args:
+            domain_id (bytes): target domain_id
+            token (bytes): resume token (KeyType.cursor) returned by the previous read (None: from the oldest entry)
+            count (int): the maximum number of entries in the batch
+            include_data (bool): If True, the entries include the serialized transactions
+            wait (float): seconds to wait for an insert if no entry is available (long poll, see _change_feed_wait())
+        Returns:
+            dict: dictionary having the entries (KeyType.change_feed) and the resume token (KeyType.cursor)
+        """
+        if domain_id is None or domain_id not in self.networking.domains:
+            self.logger.error("No such domain")
+            return None
+
+        dh = self.networking.domains[domain_id]['data']
+        entries, next_token = dh.read_change_feed(token=token, count=count, include_data=include_data, wait=wait)
+        if entries is None:
+            return None
+        return {KeyType.change_feed: entries, KeyType.cursor: next_token}
+
     def search_transaction_with_condition(self, domain_id, asset_group_id=None, asset_id=None, user_id=None,
-                                          direction=0, count=1):
+                                          direction=0, count=1, cursor=None, index_sequence=None, deep=False,
+                                          since=None, until=None):
         """Search transactions that match given conditions
 
         When Multiple conditions are given, they are considered as AND condition.
+        If more transactions match the conditions, the result includes a cursor (KeyType.cursor) to get the next page.
 
         Args:
             domain_id (bytes): target domain_id
@@ -599,6 +765,11 @@ class BBcCoreService:
             user_id (bytes): user_id that target transactions should have
             direction (int): 0: descend, 1: ascend
             count (int): The maximum number of transactions to retrieve
+            cursor (bytes): cursor returned in the previous result to get the next page
+            index_sequence (int): wait until the insert with this index_sequence is indexed (deferred indexing mode)
+            deep (bool): If True, archived transactions are also searched
+            since (int): transactions with timestamp (unix time) >= since are retrieved
+            until (int): transactions with timestamp (unix time) < until are retrieved
         Returns:
             dict: dictionary having transaction_id, serialized transaction data, asset files
         """
@@ -607,14 +778,62 @@ class BBcCoreService:
             return None
 
         dh = self.networking.domains[domain_id]['data']
-        ret_txobj = dh.search_transaction(asset_group_id=asset_group_id, asset_id=asset_id, user_id=user_id,
-                                          direction=direction, count=count)
+        if index_sequence is not None and not dh.wait_for_index(index_sequence):
+            self.logger.warning("Timeout in waiting for indexing (index_sequence=%d)" % index_sequence)
+        ret_txobj, next_cursor = dh.search_transaction_with_cursor(asset_group_id=asset_group_id, asset_id=asset_id,
+                                                                   user_id=user_id, direction=direction, count=count,
+                                                                   cursor=cursor, deep=deep, since=since,
+                                                                   until=until)
         if ret_txobj is None or len(ret_txobj) == 0:
             return None
 
-        return _create_search_result(ret_txobj)
+        response_info = _create_search_result(ret_txobj)
+        if next_cursor is not None:
+            response_info[KeyType.cursor] = next_cursor
+        return response_info
+
+    def search_transaction_by_body_field(self, domain_id, asset_group_id, field, value=None, lower=None, upper=None,
+                                         direction=0, count=1, cursor=None, index_sequence=None):
+        """Search transactions by a field of the dict asset bodies (declared in "body_index" of the domain config)
+
+        If more transactions match the conditions, the result includes a cursor (KeyType.cursor) to get the next page.
+
+        Args:
+            domain_id (bytes): target domain_id
+            asset_group_id (bytes): asset_group_id of the assets
+            field (str): field name (nested fields are given as "a.b")
+            value (int|float|str|bytes): value of the field
+            lower (int|float|str|bytes): lower bound of the value (inclusive, ignored if value is given)
+            upper (int|float|str|bytes): upper bound of the value (inclusive, ignored if value is given)
+            direction (int): 0: descend, 1: ascend
+            count (int): The maximum number of transactions to retrieve
+            cursor (bytes): cursor returned in the previous result to get the next page
+            index_sequence (int): wait until the insert with this index_sequence is indexed (deferred indexing mode)
+        Returns:
+            dict: dictionary having transaction_id, serialized transaction data, asset files
+        """
+        if domain_id is None:
+            self.logger.error("No such domain")
+            return None
+
+        dh = self.networking.domains[domain_id]['data']
+        if index_sequence is not None and not dh.wait_for_index(index_sequence):
+            self.logger.warning("Timeout in waiting for indexing (index_sequence=%d)" % index_sequence)
+        if isinstance(field, bytes):
+            field = field.decode()
+        ret_txobj, next_cursor = dh.search_transaction_by_body_field(asset_group_id, field, value=value, lower=lower,
+                                                                     upper=upper, direction=direction, count=count,
+                                                                     cursor=cursor)
+        if ret_txobj is None or len(ret_txobj) == 0:
+            return None
+
+        response_info = _create_search_result(ret_txobj)
+        if next_cursor is not None:
+            response_info[KeyType.cursor] = next_cursor
+        return response_info
 
-    def count_transactions(self, domain_id, asset_group_id=None, asset_id=None, user_id=None):
+    def count_transactions(self, domain_id, asset_group_id=None, asset_id=None, user_id=None, index_sequence=None,
+                           since=None, until=None):
         """Count transactions that match given conditions
 
         When Multiple conditions are given, they are considered as AND condition.
@@ -624,6 +843,9 @@ class BBcCoreService:
             asset_group_id (bytes): asset_group_id that target transactions should have
             asset_id (bytes): asset_id that target transactions should have
             user_id (bytes): user_id that target transactions should have
+            index_sequence (int): wait until the insert with this index_sequence is indexed (deferred indexing mode)
+            since (int): transactions with timestamp (unix time) >= since are counted
+            until (int): transactions with timestamp (unix time) < until are counted
         Returns:
             int: the number of transactions
         """
@@ -632,7 +854,10 @@ class BBcCoreService:
             return None
 
         dh = self.networking.domains[domain_id]['data']
-        return dh.count_transactions(asset_group_id=asset_group_id, asset_id=asset_id, user_id=user_id)
+        if index_sequence is not None and not dh.wait_for_index(index_sequence):
+            self.logger.warning("Timeout in waiting for indexing (index_sequence=%d)" % index_sequence)
+        return dh.count_transactions(asset_group_id=asset_group_id, asset_id=asset_id, user_id=user_id, since=since,
+                                     until=until)
 
     def _traverse_transactions(self, domain_id, transaction_id, asset_group_id=None, user_id=None, direction=1, hop_count=3):
         """Get transaction tree from the specified transaction_id and given conditions
@@ -17,6 +17,7 @@ limitations under the License.
 import redis
 import threading
 import logging
+import time
 import os
 import sys
 sys.path.extend(["../../", os.path.abspath(os.path.dirname(__file__))])
@@ -28,6 +29,18 @@ from bbc_simple.core.message_key_types import to_2byte, PayloadType
 
 
 MSG_EXPIRE_SECONDS = 30
+ZDICT_REDIS_KEY = "bbc_zdict"
+NOTIFICATION_REDIS_KEY_PREFIX = b"bbc_notify:"
+NOTIFICATION_SUBSCRIBER_TTL = 60  # sec; the registration of a node not refreshed in this period is ignored
+NOTIFICATION_HEARTBEAT_INTERVAL = 20
+
+
+def _notification_key(domain_id, asset_group_id):
+    """Redis key of the sorted set of the nodes having subscribers of the insert notification of the asset group
+
+    The score of a node_id is the expiry time of the registration, which is refreshed by the heartbeat of the node.
+    """
+    return NOTIFICATION_REDIS_KEY_PREFIX + bytes(domain_id) + bytes(asset_group_id)
 
 
 def _convert_to_string(array):
@@ -71,6 +84,51 @@ class BBcNetwork:
         th.setDaemon(True)
         th.start()
         self.redis_msg = redis.StrictRedis(connection_pool=pool, ssl=conf.get('ssl', False), db=1)
+        th = threading.Thread(target=self._notification_heartbeat_loop)
+        th.setDaemon(True)
+        th.start()
+
+    def fetch_zdicts(self, directory):
+        """Save the preset dictionaries distributed via redis (see utils/bbc_zdict_tool.py) in the directory
+
+        Args:
+            directory (str): path to the directory
+        Returns:
+            list: list of dict_ids newly saved
+        """
+        saved = list()
+        try:
+            zdicts = self.redis_msg.hgetall(ZDICT_REDIS_KEY)
+        except redis.exceptions.RedisError:
+            self.logger.error("Failed to fetch preset dictionaries")
+            return saved
+        for dict_id, zdict in zdicts.items():
+            dict_id = int(dict_id)
+            if os.path.exists(os.path.join(directory, "%d%s" % (dict_id, bbclib.ZDICT_SUFFIX))):
+                continue
+            bbclib.save_zdict(directory, dict_id, zdict)
+            saved.append(dict_id)
+        return saved
+
+    def fetch_zdict(self, directory, dict_id):
+        """Fetch a preset dictionary distributed via redis and save it in the directory (see bbclib.set_zdict_loader)
+
+        Args:
+            directory (str): path to the directory
+            dict_id (int): dictionary id
+        Returns:
+            bytes: the dictionary (None if not found)
+        """
+        try:
+            zdict = self.redis_msg.hget(ZDICT_REDIS_KEY, dict_id)
+        except redis.exceptions.RedisError:
+            self.logger.error("Failed to fetch the preset dictionary %d" % dict_id)
+            return None
+        if zdict is None:
+            return None
+        bbclib.save_zdict(directory, dict_id, zdict)
+        self.logger.info("preset dictionary %d is fetched" % dict_id)
+        return zdict
 
     def _redis_loop(self, pool):
         conf = self.config.get_config()['redis']
@@ -110,12 +168,13 @@ class BBcNetwork:
         self.domains[domain_id] = dict()
         self.domains[domain_id]['node_id'] = node_id
         self.domains[domain_id]['name'] = node_id.hex()[:4]
-        self.domains[domain_id]['user'] = UserMessageRouting(self, domain_id)
+        self.domains[domain_id]['user'] = UserMessageRouting(self, domain_id,
+                                                             config=conf.get('insert_notification', None))
 
         workingdir = self.config.get_config()['workingdir']
         db_default = self.config.get_config()['db']
         self.domains[domain_id]['data'] = DataHandler(self, default_config=db_default, config=conf,
-                                                      workingdir=workingdir, domain_id=domain_id)
+                                                      workingdir=workingdir, domain_id=domain_id, start_workers=True)
 
         self.stats.update_stats_increment("network", "num_domains", 1)
         self.logger.info("Domain %s is created" % (domain_id.hex()))
@@ -132,6 +191,8 @@ class BBcNetwork:
         if domain_id not in self.domains:
             return False
 
+        for asset_group_id in list(self.domains[domain_id]['user'].insert_notification_list.keys()):
+            self.unregister_notification_subscriber(domain_id, asset_group_id)
         del self.domains[domain_id]
         self.config.remove_domain_config(domain_id)
         self.stats.update_stats_decrement("network", "num_domains", 1)
@@ -160,14 +221,82 @@ class BBcNetwork:
             self.redis_msg.lpush(dst_info, dat)
         self.redis_pubsub.publish(domain_id, dst_info)
 
-    def broadcast_notification_message(self, domain_id, msg):
+    def register_notification_subscriber(self, domain_id, asset_group_id):
+        """Add this node to the cluster-wide registry of the nodes having subscribers of the asset group
+
+        The registration expires in NOTIFICATION_SUBSCRIBER_TTL unless refreshed by _notification_heartbeat_loop(),
+        so that the registration of a crashed node does not remain.
+
+        Args:
+            domain_id (bytes): target domain_id
+            asset_group_id (bytes): watched asset_group_id
+        """
+        self._refresh_notification_subscribers(domain_id, [asset_group_id])
+
+    def unregister_notification_subscriber(self, domain_id, asset_group_id):
+        """Remove this node from the cluster-wide registry of the nodes having subscribers of the asset group
+
+        Args:
+            domain_id (bytes): target domain_id
+            asset_group_id (bytes): asset_group_id no longer watched on this node
+        """
+        try:
+            self.redis_msg.zrem(_notification_key(domain_id, asset_group_id), self.domains[domain_id]['node_id'])
+        except redis.exceptions.RedisError:
+            self.logger.error("Failed to unregister the notification subscriber")
+
+    def _refresh_notification_subscribers(self, domain_id, asset_group_ids):
+        """Set the expiry of the registrations of this node for the asset groups"""
+        expiry = time.time() + NOTIFICATION_SUBSCRIBER_TTL
+        try:
+            pipe = self.redis_msg.pipeline()
+            for asset_group_id in asset_group_ids:
+                key = _notification_key(domain_id, asset_group_id)
+                pipe.zadd(key, {self.domains[domain_id]['node_id']: expiry})
+                pipe.expire(key, NOTIFICATION_SUBSCRIBER_TTL)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            self.logger.error("Failed to register the notification subscriber")
+
+    def _notification_heartbeat_loop(self):
+        """Refresh the registrations of the asset groups watched on this node periodically"""
+        while True:
+            time.sleep(NOTIFICATION_HEARTBEAT_INTERVAL)
+            for domain_id, domain in list(self.domains.items()):
+                asset_group_ids = list(domain['user'].insert_notification_list.keys())
+                if len(asset_group_ids) > 0:
+                    self._refresh_notification_subscribers(domain_id, asset_group_ids)
+
+    def has_notification_subscribers(self, domain_id, asset_group_ids):
+        """Return True if any node has a subscriber of the insert notification of the asset groups
+
+        Args:
+            domain_id (bytes): target domain_id
+            asset_group_ids (list): list of asset_group_ids
+        Returns:
+            bool: True if subscribed (also True if the registry cannot be read)
+        """
+        if len(asset_group_ids) == 0:
+            return False
+        now = time.time()
+        try:
+            pipe = self.redis_msg.pipeline()
+            for asset_group_id in asset_group_ids:
+                pipe.zcount(_notification_key(domain_id, asset_group_id), now, "+inf")
+            return any(num > 0 for num in pipe.execute())
+        except redis.exceptions.RedisError:
+            return True
+
+    def broadcast_notification_message(self, domain_id, msg, with_asset_info=False):
         """Send notification message to users
 
         Args:
             domain_id (bytes): target domain_id
             msg (bytes): message to broadcast
+            with_asset_info (bool): If True, msg has the asset info (asset_group_id, asset_id, user_id) of the
+                                    transaction instead of the list of asset_group_ids
         """
-        dst_info = bytearray(int(1).to_bytes(1, 'big'))
+        dst_info = bytearray(int(2 if with_asset_info else 1).to_bytes(1, 'big'))
         dst_info.extend(msg)
         dst_info = bytes(dst_info)
         self.redis_pubsub.publish(domain_id, dst_info)
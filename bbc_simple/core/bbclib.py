@@ -18,10 +18,13 @@ import sys
 import os
 import binascii
 import hashlib
+import struct
 import msgpack
 import bson
 import bz2
 import zlib
+import mmap
+import multiprocessing
 import random
 import time
 import traceback
@@ -53,6 +56,9 @@ class BBcFormat:
     FORMAT_MSGPACK = 4
     FORMAT_MSGPACK_COMPRESS_BZ2 = 5
     FORMAT_MSGPACK_COMPRESS_ZLIB = 6
+    FORMAT_COMPACT = 7
+    FORMAT_BSON_COMPRESS_ZDICT = 8
+    FORMAT_MSGPACK_COMPRESS_ZDICT = 9
 
 
 def set_error(code=-1, txt=""):
@@ -127,6 +133,188 @@ def convert_idstring_to_bytes(datastr, bytelen=DEFAULT_ID_LEN):
     return bytes(res)
 
 
+ZDICT_MAX_SIZE = 32768  # zlib uses at most the last 32KB of a preset dictionary
+ZDICT_SUFFIX = ".zdict"
+_ZDICT_ID = struct.Struct('<I')
+_zdict_registry = dict()
+_zdict_default_id = None
+_zdict_loader = None
+
+
+def register_zdict(dict_id, zdict, default=True):
+    """Register a preset dictionary for FORMAT_*_COMPRESS_ZDICT
+
+    A dictionary must never be changed once transactions are compressed with it. Train a new one and
+    register it with a new (larger) dict_id instead; the older ones are still needed for decoding.
+
+    Args:
+        dict_id (int): dictionary id (uint32) written in the header of the compressed data
+        zdict (bytes): preset dictionary
+        default (bool): If True, the dictionary is used for serializing transactions that have no zdict_id
+    """
+    global _zdict_default_id
+    _zdict_registry[dict_id] = bytes(zdict[-ZDICT_MAX_SIZE:])
+    if default:
+        _zdict_default_id = dict_id
+
+
+def get_zdict(dict_id):
+    """Return the preset dictionary registered with dict_id (None if not registered)"""
+    return _zdict_registry.get(dict_id, None)
+
+
+def set_zdict_loader(loader):
+    """Set the function to get a dictionary that is not registered yet (e.g., distributed after the startup)
+
+    Args:
+        loader (callable): function that takes dict_id and returns the dictionary (None if not found)
+    """
+    global _zdict_loader
+    _zdict_loader = loader
+
+
+def _lookup_zdict(dict_id):
+    """Return the registered dictionary, or the one given by the loader (registered as a non-default one)"""
+    zdict = _zdict_registry.get(dict_id, None)
+    if zdict is None and _zdict_loader is not None and dict_id is not None:
+        zdict = _zdict_loader(dict_id)
+        if zdict is not None:
+            register_zdict(dict_id, zdict, default=False)
+            zdict = _zdict_registry[dict_id]
+    return zdict
+
+
+def get_zdict_id(data):
+    """Return the dictionary id in FORMAT_*_COMPRESS_ZDICT data (without the 2-byte format_type)"""
+    if len(data) < _ZDICT_ID.size:
+        return None
+    return _ZDICT_ID.unpack_from(data, 0)[0]
+
+
+def load_zdicts(directory):
+    """Register all dictionaries (<dict_id>.zdict) in the directory
+
+    The dictionary having the largest dict_id becomes the default one.
+
+    Args:
+        directory (str): path to the directory
+    Returns:
+        list: list of loaded dict_ids
+    """
+    if not os.path.isdir(directory):
+        return []
+    dict_ids = list()
+    for fname in os.listdir(directory):
+        name, ext = os.path.splitext(fname)
+        if ext != ZDICT_SUFFIX or not name.isdigit():
+            continue
+        with open(os.path.join(directory, fname), "rb") as f:
+            register_zdict(int(name), f.read(), default=False)
+        dict_ids.append(int(name))
+    dict_ids.sort()
+    if len(dict_ids) > 0:
+        global _zdict_default_id
+        _zdict_default_id = dict_ids[-1]
+    return dict_ids
+
+
+def save_zdict(directory, dict_id, zdict):
+    """Save a dictionary as <dict_id>.zdict so that load_zdicts() can find it
+
+    Args:
+        directory (str): path to the directory
+        dict_id (int): dictionary id
+        zdict (bytes): preset dictionary
+    Returns:
+        str: path to the saved file
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "%d%s" % (dict_id, ZDICT_SUFFIX))
+    with open(path, "wb") as f:
+        f.write(zdict)
+    return path
+
+
+def train_zdict(samples, size=ZDICT_MAX_SIZE, segment_length=16):
+    """Make a preset dictionary from sample data
+
+    Fixed-length segments are ranked by the number of samples that contain them, and the most common
+    ones are concatenated so that the most common segment comes last (closest to the data, i.e.,
+    cheapest for zlib to refer to). Segments mostly overlapping the ones already chosen are skipped.
+
+    Args:
+        samples (list): list of serialized (uncompressed) bson/msgpack transaction data
+        size (int): maximum size of the dictionary
+        segment_length (int): length of the segments to be counted
+    Returns:
+        bytes: preset dictionary
+    """
+    counts = dict()
+    for sample in samples:
+        segments = set(sample[i:i+segment_length] for i in range(0, len(sample) - segment_length + 1))
+        for seg in segments:
+            counts[seg] = counts.get(seg, 0) + 1
+    candidates = sorted((c, seg) for seg, c in counts.items() if c > 1)
+    covered = set()
+    chosen = list()
+    total = 0
+    for c, seg in reversed(candidates):
+        if total + segment_length > size:
+            break
+        grams = [seg[i:i+4] for i in range(segment_length - 3)]
+        if sum(1 for g in grams if g in covered) * 2 > len(grams):
+            continue
+        covered.update(grams)
+        chosen.append(seg)
+        total += segment_length
+    return b''.join(reversed(chosen))
+
+
+def _zdict_compress(dat, dict_id):
+    """Compress data with the preset dictionary and prepend the dictionary id"""
+    zdict = _lookup_zdict(dict_id)
+    if zdict is None:
+        set_error(code=EOTHER, txt="No such preset dictionary: %s" % dict_id)
+        return None
+    compressor = zlib.compressobj(zdict=zdict)
+    return _ZDICT_ID.pack(dict_id) + compressor.compress(dat) + compressor.flush()
+
+
+def _zdict_decompress(dat):
+    """Decompress data made by _zdict_compress"""
+    dict_id = get_zdict_id(dat)
+    zdict = _lookup_zdict(dict_id)
+    if zdict is None:
+        set_error(code=EBADTRANSACTION, txt="No such preset dictionary: %s" % dict_id)
+        return None
+    decompressor = zlib.decompressobj(zdict=zdict)
+    try:
+        return decompressor.decompress(dat[_ZDICT_ID.size:]) + decompressor.flush()
+    except zlib.error:
+        set_error(code=EBADTRANSACTION, txt="Broken zdict data")
+        return None
+
+
+def _stringify_pairs(pairs):
+    """object_pairs_hook for msgpack that decodes raw (bytes) keys"""
+    return {(k.decode() if isinstance(k, bytes) else k): v for k, v in pairs}
+
+
+# msgpack-python < 1.0 returns keys as bytes unless raw=False, which would also decode binary ids
+_MSGPACK_RAW_KEYS = isinstance(next(iter(msgpack.loads(msgpack.dumps({"k": 0})))), bytes)
+
+
+def _msgpack_loads(data):
+    """Decode msgpack data with str keys in a single pass
+
+    The decoded dicts are passed as they are to deserialize_obj() of each part, so no part
+    needs to stringify the keys again.
+    """
+    if _MSGPACK_RAW_KEYS:
+        return msgpack.loads(data, object_pairs_hook=_stringify_pairs)
+    return msgpack.loads(data)
+
+
 def deep_copy_with_key_stringify(u, d=None):
     """Utility for updating nested dictionary"""
     if d is None:
@@ -269,6 +457,160 @@ def get_bigint(ptr, dat):
     return ptr+2+size, dat[ptr+2:ptr+2+size]
 
 
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_TX_HEADER = struct.Struct('<HIQHH')   # format_type, version, timestamp, id_length, number of events
+_BODY_HEADER = struct.Struct('<HH')     # asset_body type, asset_body_size
+_STRUCT_CACHE = dict()
+
+
+def _read_uint16(dat, ptr):
+    """Read 2-byte little endian integer at ptr of the buffer (bytes or memoryview)"""
+    return ptr+2, _UINT16.unpack_from(dat, ptr)[0]
+
+
+def _read_uint32(dat, ptr):
+    """Read 4-byte little endian integer at ptr of the buffer (bytes or memoryview)"""
+    return ptr+4, _UINT32.unpack_from(dat, ptr)[0]
+
+
+def _read_span(dat, ptr, n):
+    """Return a zero-copy view of n bytes at ptr (dat must be a memoryview)"""
+    return ptr+n, dat[ptr:ptr+n]
+
+
+def _read_bytes(dat, ptr, n):
+    """Materialize n bytes at ptr as a bytes object (leaf field)"""
+    return ptr+n, bytes(dat[ptr:ptr+n])
+
+
+def _read_bigint(dat, ptr):
+    """Materialize a length-prefixed id (see to_bigint) at ptr as a bytes object"""
+    ptr, size = _read_uint16(dat, ptr)
+    return _read_bytes(dat, ptr, size)
+
+
+def _get_struct(fmt):
+    """Return the precompiled struct.Struct for the format string (the layouts depend only on the id lengths)"""
+    st = _STRUCT_CACHE.get(fmt)
+    if st is None:
+        st = _STRUCT_CACHE[fmt] = struct.Struct(fmt)
+    return st
+
+
+def _pack_bytes(buf, ptr, val):
+    """Copy val into the pre-sized buffer at ptr"""
+    end = ptr+len(val)
+    buf[ptr:end] = val
+    return end
+
+
+def _pack_bigint(buf, ptr, val, size=32):
+    """Write a length-prefixed id (same layout as to_bigint) into the pre-sized buffer at ptr"""
+    _UINT16.pack_into(buf, ptr, size)
+    return _pack_bytes(buf, ptr+2, val)
+
+
+def _pack_part(buf, ptr, part, prefix=_UINT32, bodies=None):
+    """Write a part preceded by its length, which is filled in after the part has been written"""
+    start = ptr+prefix.size
+    end = part._pack_into(buf, start, bodies=bodies)
+    prefix.pack_into(buf, ptr, end-start)
+    return end
+
+
+def _serialize_part(part):
+    """Serialize a part (in FORMAT_BINARY) into a buffer of the exact size
+
+    The asset bodies encoded to size the buffer are kept in a dict local to the call (id(asset) -> encoded body),
+    so that they are packed as sized even if an asset is changed by another thread in the meantime.
+    """
+    bodies = dict()
+    buf = bytearray(part._binary_size(bodies=bodies))
+    part._pack_into(buf, 0, bodies=bodies)
+    return bytes(buf)
+
+
+_COMPACT_DELTA_TIMESTAMP = 0x01     # flag in FORMAT_COMPACT header: timestamp is a delta from timestamp_base
+
+
+def _write_varint(buf, val):
+    """Append an unsigned integer to buf in LEB128 varint"""
+    while val >= 0x80:
+        buf.append((val & 0x7f) | 0x80)
+        val >>= 7
+    buf.append(val)
+
+
+def _read_varint(dat, ptr):
+    """Read an unsigned LEB128 varint at ptr of the buffer"""
+    val = dat[ptr]
+    ptr += 1
+    if val < 0x80:
+        return ptr, val
+    val &= 0x7f
+    shift = 7
+    while True:
+        b = dat[ptr]
+        ptr += 1
+        val |= (b & 0x7f) << shift
+        if b < 0x80:
+            return ptr, val
+        shift += 7
+
+
+def _zigzag(val):
+    """Map a signed integer to an unsigned one so that small deltas become short varints"""
+    return val << 1 if val >= 0 else ((-val) << 1) - 1
+
+
+def _unzigzag(val):
+    return val >> 1 if not val & 1 else -((val + 1) >> 1)
+
+
+def _write_id(buf, val, id_length):
+    """Append an id whose length is implied by id_length in FORMAT_COMPACT"""
+    if len(val) != id_length:
+        raise ValueError("id length mismatch (%d != %d)" % (len(val), id_length))
+    buf += val
+
+
+def _write_blob(buf, val):
+    """Append a varint length and the value in FORMAT_COMPACT"""
+    _write_varint(buf, len(val))
+    buf += val
+
+
+def _read_blob(dat, ptr):
+    ptr, size = _read_varint(dat, ptr)
+    return _read_bytes(dat, ptr, size)
+
+
+def _write_compact_part(buf, part):
+    """Append a part preceded by its varint length in FORMAT_COMPACT"""
+    dat = bytearray()
+    part._pack_compact(dat)
+    _write_varint(buf, len(dat))
+    buf += dat
+
+
+def _read_compact_part(dat, ptr, part):
+    """Decode a part preceded by its varint length in FORMAT_COMPACT and return the position next to it"""
+    ptr, size = _read_varint(dat, ptr)
+    if part._unpack_compact(dat, ptr) != ptr+size:
+        raise ValueError("broken part in compact format")
+    return ptr+size
+
+
+def _compact_header(version, timestamp, id_length):
+    """Return the header of FORMAT_COMPACT (without format_type) in the canonical form used for the digest"""
+    dat = bytearray(1)
+    _write_varint(dat, version)
+    _write_varint(dat, timestamp)
+    _write_varint(dat, id_length)
+    return bytes(dat)
+
+
 def bin2str_base64(dat):
     import binascii
     return binascii.b2a_base64(dat, newline=False).decode("utf-8")
@@ -345,26 +687,49 @@ def verify_using_cross_ref(domain_id, transaction_id, transaction_base_digest, c
     Returns:
         bool: True if valid
     """
+    if format_type == BBcFormat.FORMAT_COMPACT:
+        # -- cross_ref_data and sigdata are the parts as they appear in the compact transaction data
+        cross = BBcCrossRef(format_type=format_type)
+        sig = BBcSignature(format_type=format_type)
+        cross._unpack_compact(memoryview(cross_ref_data), 0)
+        sig._unpack_compact(memoryview(sigdata), 0)
+        if cross.domain_id != domain_id or cross.transaction_id != transaction_id:
+            return False
+        dat = bytearray(transaction_base_digest)
+        dat.append(1)
+        _write_varint(dat, len(cross_ref_data))
+        dat.extend(cross_ref_data)
+        digest = hashlib.sha256(bytes(dat)).digest()
+        return sig.verify(digest) == 1
+
     if format_type in [BBcFormat.FORMAT_BSON_COMPRESS_BZ2, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2]:
         cross_ref_data = bz2.decompress(cross_ref_data)
     elif format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
         cross_ref_data = zlib.decompress(cross_ref_data)
+    elif format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZDICT, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+        cross_ref_data = _zdict_decompress(cross_ref_data)
+        if cross_ref_data is None:
+            return False
 
-    if format_type in [BBcFormat.FORMAT_BSON, BBcFormat.FORMAT_BSON_COMPRESS_BZ2, BBcFormat.FORMAT_BSON_COMPRESS_ZLIB]:
+    if format_type in [BBcFormat.FORMAT_BSON, BBcFormat.FORMAT_BSON_COMPRESS_BZ2, BBcFormat.FORMAT_BSON_COMPRESS_ZLIB,
+                       BBcFormat.FORMAT_BSON_COMPRESS_ZDICT]:
         cross_ref_data = bson.loads(cross_ref_data)
         sigdata = bson.loads(sigdata)
-    if format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-        cross_ref_data = msgpack.loads(cross_ref_data)
-        sigdata = msgpack.loads(sigdata)
+    if format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB,
+                       BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+        cross_ref_data = _msgpack_loads(cross_ref_data)
+        sigdata = _msgpack_loads(sigdata)
     cross = BBcCrossRef(deserialize=cross_ref_data, format_type=format_type)
     if cross.domain_id != domain_id or cross.transaction_id != transaction_id:
         return False
-    if format_type in [BBcFormat.FORMAT_BSON, BBcFormat.FORMAT_BSON_COMPRESS_BZ2, BBcFormat.FORMAT_BSON_COMPRESS_ZLIB]:
+    if format_type in [BBcFormat.FORMAT_BSON, BBcFormat.FORMAT_BSON_COMPRESS_BZ2, BBcFormat.FORMAT_BSON_COMPRESS_ZLIB,
+                       BBcFormat.FORMAT_BSON_COMPRESS_ZDICT]:
         dat = bson.dumps({
             "tx_base": transaction_base_digest,
             "cross_ref": cross_ref_data,
         })
-    elif format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
+    elif format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
+                         BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
         dat = msgpack.dumps({
             "tx_base": transaction_base_digest,
             "cross_ref": cross_ref_data,
@@ -491,12 +856,14 @@ class KeyPair:
 
 class BBcSignature:
     """Signature part in a transaction"""
+    __slots__ = ('format_type', 'key_type', 'signature', 'pubkey', '_keypair', 'not_initialized')
+
     def __init__(self, key_type=DEFAULT_CURVETYPE, deserialize=None, format_type=BBcFormat.FORMAT_BINARY):
         self.format_type = format_type
         self.key_type = key_type
         self.signature = None
         self.pubkey = None
-        self.keypair = None
+        self._keypair = None
         self.not_initialized = True
         if deserialize is not None:
             self.not_initialized = False
@@ -509,9 +876,20 @@ class BBcSignature:
             self.signature = signature
         if pubkey is not None:
             self.pubkey = pubkey
-            self.keypair = KeyPair(curvetype=self.key_type, pubkey=pubkey)
+            self._keypair = None
         return True
 
+    @property
+    def keypair(self):
+        """KeyPair object of pubkey (created on the first access)"""
+        if self._keypair is None and self.pubkey is not None:
+            self._keypair = KeyPair(curvetype=self.key_type, pubkey=self.pubkey)
+        return self._keypair
+
+    @keypair.setter
+    def keypair(self, keypair):
+        self._keypair = keypair
+
     def __str__(self):
         if self.not_initialized:
             return "  Not initialized\n"
@@ -524,17 +902,39 @@ class BBcSignature:
         """Serialize this object"""
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
         if self.not_initialized:
-            dat = bytearray(to_4byte(KeyType.NOT_INITIALIZED))
-            return bytes(dat)
-        dat = bytearray(to_4byte(self.key_type))
-        pubkey_len_bit = len(self.pubkey) * 8
-        dat.extend(to_4byte(pubkey_len_bit))
-        dat.extend(self.pubkey)
-        sig_len_bit = len(self.signature) * 8
-        dat.extend(to_4byte(sig_len_bit))
-        dat.extend(self.signature)
-        return bytes(dat)
+            return 4
+        return 12 + len(self.pubkey) + len(self.signature)
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        if self.not_initialized:
+            _UINT32.pack_into(buf, ptr, KeyType.NOT_INITIALIZED)
+            return ptr+4
+        _UINT32.pack_into(buf, ptr, self.key_type)
+        _UINT32.pack_into(buf, ptr+4, len(self.pubkey) * 8)
+        ptr = _pack_bytes(buf, ptr+8, self.pubkey)      # pubkey can be a ctypes array given by KeyPair
+        _UINT32.pack_into(buf, ptr, len(self.signature) * 8)
+        return _pack_bytes(buf, ptr+4, self.signature)
+
+    def _pack_compact(self, buf):
+        if self.not_initialized:
+            _write_varint(buf, KeyType.NOT_INITIALIZED)
+            return
+        _write_varint(buf, self.key_type)
+        _write_blob(buf, bytes(self.pubkey))
+        _write_blob(buf, self.signature)
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.key_type = _read_varint(dat, ptr)
+        if self.key_type == KeyType.NOT_INITIALIZED:
+            return ptr
+        ptr, pubkey = _read_blob(dat, ptr)
+        ptr, signature = _read_blob(dat, ptr)
+        self.add(signature=signature, pubkey=pubkey)
+        return ptr
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -546,17 +946,18 @@ class BBcSignature:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         try:
-            ptr, self.key_type = get_n_byte_int(ptr, 4, data)
+            ptr, self.key_type = _read_uint32(data, ptr)
             if self.key_type == KeyType.NOT_INITIALIZED:
                 return True
-            ptr, pubkey_len_bit = get_n_byte_int(ptr, 4, data)
+            ptr, pubkey_len_bit = _read_uint32(data, ptr)
             pubkey_len = int(pubkey_len_bit/8)
-            ptr, pubkey = get_n_bytes(ptr, pubkey_len, data)
-            ptr, sig_len_bit = get_n_byte_int(ptr, 4, data)
+            ptr, pubkey = _read_bytes(data, ptr, pubkey_len)
+            ptr, sig_len_bit = _read_uint32(data, ptr)
             sig_len = int(sig_len_bit/8)
-            ptr, signature = get_n_bytes(ptr, sig_len, data)
+            ptr, signature = _read_bytes(data, ptr, sig_len)
             self.add(signature=signature, pubkey=pubkey)
         except:
             return False
@@ -587,14 +988,9 @@ class BBcSignature:
         try:
             if self.key_type == KeyType.NOT_INITIALIZED:
                 return True
-            if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                    BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-                dat = deep_copy_with_key_stringify(obj)
-            else:
-                dat = obj
-            self.key_type = dat['key_type']
-            pubkey = dat['pubkey']
-            signature = dat['signature']
+            self.key_type = obj['key_type']
+            pubkey = obj['pubkey']
+            signature = obj['signature']
             self.add(signature=signature, pubkey=pubkey)
         except:
             return False
@@ -622,10 +1018,15 @@ class BBcSignature:
 
 class BBcTransaction:
     """Transaction object"""
+    __slots__ = ('format_type', 'id_length', 'version', 'timestamp', 'events', 'references', 'relations',
+                 'witness', 'cross_ref', 'signatures', 'userid_sigidx_mapping', 'transaction_id',
+                 'transaction_base_digest', 'transaction_data', 'asset_group_ids', 'zdict_id')
+
     def __init__(self, version=0, deserialize=None,
-                 format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
+                 format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN, zdict_id=None):
         self.format_type = format_type
         self.id_length = id_length
+        self.zdict_id = zdict_id
         self.version = version
         self.timestamp = int(time.time())
         self.events = []
@@ -750,84 +1151,107 @@ class BBcTransaction:
         self.transaction_id = d
         return d
 
-    def serialize(self, for_id=False):
-        """Serialize the whole parts"""
+    def serialize(self, for_id=False, timestamp_base=None):
+        """Serialize the whole parts
+
+        In FORMAT_BINARY, the whole transaction is written into a single buffer sized in advance,
+        and transaction_base_digest is calculated on a view of that buffer.
+
+        Args:
+            for_id (bool): True to return the data for transaction_id calculation (base digest + cross_ref part)
+            timestamp_base (int): FORMAT_COMPACT only. If given, timestamp is encoded as a delta from this value
+        Returns:
+            bytes: serialized data
+        """
+        if self.format_type == BBcFormat.FORMAT_COMPACT:
+            return self.serialize_compact(for_id, timestamp_base)
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.serialize_obj(for_id)
-        dat = bytearray(to_4byte(self.version))
-        dat.extend(to_8byte(self.timestamp))
-        dat.extend(to_2byte(self.id_length))
-        dat.extend(to_2byte(len(self.events)))
-        for i in range(len(self.events)):
-            evt = self.events[i].serialize()
-            dat.extend(to_4byte(len(evt)))
-            dat.extend(evt)
-        dat.extend(to_2byte(len(self.references)))
-        for i in range(len(self.references)):
-            refe = self.references[i].serialize()
-            dat.extend(to_4byte(len(refe)))
-            dat.extend(refe)
-        dat.extend(to_2byte(len(self.relations)))
-        for i in range(len(self.relations)):
-            rtn = self.relations[i].serialize()
-            dat.extend(to_4byte(len(rtn)))
-            dat.extend(rtn)
+        bodies = dict()  # -- asset bodies encoded by _binary_size() (see _serialize_part())
+        buf = bytearray(self._binary_size(for_id, bodies))
+        _TX_HEADER.pack_into(buf, 0, self.format_type, self.version, self.timestamp, self.id_length, len(self.events))
+        ptr = _TX_HEADER.size
+        for evt in self.events:
+            ptr = _pack_part(buf, ptr, evt, bodies=bodies)
+        _UINT16.pack_into(buf, ptr, len(self.references))
+        ptr += 2
+        for refe in self.references:
+            ptr = _pack_part(buf, ptr, refe)
+        _UINT16.pack_into(buf, ptr, len(self.relations))
+        ptr += 2
+        for rtn in self.relations:
+            ptr = _pack_part(buf, ptr, rtn, bodies=bodies)
         if self.witness is not None:
-            dat.extend(to_2byte(1))
-            witness = self.witness.serialize()
-            dat.extend(to_4byte(len(witness)))
-            dat.extend(witness)
+            _UINT16.pack_into(buf, ptr, 1)
+            ptr = _pack_part(buf, ptr+2, self.witness)
         else:
-            dat.extend(to_2byte(0))
-        self.transaction_base_digest = hashlib.sha256(dat).digest()
+            _UINT16.pack_into(buf, ptr, 0)
+            ptr += 2
+        base_end = ptr
+        with memoryview(buf) as view:
+            self.transaction_base_digest = hashlib.sha256(view[2:base_end]).digest()
 
-        dat_cross = bytearray()
         if self.cross_ref is not None:
-            cross = self.cross_ref.serialize()
-            dat_cross.extend(to_2byte(1))
-            dat_cross.extend(to_4byte(len(cross)))
-            dat_cross.extend(cross)
+            _UINT16.pack_into(buf, ptr, 1)
+            ptr = _pack_part(buf, ptr+2, self.cross_ref)
         else:
-            dat_cross.extend(to_2byte(0))
+            _UINT16.pack_into(buf, ptr, 0)
+            ptr += 2
 
         if for_id:
-            dat_for_id = bytearray(self.transaction_base_digest)
-            dat_for_id.extend(dat_cross)
-            return bytes(dat_for_id)
-
-        dat.extend(dat_cross)
+            return self.transaction_base_digest + bytes(buf[base_end:ptr])
 
-        dat.extend(to_2byte(len(self.signatures)))
+        _UINT16.pack_into(buf, ptr, len(self.signatures))
+        ptr += 2
         for signature in self.signatures:
-            sig = signature.serialize()
-            dat.extend(to_4byte(len(sig)))
-            dat.extend(sig)
-        self.transaction_data = bytes(to_2byte(self.format_type)+dat)
+            ptr = _pack_part(buf, ptr, signature)
+        self.transaction_data = bytes(buf)
         return self.transaction_data
 
-    def deserialize(self, data):
+    def _binary_size(self, for_id=False, bodies=None):
+        """Return the length of the serialized data in FORMAT_BINARY (the encoded asset bodies are put in bodies)"""
+        size = _TX_HEADER.size + 2 + 2 + 2 + 2
+        for part in self.events + self.references + self.relations:
+            size += 4 + part._binary_size(bodies=bodies)
+        if self.witness is not None:
+            size += 4 + self.witness._binary_size()
+        if self.cross_ref is not None:
+            size += 4 + self.cross_ref._binary_size()
+        if not for_id:
+            size += 2
+            for signature in self.signatures:
+                size += 4 + signature._binary_size()
+        return size
+
+    def deserialize(self, data, timestamp_base=None):
         """Deserialize into this object
 
+        Binary format data is decoded on a single memoryview with offsets, so only leaf fields
+        (ids, signatures, bodies) are copied out of the given buffer.
+
         Args:
             data (bytes): serialized binary data
+            timestamp_base (int): FORMAT_COMPACT only. Needed if the timestamp was encoded as a delta
         Returns:
             bool: True if successful
         """
-        self.transaction_data = data[:]
-        ptr = 0
-        ptr, self.format_type = get_n_byte_int(ptr, 2, data)
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self.transaction_data = data
+        ptr, self.format_type = get_n_byte_int(0, 2, data)
+        if self.format_type == BBcFormat.FORMAT_COMPACT:
+            return self.deserialize_compact(data, timestamp_base)
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data[2:])
+        data = memoryview(data)
         data_size = len(data)
         try:
-            ptr, self.version = get_n_byte_int(ptr, 4, data)
-            ptr, self.timestamp = get_n_byte_int(ptr, 8, data)
-            ptr, self.id_length = get_n_byte_int(ptr, 2, data)
-            ptr, evt_num = get_n_byte_int(ptr, 2, data)
+            _, self.version, self.timestamp, self.id_length, evt_num = _TX_HEADER.unpack_from(data, 0)
+            ptr = _TX_HEADER.size
             self.events = []
             for i in range(evt_num):
-                ptr, size = get_n_byte_int(ptr, 4, data)
-                ptr, evtdata = get_n_bytes(ptr, size, data)
+                ptr, size = _read_uint32(data, ptr)
+                ptr, evtdata = _read_span(data, ptr, size)
                 evt = BBcEvent(id_length=self.id_length)
                 if not evt.deserialize(evtdata):
                     return False
@@ -836,11 +1260,11 @@ class BBcTransaction:
                     return False
                 self.asset_group_ids[evt.asset.asset_id] = evt.asset_group_id
 
-            ptr, ref_num = get_n_byte_int(ptr, 2, data)
+            ptr, ref_num = _read_uint16(data, ptr)
             self.references = []
             for i in range(ref_num):
-                ptr, size = get_n_byte_int(ptr, 4, data)
-                ptr, refdata = get_n_bytes(ptr, size, data)
+                ptr, size = _read_uint32(data, ptr)
+                ptr, refdata = _read_span(data, ptr, size)
                 refe = BBcReference(None, None, id_length=self.id_length)
                 if not refe.deserialize(refdata):
                     return False
@@ -848,11 +1272,11 @@ class BBcTransaction:
                 if ptr >= data_size:
                     return False
 
-            ptr, rtn_num = get_n_byte_int(ptr, 2, data)
+            ptr, rtn_num = _read_uint16(data, ptr)
             self.relations = []
             for i in range(rtn_num):
-                ptr, size = get_n_byte_int(ptr, 4, data)
-                ptr, rtndata = get_n_bytes(ptr, size, data)
+                ptr, size = _read_uint32(data, ptr)
+                ptr, rtndata = _read_span(data, ptr, size)
                 rtn = BBcRelation(id_length=self.id_length)
                 if not rtn.deserialize(rtndata):
                     return False
@@ -861,40 +1285,186 @@ class BBcTransaction:
                     return False
                 self.asset_group_ids[rtn.asset.asset_id] = rtn.asset_group_id
 
-            ptr, witness_num = get_n_byte_int(ptr, 2, data)
+            ptr, witness_num = _read_uint16(data, ptr)
             if witness_num == 0:
                 self.witness = None
             else:
-                ptr, size = get_n_byte_int(ptr, 4, data)
-                ptr, witnessdata = get_n_bytes(ptr, size, data)
+                ptr, size = _read_uint32(data, ptr)
+                ptr, witnessdata = _read_span(data, ptr, size)
                 self.witness = BBcWitness(id_length=self.id_length)
                 self.witness.transaction = self
                 if not self.witness.deserialize(witnessdata):
                     return False
+            base_end = ptr
 
-            ptr, cross_num = get_n_byte_int(ptr, 2, data)
+            ptr, cross_num = _read_uint16(data, ptr)
             if cross_num == 0:
                 self.cross_ref = None
             else:
-                ptr, size = get_n_byte_int(ptr, 4, data)
-                ptr, crossdata = get_n_bytes(ptr, size, data)
+                ptr, size = _read_uint32(data, ptr)
+                ptr, crossdata = _read_span(data, ptr, size)
                 self.cross_ref = BBcCrossRef()
                 if not self.cross_ref.deserialize(crossdata):
                     return False
+            cross_end = ptr
 
-            ptr, sig_num = get_n_byte_int(ptr, 2, data)
+            ptr, sig_num = _read_uint16(data, ptr)
             self.signatures = []
             for i in range(sig_num):
-                ptr, size = get_n_byte_int(ptr, 4, data)
+                ptr, size = _read_uint32(data, ptr)
                 sig = BBcSignature()
+                ptr, sigdata = _read_span(data, ptr, size)
                 if size > 4:
-                    ptr, sigdata = get_n_bytes(ptr, size, data)
                     if not sig.deserialize(sigdata):
                         return False
                 self.signatures.append(sig)
                 if ptr > data_size:
                     return False
-            self.digest()
+
+            # -- the digest is taken over the received bytes, so the transaction is not re-serialized here
+            self.transaction_base_digest = hashlib.sha256(data[2:base_end]).digest()
+            target = self.transaction_base_digest + bytes(data[base_end:cross_end])
+            self.transaction_id = hashlib.sha256(target).digest()[:self.id_length]
+        except Exception as e:
+            print("Transaction data deserialize: %s" % e)
+            print(traceback.format_exc())
+            return False
+        return True
+
+    def serialize_compact(self, for_id=False, timestamp_base=None):
+        """Serialize the whole parts in FORMAT_COMPACT
+
+        The layout follows FORMAT_BINARY, but counts and lengths are LEB128 varints and ids have no
+        length prefix (the length is id_length in the header). The header is
+        format_type(2 bytes), flags(1 byte), version, timestamp and id_length. If timestamp_base is given,
+        the timestamp is stored as a zigzag varint delta from it and the flag is set.
+
+        transaction_base_digest is the sha256 of the header (in the canonical form with absolute timestamp)
+        and the events, references, relations and witness parts. transaction_id is calculated from it and
+        the cross_ref part in the same way as FORMAT_BINARY, so it does not depend on timestamp_base.
+
+        Args:
+            for_id (bool): True to return the data for transaction_id calculation (base digest + cross_ref part)
+            timestamp_base (int): base timestamp for delta encoding
+        Returns:
+            bytes: serialized data
+        """
+        header = _compact_header(self.version, self.timestamp, self.id_length)
+        buf = bytearray(to_2byte(self.format_type))
+        if timestamp_base is None or for_id:
+            buf += header
+        else:
+            buf.append(_COMPACT_DELTA_TIMESTAMP)
+            _write_varint(buf, self.version)
+            _write_varint(buf, _zigzag(self.timestamp - timestamp_base))
+            _write_varint(buf, self.id_length)
+        header_end = len(buf)
+        for parts in (self.events, self.references, self.relations):
+            _write_varint(buf, len(parts))
+            for part in parts:
+                _write_compact_part(buf, part)
+        if self.witness is None:
+            buf.append(0)
+        else:
+            buf.append(1)
+            _write_compact_part(buf, self.witness)
+        base_end = len(buf)
+        digest = hashlib.sha256(header)
+        with memoryview(buf) as view:
+            digest.update(view[header_end:base_end])
+        self.transaction_base_digest = digest.digest()
+
+        if self.cross_ref is None:
+            buf.append(0)
+        else:
+            buf.append(1)
+            _write_compact_part(buf, self.cross_ref)
+        if for_id:
+            return self.transaction_base_digest + bytes(buf[base_end:])
+
+        _write_varint(buf, len(self.signatures))
+        for signature in self.signatures:
+            _write_compact_part(buf, signature)
+        self.transaction_data = bytes(buf)
+        return self.transaction_data
+
+    def deserialize_compact(self, data, timestamp_base=None):
+        """Deserialize FORMAT_COMPACT data into this object (see serialize_compact for the layout)
+
+        Args:
+            data (bytes): serialized data including the format_type header
+            timestamp_base (int): base timestamp if the timestamp was encoded as a delta
+        Returns:
+            bool: True if successful
+        """
+        dat = memoryview(data)
+        try:
+            flags = dat[2]
+            ptr, self.version = _read_varint(dat, 3)
+            ptr, timestamp = _read_varint(dat, ptr)
+            ptr, self.id_length = _read_varint(dat, ptr)
+            if flags & _COMPACT_DELTA_TIMESTAMP:
+                if timestamp_base is None:
+                    return False
+                timestamp = timestamp_base + _unzigzag(timestamp)
+            self.timestamp = timestamp
+            header_end = ptr
+
+            ptr, evt_num = _read_varint(dat, ptr)
+            self.events = []
+            for i in range(evt_num):
+                evt = BBcEvent(format_type=self.format_type, id_length=self.id_length)
+                ptr = _read_compact_part(dat, ptr, evt)
+                self.events.append(evt)
+                self.asset_group_ids[evt.asset.asset_id] = evt.asset_group_id
+
+            ptr, ref_num = _read_varint(dat, ptr)
+            self.references = []
+            for i in range(ref_num):
+                refe = BBcReference(None, None, format_type=self.format_type, id_length=self.id_length)
+                ptr = _read_compact_part(dat, ptr, refe)
+                self.references.append(refe)
+
+            ptr, rtn_num = _read_varint(dat, ptr)
+            self.relations = []
+            for i in range(rtn_num):
+                rtn = BBcRelation(format_type=self.format_type, id_length=self.id_length)
+                ptr = _read_compact_part(dat, ptr, rtn)
+                self.relations.append(rtn)
+                if rtn.asset is not None:
+                    self.asset_group_ids[rtn.asset.asset_id] = rtn.asset_group_id
+
+            self.witness = None
+            if dat[ptr] == 1:
+                self.witness = BBcWitness(format_type=self.format_type, id_length=self.id_length)
+                self.witness.transaction = self
+                ptr = _read_compact_part(dat, ptr+1, self.witness)
+            else:
+                ptr += 1
+            base_end = ptr
+
+            self.cross_ref = None
+            if dat[ptr] == 1:
+                self.cross_ref = BBcCrossRef(format_type=self.format_type)
+                ptr = _read_compact_part(dat, ptr+1, self.cross_ref)
+            else:
+                ptr += 1
+            cross_end = ptr
+
+            ptr, sig_num = _read_varint(dat, ptr)
+            self.signatures = []
+            for i in range(sig_num):
+                sig = BBcSignature(format_type=self.format_type)
+                ptr = _read_compact_part(dat, ptr, sig)
+                self.signatures.append(sig)
+            if ptr != len(dat):
+                return False
+
+            digest = hashlib.sha256(_compact_header(self.version, self.timestamp, self.id_length))
+            digest.update(dat[header_end:base_end])
+            self.transaction_base_digest = digest.digest()
+            target = self.transaction_base_digest + bytes(dat[base_end:cross_end])
+            self.transaction_id = hashlib.sha256(target).digest()[:self.id_length]
         except Exception as e:
             print("Transaction data deserialize: %s" % e)
             print(traceback.format_exc())
@@ -924,13 +1494,13 @@ class BBcTransaction:
             "witness": witness,
         }
         if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
+                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
             self.transaction_base_digest = hashlib.sha256(msgpack.dumps(tx_base)).digest()
         else:
             self.transaction_base_digest = hashlib.sha256(bson.dumps(tx_base)).digest()
         if for_id:
             if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                    BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
+                                    BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
                 return msgpack.dumps({
                     "tx_base": self.transaction_base_digest,
                     "cross_ref": tx_crossref,
@@ -943,7 +1513,7 @@ class BBcTransaction:
         tx_base.update({"cross_ref": tx_crossref})
 
         if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
+                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
             dat = msgpack.dumps({
                 "transaction_base": tx_base,
                 "signatures": [sig.serialize() for sig in self.signatures],
@@ -957,6 +1527,12 @@ class BBcTransaction:
             dat = bz2.compress(dat, compresslevel=1)
         elif self.format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
             dat = zlib.compress(dat)
+        elif self.format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZDICT, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+            if self.zdict_id is None:
+                self.zdict_id = _zdict_default_id
+            dat = _zdict_compress(dat, self.zdict_id)
+            if dat is None:
+                return None
         if no_header:
             return dat
         self.transaction_data = bytes(to_2byte(self.format_type) + dat)
@@ -974,10 +1550,15 @@ class BBcTransaction:
             data = bz2.decompress(data)
         elif self.format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
             data = zlib.decompress(data)
+        elif self.format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZDICT, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+            self.zdict_id = get_zdict_id(data)
+            data = _zdict_decompress(data)
+            if data is None:
+                return False
 
         if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            datobj = deep_copy_with_key_stringify(msgpack.loads(data))
+                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+            datobj = _msgpack_loads(data)
         else:
             datobj = bson.loads(data)
         tx_base = datobj["transaction_base"]
@@ -1054,6 +1635,9 @@ class BBcTransaction:
 
 class BBcEvent:
     """Event part in a transaction"""
+    __slots__ = ('format_type', 'id_length', 'asset_group_id', 'reference_indices', 'mandatory_approvers',
+                 'option_approver_num_numerator', 'option_approver_num_denominator', 'option_approvers', 'asset')
+
     def __init__(self, asset_group_id=None, format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
         self.format_type = format_type
         self.id_length = id_length
@@ -1115,21 +1699,64 @@ class BBcEvent:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
-        dat = bytearray(to_bigint(self.asset_group_id, size=self.id_length))
-        dat.extend(to_2byte(len(self.reference_indices)))
-        for i in range(len(self.reference_indices)):
-            dat.extend(to_2byte(self.reference_indices[i]))
-        dat.extend(to_2byte(len(self.mandatory_approvers)))
-        for i in range(len(self.mandatory_approvers)):
-            dat.extend(to_bigint(self.mandatory_approvers[i], size=self.id_length))
-        dat.extend(to_2byte(self.option_approver_num_numerator))
-        dat.extend(to_2byte(self.option_approver_num_denominator))
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
+        size = 2 + len(self.asset_group_id) + 2 + 2 * len(self.reference_indices) + 2 + 2 + 2 + 4
+        for user in self.mandatory_approvers:
+            size += 2 + len(user)
+        for i in range(self.option_approver_num_denominator):
+            size += 2 + len(self.option_approvers[i])
+        return size + self.asset._binary_size(bodies=bodies)
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        st = _get_struct('<H%dsH%dHH' % (len(self.asset_group_id), len(self.reference_indices)))
+        st.pack_into(buf, ptr, self.id_length, self.asset_group_id, len(self.reference_indices),
+                     *self.reference_indices, len(self.mandatory_approvers))
+        ptr += st.size
+        for user in self.mandatory_approvers:
+            ptr = _pack_bigint(buf, ptr, user, size=self.id_length)
+        _UINT16.pack_into(buf, ptr, self.option_approver_num_numerator)
+        _UINT16.pack_into(buf, ptr+2, self.option_approver_num_denominator)
+        ptr += 4
         for i in range(self.option_approver_num_denominator):
-            dat.extend(to_bigint(self.option_approvers[i], size=self.id_length))
-        ast = self.asset.serialize()
-        dat.extend(to_4byte(len(ast)))
-        dat.extend(ast)
-        return bytes(dat)
+            ptr = _pack_bigint(buf, ptr, self.option_approvers[i], size=self.id_length)
+        return _pack_part(buf, ptr, self.asset, bodies=bodies)
+
+    def _pack_compact(self, buf):
+        _write_id(buf, self.asset_group_id, self.id_length)
+        _write_varint(buf, len(self.reference_indices))
+        for idx in self.reference_indices:
+            _write_varint(buf, idx)
+        _write_varint(buf, len(self.mandatory_approvers))
+        for user in self.mandatory_approvers:
+            _write_id(buf, user, self.id_length)
+        _write_varint(buf, self.option_approver_num_numerator)
+        _write_varint(buf, self.option_approver_num_denominator)
+        for i in range(self.option_approver_num_denominator):
+            _write_id(buf, self.option_approvers[i], self.id_length)
+        self.asset._pack_compact(buf)
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.asset_group_id = _read_bytes(dat, ptr, self.id_length)
+        ptr, num = _read_varint(dat, ptr)
+        self.reference_indices = []
+        for i in range(num):
+            ptr, idx = _read_varint(dat, ptr)
+            self.reference_indices.append(idx)
+        ptr, num = _read_varint(dat, ptr)
+        self.mandatory_approvers = []
+        for i in range(num):
+            ptr, user = _read_bytes(dat, ptr, self.id_length)
+            self.mandatory_approvers.append(user)
+        ptr, self.option_approver_num_numerator = _read_varint(dat, ptr)
+        ptr, self.option_approver_num_denominator = _read_varint(dat, ptr)
+        self.option_approvers = []
+        for i in range(self.option_approver_num_denominator):
+            ptr, user = _read_bytes(dat, ptr, self.id_length)
+            self.option_approvers.append(user)
+        self.asset = BBcAsset(format_type=self.format_type, id_length=self.id_length)
+        return self.asset._unpack_compact(dat, ptr)
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -1141,34 +1768,35 @@ class BBcEvent:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         data_size = len(data)
         try:
-            ptr, self.asset_group_id = get_bigint(ptr, data)
-            ptr, ref_num = get_n_byte_int(ptr, 2, data)
+            ptr, self.asset_group_id = _read_bigint(data, ptr)
+            ptr, ref_num = _read_uint16(data, ptr)
             self.reference_indices = []
             for i in range(ref_num):
-                ptr, idx = get_n_byte_int(ptr, 2, data)
+                ptr, idx = _read_uint16(data, ptr)
                 self.reference_indices.append(idx)
                 if ptr >= data_size:
                     return False
-            ptr, appr_num = get_n_byte_int(ptr, 2, data)
+            ptr, appr_num = _read_uint16(data, ptr)
             self.mandatory_approvers = []
             for i in range(appr_num):
-                ptr, appr = get_bigint(ptr, data)
+                ptr, appr = _read_bigint(data, ptr)
                 self.mandatory_approvers.append(appr)
                 if ptr >= data_size:
                     return False
-            ptr, self.option_approver_num_numerator = get_n_byte_int(ptr, 2, data)
-            ptr, self.option_approver_num_denominator = get_n_byte_int(ptr, 2, data)
+            ptr, self.option_approver_num_numerator = _read_uint16(data, ptr)
+            ptr, self.option_approver_num_denominator = _read_uint16(data, ptr)
             self.option_approvers = []
             for i in range(self.option_approver_num_denominator):
-                ptr, appr = get_bigint(ptr, data)
+                ptr, appr = _read_bigint(data, ptr)
                 self.option_approvers.append(appr)
                 if ptr >= data_size:
                     return False
-            ptr, astsize = get_n_byte_int(ptr, 4, data)
-            ptr, astdata = get_n_bytes(ptr, astsize, data)
+            ptr, astsize = _read_uint32(data, ptr)
+            ptr, astdata = _read_span(data, ptr, astsize)
             self.asset = BBcAsset(id_length=self.id_length)
             self.asset.deserialize(astdata)
         except:
@@ -1199,11 +1827,7 @@ class BBcEvent:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.asset_group_id = data.get('asset_group_id', None)
         self.reference_indices = data.get('reference_indices', [])
@@ -1222,6 +1846,9 @@ class BBcEvent:
 
 class BBcReference:
     """Reference part in a transaction"""
+    __slots__ = ('format_type', 'id_length', 'asset_group_id', 'transaction_id', 'transaction', 'ref_transaction',
+                 'event_index_in_ref', 'sig_indices', 'mandatory_approvers', 'option_approvers', 'option_sig_ids')
+
     def __init__(self, asset_group_id, transaction, ref_transaction=None, event_index_in_ref=0,
                  format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
         self.format_type = format_type
@@ -1296,13 +1923,36 @@ class BBcReference:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
-        dat = bytearray(to_bigint(self.asset_group_id, size=self.id_length))
-        dat.extend(to_bigint(self.transaction_id, size=self.id_length))
-        dat.extend(to_2byte(self.event_index_in_ref))
-        dat.extend(to_2byte(len(self.sig_indices)))
-        for i in range(len(self.sig_indices)):
-            dat.extend(to_2byte(self.sig_indices[i]))
-        return bytes(dat)
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
+        return 2 + len(self.asset_group_id) + 2 + len(self.transaction_id) + 2 + 2 + 2 * len(self.sig_indices)
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        st = _get_struct('<H%dsH%dsHH%dH' % (len(self.asset_group_id), len(self.transaction_id),
+                                              len(self.sig_indices)))
+        st.pack_into(buf, ptr, self.id_length, self.asset_group_id, self.id_length, self.transaction_id,
+                     self.event_index_in_ref, len(self.sig_indices), *self.sig_indices)
+        return ptr+st.size
+
+    def _pack_compact(self, buf):
+        _write_id(buf, self.asset_group_id, self.id_length)
+        _write_id(buf, self.transaction_id, self.id_length)
+        _write_varint(buf, self.event_index_in_ref)
+        _write_varint(buf, len(self.sig_indices))
+        for idx in self.sig_indices:
+            _write_varint(buf, idx)
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.asset_group_id = _read_bytes(dat, ptr, self.id_length)
+        ptr, self.transaction_id = _read_bytes(dat, ptr, self.id_length)
+        ptr, self.event_index_in_ref = _read_varint(dat, ptr)
+        ptr, num = _read_varint(dat, ptr)
+        self.sig_indices = []
+        for i in range(num):
+            ptr, idx = _read_varint(dat, ptr)
+            self.sig_indices.append(idx)
+        return ptr
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -1314,16 +1964,17 @@ class BBcReference:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         data_size = len(data)
         try:
-            ptr, self.asset_group_id = get_bigint(ptr, data)
-            ptr, self.transaction_id = get_bigint(ptr, data)
-            ptr, self.event_index_in_ref = get_n_byte_int(ptr, 2, data)
-            ptr, signum = get_n_byte_int(ptr, 2, data)
+            ptr, self.asset_group_id = _read_bigint(data, ptr)
+            ptr, self.transaction_id = _read_bigint(data, ptr)
+            ptr, self.event_index_in_ref = _read_uint16(data, ptr)
+            ptr, signum = _read_uint16(data, ptr)
             self.sig_indices = []
             for i in range(signum):
-                ptr, idx = get_n_byte_int(ptr, 2, data)
+                ptr, idx = _read_uint16(data, ptr)
                 self.sig_indices.append(idx)
                 if ptr > data_size:
                     return False
@@ -1348,11 +1999,7 @@ class BBcReference:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.asset_group_id = data.get('asset_group_id', None)
         self.transaction_id = data.get('transaction_id', None)
@@ -1363,6 +2010,8 @@ class BBcReference:
 
 class BBcRelation:
     """Relation part in a transaction"""
+    __slots__ = ('format_type', 'id_length', 'asset_group_id', 'pointers', 'asset')
+
     def __init__(self, asset_group_id=None, format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
         self.format_type = format_type
         self.id_length = id_length
@@ -1404,19 +2053,53 @@ class BBcRelation:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
-        dat = bytearray(to_bigint(self.asset_group_id, size=self.id_length))
-        dat.extend(to_2byte(len(self.pointers)))
-        for i in range(len(self.pointers)):
-            pt = self.pointers[i].serialize()
-            dat.extend(to_2byte(len(pt)))
-            dat.extend(pt)
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
+        size = 2 + len(self.asset_group_id) + 2 + 4
+        for pt in self.pointers:
+            size += 2 + pt._binary_size()
+        if self.asset is not None:
+            size += self.asset._binary_size(bodies=bodies)
+        return size
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        st = _get_struct('<H%dsH' % len(self.asset_group_id))
+        st.pack_into(buf, ptr, self.id_length, self.asset_group_id, len(self.pointers))
+        ptr += st.size
+        for pt in self.pointers:
+            end = pt._pack_into(buf, ptr+2)
+            _UINT16.pack_into(buf, ptr, end-ptr-2)
+            ptr = end
         if self.asset is not None:
-            ast = self.asset.serialize()
-            dat.extend(to_4byte(len(ast)))
-            dat.extend(ast)
+            return _pack_part(buf, ptr, self.asset, bodies=bodies)
+        _UINT32.pack_into(buf, ptr, 0)
+        return ptr+4
+
+    def _pack_compact(self, buf):
+        _write_id(buf, self.asset_group_id, self.id_length)
+        _write_varint(buf, len(self.pointers))
+        for pt in self.pointers:
+            pt._pack_compact(buf)
+        if self.asset is None:
+            buf.append(0)
         else:
-            dat.extend(to_4byte(0))
-        return bytes(dat)
+            buf.append(1)
+            self.asset._pack_compact(buf)
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.asset_group_id = _read_bytes(dat, ptr, self.id_length)
+        ptr, num = _read_varint(dat, ptr)
+        self.pointers = list()
+        for i in range(num):
+            pt = BBcPointer(format_type=self.format_type, id_length=self.id_length)
+            ptr = pt._unpack_compact(dat, ptr)
+            self.pointers.append(pt)
+        self.asset = None
+        if dat[ptr] == 0:
+            return ptr+1
+        self.asset = BBcAsset(format_type=self.format_type, id_length=self.id_length)
+        return self.asset._unpack_compact(dat, ptr+1)
 
     def deserialize(self, data):
         """Deserialize bson data into this object
@@ -1428,26 +2111,27 @@ class BBcRelation:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         data_size = len(data)
         try:
-            ptr, self.asset_group_id = get_bigint(ptr, data)
-            ptr, pt_num = get_n_byte_int(ptr, 2, data)
+            ptr, self.asset_group_id = _read_bigint(data, ptr)
+            ptr, pt_num = _read_uint16(data, ptr)
             self.pointers = list()
             for i in range(pt_num):
-                ptr, size = get_n_byte_int(ptr, 2, data)
-                ptr, ptdata = get_n_bytes(ptr, size, data)
+                ptr, size = _read_uint16(data, ptr)
+                ptr, ptdata = _read_span(data, ptr, size)
                 if ptr >= data_size:
                     return False
-                pt = BBcPointer()
+                pt = BBcPointer(id_length=self.id_length)
                 if not pt.deserialize(ptdata):
                     return False
                 self.pointers.append(pt)
             self.asset = None
-            ptr, astsize = get_n_byte_int(ptr, 4, data)
+            ptr, astsize = _read_uint32(data, ptr)
             if astsize > 0:
                 self.asset = BBcAsset(id_length=self.id_length)
-                ptr, astdata = get_n_bytes(ptr, astsize, data)
+                ptr, astdata = _read_span(data, ptr, astsize)
                 if not self.asset.deserialize(astdata):
                     return False
         except:
@@ -1474,11 +2158,7 @@ class BBcRelation:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.asset_group_id = data.get('asset_group_id', None)
         for ptrdat in data.get('pointers', []):
@@ -1496,6 +2176,8 @@ class BBcRelation:
 
 class BBcPointer:
     """Pointer part in a transaction"""
+    __slots__ = ('format_type', 'id_length', 'transaction_id', 'asset_id')
+
     def __init__(self, transaction_id=None, asset_id=None, format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
         self.format_type = format_type
         self.id_length = id_length
@@ -1528,13 +2210,37 @@ class BBcPointer:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
-        dat = bytearray(to_bigint(self.transaction_id, size=self.id_length))
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
         if self.asset_id is None:
-            dat.extend(to_2byte(0))
+            return 2 + len(self.transaction_id) + 2
+        return 2 + len(self.transaction_id) + 2 + 2 + len(self.asset_id)
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        if self.asset_id is None:
+            st = _get_struct('<H%dsH' % len(self.transaction_id))
+            st.pack_into(buf, ptr, self.id_length, self.transaction_id, 0)
         else:
-            dat.extend(to_2byte(1))
-            dat.extend(to_bigint(self.asset_id, size=self.id_length))
-        return bytes(dat)
+            st = _get_struct('<H%dsHH%ds' % (len(self.transaction_id), len(self.asset_id)))
+            st.pack_into(buf, ptr, self.id_length, self.transaction_id, 1, self.id_length, self.asset_id)
+        return ptr+st.size
+
+    def _pack_compact(self, buf):
+        _write_id(buf, self.transaction_id, self.id_length)
+        if self.asset_id is None:
+            buf.append(0)
+        else:
+            buf.append(1)
+            _write_id(buf, self.asset_id, self.id_length)
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.transaction_id = _read_bytes(dat, ptr, self.id_length)
+        if dat[ptr] == 0:
+            self.asset_id = None
+            return ptr+1
+        ptr, self.asset_id = _read_bytes(dat, ptr+1, self.id_length)
+        return ptr
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -1546,12 +2252,13 @@ class BBcPointer:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         try:
-            ptr, self.transaction_id = get_bigint(ptr, data)
-            ptr, num = get_n_byte_int(ptr, 2, data)
+            ptr, self.transaction_id = _read_bigint(data, ptr)
+            ptr, num = _read_uint16(data, ptr)
             if num == 1:
-                ptr, self.asset_id = get_bigint(ptr, data)
+                ptr, self.asset_id = _read_bigint(data, ptr)
             else:
                 self.asset_id = None
         except:
@@ -1573,11 +2280,7 @@ class BBcPointer:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.transaction_id = data.get('transaction_id', None)
         self.asset_id = data.get('asset_id', None)
@@ -1586,6 +2289,8 @@ class BBcPointer:
 
 class BBcWitness:
     """Witness part in a transaction"""
+    __slots__ = ('format_type', 'id_length', 'transaction', 'user_ids', 'sig_indices')
+
     def __init__(self, format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
         self.format_type = format_type
         self.id_length = id_length
@@ -1628,11 +2333,39 @@ class BBcWitness:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
-        dat = bytearray(to_2byte(len(self.sig_indices)))
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
+        size = 2
+        for i in range(len(self.sig_indices)):
+            size += 2 + len(self.user_ids[i]) + 2
+        return size
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        _UINT16.pack_into(buf, ptr, len(self.sig_indices))
+        ptr += 2
         for i in range(len(self.sig_indices)):
-            dat.extend(to_bigint(self.user_ids[i], size=self.id_length))
-            dat.extend(to_2byte(self.sig_indices[i]))
-        return bytes(dat)
+            st = _get_struct('<H%dsH' % len(self.user_ids[i]))
+            st.pack_into(buf, ptr, self.id_length, self.user_ids[i], self.sig_indices[i])
+            ptr += st.size
+        return ptr
+
+    def _pack_compact(self, buf):
+        _write_varint(buf, len(self.sig_indices))
+        for i in range(len(self.sig_indices)):
+            _write_id(buf, self.user_ids[i], self.id_length)
+            _write_varint(buf, self.sig_indices[i])
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, num = _read_varint(dat, ptr)
+        self.user_ids = list()
+        self.sig_indices = list()
+        for i in range(num):
+            ptr, uid = _read_bytes(dat, ptr, self.id_length)
+            self.user_ids.append(uid)
+            ptr, idx = _read_varint(dat, ptr)
+            self.sig_indices.append(idx)
+        return ptr
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -1644,16 +2377,17 @@ class BBcWitness:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         data_size = len(data)
         try:
-            ptr, signum = get_n_byte_int(ptr, 2, data)
+            ptr, signum = _read_uint16(data, ptr)
             self.user_ids = list()
             self.sig_indices = list()
             for i in range(signum):
-                ptr, uid = get_bigint(ptr, data)
+                ptr, uid = _read_bigint(data, ptr)
                 self.user_ids.append(uid)
-                ptr, idx = get_n_byte_int(ptr, 2, data)
+                ptr, idx = _read_uint16(data, ptr)
                 self.sig_indices.append(idx)
                 if ptr > data_size:
                     return False
@@ -1676,11 +2410,7 @@ class BBcWitness:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.user_ids = data.get('user_ids', [])
         self.sig_indices = data.get('sig_indices', [])
@@ -1691,6 +2421,9 @@ class BBcWitness:
 
 class BBcAsset:
     """Asset part in a transaction"""
+    __slots__ = ('id_length', 'format_type', 'asset_id', 'user_id', 'nonce', 'asset_file_size', 'asset_file',
+                 'asset_file_digest', 'asset_body_size', 'asset_body')
+
     def __init__(self, user_id=None, asset_file=None, asset_body=None,
                  format_type=BBcFormat.FORMAT_BINARY, id_length=DEFAULT_ID_LEN):
         self.id_length = id_length
@@ -1777,43 +2510,85 @@ class BBcAsset:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict(for_digest_calculation=for_digest_calculation)
+        bodies = dict()  # -- the body encoded by _binary_size() (see _serialize_part())
+        buf = bytearray(self._binary_size(for_digest_calculation, bodies))
+        self._pack_into(buf, 0, for_digest_calculation, bodies)
+        return bytes(buf)
+
+    def _get_body_for_binary(self):
+        """Return the asset_body type flag, the declared size and the content in FORMAT_BINARY"""
+        if isinstance(self.asset_body, dict):
+            astbdy = bson.dumps(self.asset_body)
+            return 1, len(astbdy), astbdy
+        if self.asset_body_size > 0:
+            return 0, self.asset_body_size, self.asset_body
+        return 0, self.asset_body_size, b''
+
+    def _binary_size(self, for_digest_calculation=False, bodies=None):
+        size = 2 + len(self.user_id) + 2 + len(self.nonce) + 4 + 2 + 2
+        if not for_digest_calculation:
+            size += 2 + len(self.asset_id)
+        if self.asset_file_size > 0:
+            size += len(self.asset_file_digest)
+            if not for_digest_calculation:
+                size += 2
+        body = self._get_body_for_binary()
+        if bodies is not None:
+            bodies[id(self)] = body
+        return size + len(body[2])
+
+    def _pack_into(self, buf, ptr, for_digest_calculation=False, bodies=None):
         if for_digest_calculation:
-            dat = bytearray(to_bigint(self.user_id, size=self.id_length))
-            dat.extend(to_2byte(len(self.nonce)))
-            dat.extend(self.nonce)
-            dat.extend(to_4byte(self.asset_file_size))
-            if self.asset_file_size > 0:
-                dat.extend(self.asset_file_digest)
-            if isinstance(self.asset_body, dict):
-                dat.extend(to_2byte(1))
-                astbdy = bson.dumps(self.asset_body)
-                dat.extend(to_2byte(len(astbdy)))
-                dat.extend(astbdy)
-            else:
-                dat.extend(to_2byte(0))
-                dat.extend(to_2byte(self.asset_body_size))
-                if self.asset_body_size > 0:
-                    dat.extend(self.asset_body)
-            return bytes(dat)
+            st = _get_struct('<H%dsH%dsI' % (len(self.user_id), len(self.nonce)))
+            st.pack_into(buf, ptr, self.id_length, self.user_id, len(self.nonce), self.nonce, self.asset_file_size)
         else:
-            dat = bytearray(to_bigint(self.asset_id, size=self.id_length))
-            dat.extend(to_bigint(self.user_id, size=self.id_length))
-            dat.extend(to_2byte(len(self.nonce)))
-            dat.extend(self.nonce)
-            dat.extend(to_4byte(self.asset_file_size))
-            if self.asset_file_size > 0:
-                dat.extend(to_bigint(self.asset_file_digest, size=self.id_length))
-            if isinstance(self.asset_body, dict):
-                dat.extend(to_2byte(1))
-                astbdy = bson.dumps(self.asset_body)
-                dat.extend(to_2byte(len(astbdy)))
-                dat.extend(astbdy)
+            st = _get_struct('<H%dsH%dsH%dsI' % (len(self.asset_id), len(self.user_id), len(self.nonce)))
+            st.pack_into(buf, ptr, self.id_length, self.asset_id, self.id_length, self.user_id,
+                         len(self.nonce), self.nonce, self.asset_file_size)
+        ptr += st.size
+        if self.asset_file_size > 0:
+            if for_digest_calculation:
+                ptr = _pack_bytes(buf, ptr, self.asset_file_digest)
             else:
-                dat.extend(to_2byte(0))
-                dat.extend(to_2byte(self.asset_body_size))
-                if self.asset_body_size > 0:
-                    dat.extend(self.asset_body)
-            return bytes(dat)
+                ptr = _pack_bigint(buf, ptr, self.asset_file_digest, size=self.id_length)
+        if bodies is not None and id(self) in bodies:
+            body_type, body_size, body = bodies.pop(id(self))
+        else:
+            body_type, body_size, body = self._get_body_for_binary()
+        _BODY_HEADER.pack_into(buf, ptr, body_type, body_size)
+        return _pack_bytes(buf, ptr+4, body)
+
+    def _pack_compact(self, buf):
+        _write_id(buf, self.asset_id, self.id_length)
+        _write_id(buf, self.user_id, self.id_length)
+        _write_blob(buf, self.nonce)
+        _write_varint(buf, self.asset_file_size)
+        if self.asset_file_size > 0:
+            _write_id(buf, self.asset_file_digest, self.id_length)
+        body_type, body_size, body = self._get_body_for_binary()
+        buf.append(body_type)
+        _write_varint(buf, body_size)
+        buf += body
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.asset_id = _read_bytes(dat, ptr, self.id_length)
+        ptr, self.user_id = _read_bytes(dat, ptr, self.id_length)
+        ptr, self.nonce = _read_blob(dat, ptr)
+        ptr, self.asset_file_size = _read_varint(dat, ptr)
+        self.asset_file_digest = None
+        if self.asset_file_size > 0:
+            ptr, self.asset_file_digest = _read_bytes(dat, ptr, self.id_length)
+        body_type = dat[ptr]
+        ptr, body_size = _read_varint(dat, ptr+1)
+        if body_type == 1:
+            ptr, astbdy = _read_bytes(dat, ptr, body_size)
+            self.asset_body = bson.loads(astbdy)
+            self.asset_body_size = len(self.asset_body)
+        else:
+            self.asset_body_size = body_size
+            if body_size > 0:
+                ptr, self.asset_body = _read_bytes(dat, ptr, body_size)
+        return ptr
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -1825,25 +2600,26 @@ class BBcAsset:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         try:
-            ptr, self.asset_id = get_bigint(ptr, data)
-            ptr, self.user_id = get_bigint(ptr, data)
-            ptr, noncelen = get_n_byte_int(ptr, 2, data)
-            ptr, self.nonce = get_n_bytes(ptr, noncelen, data)
-            ptr, self.asset_file_size = get_n_byte_int(ptr, 4, data)
+            ptr, self.asset_id = _read_bigint(data, ptr)
+            ptr, self.user_id = _read_bigint(data, ptr)
+            ptr, noncelen = _read_uint16(data, ptr)
+            ptr, self.nonce = _read_bytes(data, ptr, noncelen)
+            ptr, self.asset_file_size = _read_uint32(data, ptr)
             if self.asset_file_size > 0:
-                ptr, self.asset_file_digest = get_bigint(ptr, data)
+                ptr, self.asset_file_digest = _read_bigint(data, ptr)
             else:
                 self.asset_file_digest = None
-            ptr, dict_flag = get_n_byte_int(ptr, 2, data)
+            ptr, dict_flag = _read_uint16(data, ptr)
             if dict_flag != 1:
-                ptr, self.asset_body_size = get_n_byte_int(ptr, 2, data)
+                ptr, self.asset_body_size = _read_uint16(data, ptr)
                 if self.asset_body_size > 0:
-                    ptr, self.asset_body = get_n_bytes(ptr, self.asset_body_size, data)
+                    ptr, self.asset_body = _read_bytes(data, ptr, self.asset_body_size)
             else:
-                ptr, sz = get_n_byte_int(ptr, 2, data)
-                ptr, astbdy = get_n_bytes(ptr, sz, data)
+                ptr, sz = _read_uint16(data, ptr)
+                ptr, astbdy = _read_bytes(data, ptr, sz)
                 self.asset_body = bson.loads(astbdy)
                 self.asset_body_size = len(self.asset_body)
 
@@ -1882,11 +2658,7 @@ class BBcAsset:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.asset_id = data.get('asset_id', None)
         self.user_id = data.get('user_id', None)
@@ -1900,6 +2672,8 @@ class BBcAsset:
 
 class BBcCrossRef:
     """CrossRef part in a transaction"""
+    __slots__ = ('format_type', 'domain_id', 'transaction_id')
+
     def __init__(self, domain_id=None, transaction_id=None, deserialize=None, format_type=BBcFormat.FORMAT_BINARY):
         self.format_type = format_type
         self.domain_id = domain_id
@@ -1921,9 +2695,24 @@ class BBcCrossRef:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.get_dict()
-        dat = bytearray(to_bigint(self.domain_id))
-        dat.extend(to_bigint(self.transaction_id))
-        return bytes(dat)
+        return _serialize_part(self)
+
+    def _binary_size(self, bodies=None):
+        return 2 + len(self.domain_id) + 2 + len(self.transaction_id)
+
+    def _pack_into(self, buf, ptr, bodies=None):
+        st = _get_struct('<H%dsH%ds' % (len(self.domain_id), len(self.transaction_id)))
+        st.pack_into(buf, ptr, 32, self.domain_id, 32, self.transaction_id)
+        return ptr+st.size
+
+    def _pack_compact(self, buf):
+        _write_blob(buf, self.domain_id)
+        _write_blob(buf, self.transaction_id)
+
+    def _unpack_compact(self, dat, ptr):
+        ptr, self.domain_id = _read_blob(dat, ptr)
+        ptr, self.transaction_id = _read_blob(dat, ptr)
+        return ptr
 
     def deserialize(self, data):
         """Deserialize into this object
@@ -1935,10 +2724,11 @@ class BBcCrossRef:
         """
         if self.format_type != BBcFormat.FORMAT_BINARY:
             return self.deserialize_obj(data)
+        data = memoryview(data)
         ptr = 0
         try:
-            ptr, self.domain_id = get_bigint(ptr, data)
-            ptr, self.transaction_id = get_bigint(ptr, data)
+            ptr, self.domain_id = _read_bigint(data, ptr)
+            ptr, self.transaction_id = _read_bigint(data, ptr)
         except:
             return False
         return True
@@ -1958,17 +2748,552 @@ class BBcCrossRef:
         Returns:
             bool: True if successful
         """
-        if self.format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
-                                BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
-            data = deep_copy_with_key_stringify(obj)
-        else:
-            data = obj
+        data = obj
 
         self.domain_id = data.get('domain_id', None)
         self.transaction_id = data.get('transaction_id', None)
         return True
 
 
+class BBcTransactionIndex:
+    """Index fields of a transaction extracted from transaction_data without building the whole object graph
+
+    Use scan_transaction() to create this object. Full objects are materialized only on demand
+    through get_transaction() and the signatures attribute.
+    """
+    __slots__ = ('format_type', 'id_length', 'version', 'timestamp', 'transaction_id', 'transaction_base_digest',
+                 'transaction_data', 'asset_info', 'pointers', 'signature_spans', 'signature_objs', '_signatures',
+                 '_txobj', 'timestamp_base')
+
+    def __init__(self, transaction_data, format_type=BBcFormat.FORMAT_BINARY, timestamp_base=None):
+        self.format_type = format_type
+        self.timestamp_base = timestamp_base
+        self.id_length = DEFAULT_ID_LEN
+        self.version = 0
+        self.timestamp = 0
+        self.transaction_id = None
+        self.transaction_base_digest = None
+        self.transaction_data = transaction_data
+        self.asset_info = list()        # list of (asset_group_id, asset_id, user_id)
+        self.pointers = list()          # transaction_ids pointed by references and pointers in relations
+        self.signature_spans = list()   # (start, end) of each signature in transaction_data (FORMAT_BINARY/COMPACT)
+        self.signature_objs = list()    # signature parts in bson/msgpack formats
+        self._signatures = None
+        self._txobj = None
+
+    def __str__(self):
+        ret =  "------- Index of the transaction data ------\n"
+        ret += "* transaction_id: %s\n" % str_binary(self.transaction_id)
+        ret += "timestamp: %d\n" % self.timestamp
+        ret += "Asset[]: %d\n" % len(self.asset_info)
+        for asset_group_id, asset_id, user_id in self.asset_info:
+            ret += "  - %s %s %s\n" % (str_binary(asset_group_id), str_binary(asset_id), str_binary(user_id))
+        ret += "Pointer[]: %d\n" % len(self.pointers)
+        for txid in self.pointers:
+            ret += "  - %s\n" % str_binary(txid)
+        return ret
+
+    @property
+    def signatures(self):
+        """List of BBcSignature objects (materialized on the first access)"""
+        if self._signatures is None:
+            self._signatures = list()
+            if self.format_type == BBcFormat.FORMAT_BINARY:
+                dat = memoryview(self.transaction_data)
+                for start, end in self.signature_spans:
+                    sig = BBcSignature()
+                    if end - start > 4:
+                        sig.deserialize(dat[start:end])
+                    self._signatures.append(sig)
+            elif self.format_type == BBcFormat.FORMAT_COMPACT:
+                dat = memoryview(self.transaction_data)
+                for start, end in self.signature_spans:
+                    sig = BBcSignature(format_type=self.format_type)
+                    sig._unpack_compact(dat, start)
+                    self._signatures.append(sig)
+            else:
+                for sigobj in self.signature_objs:
+                    sig = BBcSignature(format_type=self.format_type)
+                    sig.deserialize(sigobj)
+                    self._signatures.append(sig)
+        return self._signatures
+
+    def get_transaction(self):
+        """Materialize the BBcTransaction object
+
+        Returns:
+            BBcTransaction: transaction object (None if deserialization fails)
+        """
+        if self._txobj is None:
+            txobj = BBcTransaction()
+            if not txobj.deserialize(self.transaction_data, timestamp_base=self.timestamp_base):
+                return None
+            self._txobj = txobj
+        return self._txobj
+
+
+def _skip_bigint(dat, ptr):
+    """Return the position next to a length-prefixed id"""
+    return ptr + 2 + _UINT16.unpack_from(dat, ptr)[0]
+
+
+def _scan_binary(data):
+    """Scan FORMAT_BINARY transaction data (see BBcTransaction.deserialize for the layout)"""
+    idx = BBcTransactionIndex(data, BBcFormat.FORMAT_BINARY)
+    dat = memoryview(data)
+    _, idx.version, idx.timestamp, idx.id_length, evt_num = _TX_HEADER.unpack_from(dat, 0)
+    ptr = _TX_HEADER.size
+    for i in range(evt_num):
+        ptr, size = _read_uint32(dat, ptr)
+        end = ptr + size
+        ptr, asset_group_id = _read_bigint(dat, ptr)
+        ptr, ref_num = _read_uint16(dat, ptr)
+        ptr += 2 * ref_num
+        ptr, appr_num = _read_uint16(dat, ptr)
+        for j in range(appr_num):
+            ptr = _skip_bigint(dat, ptr)
+        ptr += 2
+        ptr, option_num = _read_uint16(dat, ptr)
+        for j in range(option_num):
+            ptr = _skip_bigint(dat, ptr)
+        ptr, astsize = _read_uint32(dat, ptr)
+        if astsize > 0:
+            ptr, asset_id = _read_bigint(dat, ptr)
+            ptr, user_id = _read_bigint(dat, ptr)
+            idx.asset_info.append((asset_group_id, asset_id, user_id))
+        ptr = end
+
+    ptr, ref_num = _read_uint16(dat, ptr)
+    for i in range(ref_num):
+        ptr, size = _read_uint32(dat, ptr)
+        end = ptr + size
+        ptr = _skip_bigint(dat, ptr)
+        ptr, transaction_id = _read_bigint(dat, ptr)
+        idx.pointers.append(transaction_id)
+        ptr = end
+
+    ptr, rtn_num = _read_uint16(dat, ptr)
+    for i in range(rtn_num):
+        ptr, size = _read_uint32(dat, ptr)
+        end = ptr + size
+        ptr, asset_group_id = _read_bigint(dat, ptr)
+        ptr, pt_num = _read_uint16(dat, ptr)
+        for j in range(pt_num):
+            ptr, ptsize = _read_uint16(dat, ptr)
+            _, transaction_id = _read_bigint(dat, ptr)
+            idx.pointers.append(transaction_id)
+            ptr += ptsize
+        ptr, astsize = _read_uint32(dat, ptr)
+        if astsize > 0:
+            ptr, asset_id = _read_bigint(dat, ptr)
+            ptr, user_id = _read_bigint(dat, ptr)
+            idx.asset_info.append((asset_group_id, asset_id, user_id))
+        ptr = end
+
+    ptr, witness_num = _read_uint16(dat, ptr)
+    if witness_num > 0:
+        ptr, size = _read_uint32(dat, ptr)
+        ptr += size
+    base_end = ptr
+    ptr, cross_num = _read_uint16(dat, ptr)
+    if cross_num > 0:
+        ptr, size = _read_uint32(dat, ptr)
+        ptr += size
+    cross_end = ptr
+
+    ptr, sig_num = _read_uint16(dat, ptr)
+    for i in range(sig_num):
+        ptr, size = _read_uint32(dat, ptr)
+        idx.signature_spans.append((ptr, ptr + size))
+        ptr += size
+    if ptr > len(dat):
+        return None
+
+    idx.transaction_base_digest = hashlib.sha256(dat[2:base_end]).digest()
+    target = idx.transaction_base_digest + bytes(dat[base_end:cross_end])
+    idx.transaction_id = hashlib.sha256(target).digest()[:idx.id_length]
+    return idx
+
+
+def _scan_compact(data, timestamp_base):
+    """Scan FORMAT_COMPACT transaction data (see BBcTransaction.serialize_compact for the layout)"""
+    idx = BBcTransactionIndex(data, BBcFormat.FORMAT_COMPACT, timestamp_base)
+    dat = memoryview(data)
+    ptr, idx.version = _read_varint(dat, 3)
+    ptr, timestamp = _read_varint(dat, ptr)
+    ptr, idx.id_length = _read_varint(dat, ptr)
+    if dat[2] & _COMPACT_DELTA_TIMESTAMP:
+        if timestamp_base is None:
+            return None
+        timestamp = timestamp_base + _unzigzag(timestamp)
+    idx.timestamp = timestamp
+    header_end = ptr
+    id_length = idx.id_length
+
+    ptr, evt_num = _read_varint(dat, ptr)
+    for i in range(evt_num):
+        ptr, size = _read_varint(dat, ptr)
+        end = ptr + size
+        ptr, asset_group_id = _read_bytes(dat, ptr, id_length)
+        ptr, ref_num = _read_varint(dat, ptr)
+        for j in range(ref_num):
+            ptr, _ = _read_varint(dat, ptr)
+        ptr, appr_num = _read_varint(dat, ptr)
+        ptr, _ = _read_varint(dat, ptr + appr_num * id_length)
+        ptr, option_num = _read_varint(dat, ptr)
+        ptr, asset_id = _read_bytes(dat, ptr + option_num * id_length, id_length)
+        ptr, user_id = _read_bytes(dat, ptr, id_length)
+        idx.asset_info.append((asset_group_id, asset_id, user_id))
+        ptr = end
+
+    ptr, ref_num = _read_varint(dat, ptr)
+    for i in range(ref_num):
+        ptr, size = _read_varint(dat, ptr)
+        _, transaction_id = _read_bytes(dat, ptr + id_length, id_length)
+        idx.pointers.append(transaction_id)
+        ptr += size
+
+    ptr, rtn_num = _read_varint(dat, ptr)
+    for i in range(rtn_num):
+        ptr, size = _read_varint(dat, ptr)
+        end = ptr + size
+        ptr, asset_group_id = _read_bytes(dat, ptr, id_length)
+        ptr, pt_num = _read_varint(dat, ptr)
+        for j in range(pt_num):
+            ptr, transaction_id = _read_bytes(dat, ptr, id_length)
+            idx.pointers.append(transaction_id)
+            ptr += 1 + id_length if dat[ptr] == 1 else 1
+        if dat[ptr] == 1:
+            ptr, asset_id = _read_bytes(dat, ptr + 1, id_length)
+            ptr, user_id = _read_bytes(dat, ptr, id_length)
+            idx.asset_info.append((asset_group_id, asset_id, user_id))
+        ptr = end
+
+    if dat[ptr] == 1:
+        ptr, size = _read_varint(dat, ptr + 1)
+        ptr += size
+    else:
+        ptr += 1
+    base_end = ptr
+    if dat[ptr] == 1:
+        ptr, size = _read_varint(dat, ptr + 1)
+        ptr += size
+    else:
+        ptr += 1
+    cross_end = ptr
+
+    ptr, sig_num = _read_varint(dat, ptr)
+    for i in range(sig_num):
+        ptr, size = _read_varint(dat, ptr)
+        idx.signature_spans.append((ptr, ptr + size))
+        ptr += size
+    if ptr != len(dat):
+        return None
+
+    digest = hashlib.sha256(_compact_header(idx.version, idx.timestamp, id_length))
+    digest.update(dat[header_end:base_end])
+    idx.transaction_base_digest = digest.digest()
+    target = idx.transaction_base_digest + bytes(dat[base_end:cross_end])
+    idx.transaction_id = hashlib.sha256(target).digest()[:id_length]
+    return idx
+
+
+def _scan_obj(data, format_type):
+    """Scan bson/msgpack transaction data (see BBcTransaction.serialize_obj for the layout)"""
+    idx = BBcTransactionIndex(data, format_type)
+    dat = data[2:]
+    if format_type in [BBcFormat.FORMAT_BSON_COMPRESS_BZ2, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2]:
+        dat = bz2.decompress(dat)
+    elif format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB]:
+        dat = zlib.decompress(dat)
+    elif format_type in [BBcFormat.FORMAT_BSON_COMPRESS_ZDICT, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+        dat = _zdict_decompress(dat)
+        if dat is None:
+            return None
+    if format_type in [BBcFormat.FORMAT_MSGPACK, BBcFormat.FORMAT_MSGPACK_COMPRESS_BZ2,
+                       BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT]:
+        datobj = _msgpack_loads(dat)
+        dumps = msgpack.dumps
+    else:
+        datobj = bson.loads(dat)
+        dumps = bson.dumps
+
+    tx_base = datobj["transaction_base"]
+    idx.version = tx_base["header"]["version"]
+    idx.timestamp = tx_base["header"]["timestamp"]
+    idx.id_length = tx_base["header"]["id_length"]
+    for evt in tx_base["events"]:
+        ast = evt.get('asset', None)
+        if ast is not None:
+            idx.asset_info.append((evt.get('asset_group_id', None), ast.get('asset_id', None),
+                                   ast.get('user_id', None)))
+    for refe in tx_base["references"]:
+        idx.pointers.append(refe.get('transaction_id', None))
+    for rtn in tx_base["relations"]:
+        for pt in rtn.get('pointers', []):
+            idx.pointers.append(pt.get('transaction_id', None))
+        ast = rtn.get('asset', None)
+        if ast is not None:
+            idx.asset_info.append((rtn.get('asset_group_id', None), ast.get('asset_id', None),
+                                   ast.get('user_id', None)))
+    idx.signature_objs = datobj.get("signatures", [])
+
+    base = dict((k, v) for k, v in tx_base.items() if k != "cross_ref")
+    idx.transaction_base_digest = hashlib.sha256(dumps(base)).digest()
+    target = dumps({
+        "tx_base": idx.transaction_base_digest,
+        "cross_ref": tx_base.get("cross_ref", None),
+    })
+    idx.transaction_id = hashlib.sha256(target).digest()[:idx.id_length]
+    return idx
+
+
+def scan_transaction(data, timestamp_base=None):
+    """Extract index fields from transaction_data without full object construction
+
+    transaction_id, asset_group_id/asset_id/user_id of the assets, transaction_ids pointed by references and
+    pointers and the signature spans are extracted. KeyPair objects are not created.
+
+    Args:
+        data (bytes): serialized transaction data (any format in BBcFormat)
+        timestamp_base (int): FORMAT_COMPACT only. Needed if the timestamp was encoded as a delta
+    Returns:
+        BBcTransactionIndex: index fields of the transaction (None if the data is broken)
+    """
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    try:
+        format_type = _UINT16.unpack_from(data, 0)[0]
+        if format_type == BBcFormat.FORMAT_BINARY:
+            return _scan_binary(data)
+        if format_type == BBcFormat.FORMAT_COMPACT:
+            return _scan_compact(data, timestamp_base)
+        return _scan_obj(data, format_type)
+    except Exception:
+        return None
+
+
+ARCHIVE_MAGIC = b'BBCA'
+ARCHIVE_VERSION = 1
+_ARCHIVE_HEADER = struct.Struct('<4sHHQ')  # magic, version, flags, timestamp_base
+_ARCHIVE_FLAG_TIMESTAMP_BASE = 0x01
+ARCHIVE_VALIDATION_BATCH = 1000
+
+
+class BBcArchiveWriter:
+    """Writer of a transaction archive
+
+    An archive is a header followed by length-prefixed (uint32) transaction data in any format of BBcFormat.
+    Transactions are appended one by one, so an archive of any size is written in constant memory.
+    """
+    def __init__(self, path, timestamp_base=None):
+        """Create the archive file
+
+        Args:
+            path (str): path to the archive file (overwritten if exists)
+            timestamp_base (int): base of the delta timestamps of FORMAT_COMPACT transactions in this archive
+        """
+        self.timestamp_base = timestamp_base
+        self.count = 0
+        self.file = open(path, "wb")
+        flags = _ARCHIVE_FLAG_TIMESTAMP_BASE if timestamp_base is not None else 0
+        self.file.write(_ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, flags, timestamp_base or 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def write(self, txobj):
+        """Append a transaction
+
+        Args:
+            txobj (BBcTransaction|BBcTransactionIndex|bytes): transaction object, its index or serialized data
+        Returns:
+            bool: True if successful
+        """
+        if isinstance(txobj, BBcTransaction):
+            if txobj.format_type == BBcFormat.FORMAT_COMPACT:
+                dat = txobj.serialize(timestamp_base=self.timestamp_base)
+            else:
+                dat = txobj.serialize()
+        elif isinstance(txobj, BBcTransactionIndex):
+            dat = txobj.transaction_data
+        else:
+            dat = txobj
+        if dat is None:
+            return False
+        self.file.write(_UINT32.pack(len(dat)))
+        self.file.write(dat)
+        self.count += 1
+        return True
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _init_archive_worker(zdicts, default_zdict_id):
+    """Initializer of the validation processes (preset dictionaries are needed for ZDICT formats)"""
+    global _zdict_default_id
+    _zdict_registry.update(zdicts)
+    _zdict_default_id = default_zdict_id
+
+
+def _validate_archived_transaction(args):
+    """Validate a transaction in a worker process
+
+    Args:
+        args (tuple): (serialized transaction data, timestamp_base)
+    Returns:
+        tuple: (transaction_id or None, True if valid)
+    """
+    idx = scan_transaction(args[0], timestamp_base=args[1])
+    if idx is None:
+        return None, False
+    return idx.transaction_id, validate_transaction_object(idx)[0]
+
+
+class BBcArchiveReader:
+    """Reader of a transaction archive written by BBcArchiveWriter
+
+    Iterating over the reader yields BBcTransactionIndex objects (see scan_transaction), so only the index fields
+    are decoded. Use transactions() for fully decoded objects and records() for raw transaction data. Only one
+    transaction is held at a time, so an archive of any size is read in constant memory.
+    """
+    def __init__(self, path, use_mmap=True):
+        """Open the archive file
+
+        Args:
+            path (str): path to the archive file
+            use_mmap (bool): If True, the file is memory-mapped instead of being read with read() calls
+        """
+        self.file = open(path, "rb")
+        self.mmap = None
+        self.timestamp_base = None
+        self.broken = False
+        header = self.file.read(_ARCHIVE_HEADER.size)
+        if len(header) < _ARCHIVE_HEADER.size:
+            self.broken = True
+            return
+        magic, version, flags, timestamp_base = _ARCHIVE_HEADER.unpack(header)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            self.broken = True
+            return
+        if flags & _ARCHIVE_FLAG_TIMESTAMP_BASE:
+            self.timestamp_base = timestamp_base
+        if use_mmap:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __iter__(self):
+        for dat in self.records():
+            idx = scan_transaction(dat, timestamp_base=self.timestamp_base)
+            if idx is None:
+                self.broken = True
+                set_error(code=EBADTRANSACTION, txt="Broken transaction in the archive")
+                return
+            yield idx
+
+    def records(self):
+        """Iterate over the serialized transaction data in the archive
+
+        Iteration stops at a truncated record and self.broken is set to True.
+
+        Returns:
+            generator: bytes of each transaction
+        """
+        if self.broken:
+            return
+        if self.mmap is not None:
+            mm = self.mmap
+            ptr = _ARCHIVE_HEADER.size
+            end = len(mm)
+            while ptr < end:
+                if ptr + _UINT32.size > end:
+                    break
+                size = _UINT32.unpack_from(mm, ptr)[0]
+                ptr += _UINT32.size
+                if ptr + size > end:
+                    break
+                yield mm[ptr:ptr+size]
+                ptr += size
+            else:
+                return
+        else:
+            self.file.seek(_ARCHIVE_HEADER.size)
+            while True:
+                dat = self.file.read(_UINT32.size)
+                if len(dat) == 0:
+                    return
+                if len(dat) < _UINT32.size:
+                    break
+                size = _UINT32.unpack(dat)[0]
+                dat = self.file.read(size)
+                if len(dat) < size:
+                    break
+                yield dat
+        self.broken = True
+        set_error(code=EBADTRANSACTION, txt="Truncated archive")
+
+    def transactions(self):
+        """Iterate over the fully decoded transactions in the archive
+
+        Returns:
+            generator: BBcTransaction objects
+        """
+        for dat in self.records():
+            txobj = BBcTransaction()
+            if not txobj.deserialize(dat, timestamp_base=self.timestamp_base):
+                self.broken = True
+                set_error(code=EBADTRANSACTION, txt="Broken transaction in the archive")
+                return
+            yield txobj
+
+    def validate(self, processes=None, batch_size=ARCHIVE_VALIDATION_BATCH):
+        """Validate the signatures of all transactions in the archive
+
+        Args:
+            processes (int): the number of worker processes (0 to validate in this process, None for os.cpu_count())
+            batch_size (int): the number of transactions handed to the worker processes at a time
+        Returns:
+            generator: (transaction_id, True if valid) for each transaction in the archive order
+        """
+        if processes == 0:
+            for dat in self.records():
+                yield _validate_archived_transaction((dat, self.timestamp_base))
+            return
+        pool = multiprocessing.Pool(processes, initializer=_init_archive_worker,
+                                    initargs=(dict(_zdict_registry), _zdict_default_id))
+        try:
+            batch = list()
+            for dat in self.records():
+                batch.append((dat, self.timestamp_base))
+                if len(batch) >= batch_size:
+                    for ret in pool.map(_validate_archived_transaction, batch):
+                        yield ret
+                    batch = list()
+            for ret in pool.map(_validate_archived_transaction, batch):
+                yield ret
+        finally:
+            pool.terminate()
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
 class MsgType:
     """Message types for between core node and client"""
     REQUEST_SETUP_DOMAIN = 0
@@ -2030,6 +3355,12 @@ class MsgType:
     REQUEST_REPAIR = 94
     REQUEST_COUNT_TRANSACTIONS = 95
     RESPONSE_COUNT_TRANSACTIONS = 95
+    REQUEST_SEARCH_BY_BODY_FIELD = 96
+    RESPONSE_SEARCH_BY_BODY_FIELD = 97
+    REQUEST_GET_HEAD = 98
+    RESPONSE_GET_HEAD = 99
+    REQUEST_CHANGE_FEED = 100
+    RESPONSE_CHANGE_FEED = 101
 
     REQUEST_REGISTER_HASH_IN_SUBSYS = 128
     RESPONSE_REGISTER_HASH_IN_SUBSYS = 129
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2018 quvox.net
+
+Scalable Bloom filter for existence checks of transaction_ids (see DataHandler)
+"""
+import hashlib
+import math
+import os
+import struct
+import threading
+
+SNAPSHOT_MAGIC = b'BBCF'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<4sHHQQdd')  # magic, version, number of filters, tag, initial capacity,
+                                                 # error rate, tightening ratio
+_FILTER_HEADER = struct.Struct('<QQQH')  # capacity, count, number of bits, number of hash functions
+_HASH = struct.Struct('<QQ')
+
+
+def _hash_pair(item):
+    """Two independent 64-bit hashes of the item for double hashing"""
+    h1, h2 = _HASH.unpack(hashlib.blake2b(item, digest_size=16).digest())
+    return h1, h2 | 1
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter"""
+    def __init__(self, capacity, error_rate, num_bits=None, num_hashes=None, bits=None):
+        self.capacity = capacity
+        self.count = 0
+        if num_bits is None:
+            num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        if num_hashes is None:
+            num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8) if bits is None else bytearray(bits)
+
+    def _positions(self, hashes):
+        h1, h2 = hashes
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, hashes):
+        """Add an item given by _hash_pair()"""
+        for pos in self._positions(hashes):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def contains(self, hashes):
+        """Return False if the item given by _hash_pair() has never been added"""
+        for pos in self._positions(hashes):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def estimated_error_rate(self):
+        """False positive rate for the current number of items"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class ScalableBloomFilter:
+    """Bloom filter that adds a larger filter when the current one is full
+
+    The n-th filter has growth^n times the initial capacity and tightening^n times the error rate, so that the
+    total false positive rate stays below error_rate / (1 - tightening).
+    """
+    def __init__(self, initial_capacity=100000, error_rate=0.001, growth=2, tightening=0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = list()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def __contains__(self, item):
+        hashes = _hash_pair(item)
+        for f in reversed(self.filters):
+            if f.contains(hashes):
+                return True
+        return False
+
+    def add(self, item):
+        """Add an item (bytes)"""
+        hashes = _hash_pair(item)
+        with self.lock:
+            if len(self.filters) == 0 or self.filters[-1].is_full():
+                n = len(self.filters)
+                self.filters.append(BloomFilter(self.initial_capacity * (self.growth ** n),
+                                                self.error_rate * (self.tightening ** n)))
+            self.filters[-1].add(hashes)
+
+    def memory_size(self):
+        """Size of the bit arrays in bytes"""
+        return sum(len(f.bits) for f in self.filters)
+
+    def estimated_error_rate(self):
+        """False positive rate for the current number of items"""
+        ok = 1.0
+        for f in self.filters:
+            ok *= 1 - f.estimated_error_rate()
+        return 1 - ok
+
+    def save(self, path, tag=0):
+        """Save the filter in a file
+
+        Args:
+            path (str): path to the snapshot file
+            tag (int): value to check the freshness of the snapshot at loading (e.g., the number of items)
+        """
+        tmp = path + ".tmp"
+        with self.lock, open(tmp, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.filters), tag,
+                                          self.initial_capacity, self.error_rate, self.tightening))
+            for flt in self.filters:
+                f.write(_FILTER_HEADER.pack(flt.capacity, flt.count, flt.num_bits, flt.num_hashes))
+                f.write(flt.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, growth=2):
+        """Load a filter saved by save()
+
+        Returns:
+            ScalableBloomFilter: the filter (None if the file is not a snapshot)
+            int: tag given to save()
+        """
+        with open(path, "rb") as f:
+            dat = f.read()
+        if len(dat) < _SNAPSHOT_HEADER.size:
+            return None, None
+        magic, version, num, tag, capacity, error_rate, tightening = _SNAPSHOT_HEADER.unpack_from(dat, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return None, None
+        obj = cls(initial_capacity=capacity, error_rate=error_rate, growth=growth, tightening=tightening)
+        ptr = _SNAPSHOT_HEADER.size
+        for i in range(num):
+            if len(dat) < ptr + _FILTER_HEADER.size:
+                return None, None
+            flt_capacity, count, num_bits, num_hashes = _FILTER_HEADER.unpack_from(dat, ptr)
+            ptr += _FILTER_HEADER.size
+            size = (num_bits + 7) // 8
+            if len(dat) < ptr + size:
+                return None, None
+            flt = BloomFilter(flt_capacity, None, num_bits=num_bits, num_hashes=num_hashes, bits=dat[ptr:ptr+size])
+            flt.count = count
+            obj.filters.append(flt)
+            ptr += size
+        return obj, tag
@@ -5,13 +5,21 @@ Copyright (c) 2018 quvox.net
 This code is based on that in bbc-1 (https://github.com/beyond-blockchain/bbc1.git)
 """
 import mysql.connector
+import hashlib
 import traceback
 import logging
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict, deque
 
 import os
 import sys
 sys.path.extend(["../../", os.path.abspath(os.path.dirname(__file__))])
-from bbc_simple.core import bbclib
+from bbc_simple.core import bbclib, bbc_stats
+from bbc_simple.core.bloom_filter import ScalableBloomFilter
+from bbc_simple.core.journal import InsertJournal, JOURNAL_SUFFIX
+from bbc_simple.core.segment_store import SegmentStore, DEFAULT_SEGMENT_SIZE
 from bbc_simple.core.message_key_types import to_2byte, PayloadType, KeyType
 
 transaction_tbl_definition = [
@@ -27,53 +35,820 @@ topology_info_definition = [
     ["id", "INTEGER"], ["base", "BLOB"], ["point_to", "BLOB"]
 ]
 
+# -- schema version 2: fixed-width id columns and composite indexes for "WHERE xxx = ? ORDER BY id"
+ID_COLUMN_TYPE = "VARBINARY(32)"  # ids up to 32 bytes (id_length of a transaction is 8 to 32)
+
+transaction_tbl_definition_v2 = [
+    ["transaction_id", ID_COLUMN_TYPE], ["transaction_data", "BLOB"],
+]
+
+asset_info_definition_v2 = [
+    ["id", "BIGINT"],
+    ["transaction_id", ID_COLUMN_TYPE], ["asset_group_id", ID_COLUMN_TYPE], ["asset_id", ID_COLUMN_TYPE],
+    ["user_id", ID_COLUMN_TYPE],
+]
+
+topology_info_definition_v2 = [
+    ["id", "BIGINT"], ["base", ID_COLUMN_TYPE], ["point_to", ID_COLUMN_TYPE]
+]
+
+# -- schema version 3: timestamp (BBcTransaction.timestamp) of the transaction in all the tables for archival
+transaction_tbl_definition_v3 = transaction_tbl_definition_v2 + [["timestamp", "BIGINT"]]
+asset_info_definition_v3 = asset_info_definition_v2 + [["timestamp", "BIGINT"]]
+topology_info_definition_v3 = topology_info_definition_v2 + [["timestamp", "BIGINT"]]
+
+# -- transaction counters (see count_transactions()), independent of the schema version
+counter_table_definition = [
+    ["counter_key", "VARBINARY(66)"], ["tx_count", "BIGINT"],
+]
+
+# -- latest transaction of each (asset_group_id, user_id) (see get_head()), independent of the schema version
+head_table_definition = [
+    ["head_key", "VARBINARY(66)"], ["transaction_id", ID_COLUMN_TYPE], ["asset_id", ID_COLUMN_TYPE],
+    ["timestamp", "BIGINT"],
+]
+
+# -- inserted transactions in the order of the inserts (see read_change_feed()). id is the insert sequence
+change_feed_definition = [
+    ["id", "BIGINT"], ["transaction_id", ID_COLUMN_TYPE], ["asset_group_ids", "BLOB"], ["inserted_at", "BIGINT"],
+]
+MAX_CHANGE_FEED_BATCH = 1000
+DEFAULT_CHANGE_FEED_COMMIT_LAG = 10  # sec; a gap in the ids older than this is taken as a rolled back insert
+DEFAULT_CHANGE_FEED_MAX_WAIT = 30  # sec; the longest long poll of a client (see BBcCore.read_change_feed())
+CHANGE_FEED_WAIT_SLICE = 1  # sec; the inserts by other cores do not wake up the readers, so they poll the DB
+
+# -- transactions of which asset_info/topology rows are not written yet (deferred indexing)
+pending_index_definition = [
+    ["id", "BIGINT"], ["transaction_id", ID_COLUMN_TYPE],
+]
+
+# -- values of the indexed fields in dict asset bodies (see "body_index" in the domain config)
+body_index_definition = [
+    ["id", "BIGINT"], ["transaction_id", ID_COLUMN_TYPE], ["asset_group_id", ID_COLUMN_TYPE],
+    ["field", "VARCHAR(64)"], ["num_value", "DOUBLE"], ["str_value", "VARBINARY(255)"],
+]
+body_index_indices = [1, (2, 3, 4, 0), (2, 3, 5, 0)]
+MAX_BODY_VALUE_LEN = 255
+
+SCHEMA_VERSION = 3
+
+# schema version -> list of (table name, definition, primary key, indices)
+# an element of indices is a column index or a tuple of column indices (composite index)
+table_schemas = {
+    1: [
+        ('transaction_table', transaction_tbl_definition, 0, [0]),
+        ('asset_info_table', asset_info_definition, 0, [0, 1, 2, 3, 4]),
+        ('topology_table', topology_info_definition, 0, [0, 1, 2]),
+    ],
+    2: [
+        ('transaction_table', transaction_tbl_definition_v2, 0, []),
+        ('asset_info_table', asset_info_definition_v2, 0, [1, (2, 0), (4, 0), (3, 0)]),
+        ('topology_table', topology_info_definition_v2, 0, [(1, 2), (2, 1)]),
+    ],
+    3: [
+        ('transaction_table', transaction_tbl_definition_v3, 0, [2]),
+        ('asset_info_table', asset_info_definition_v3, 0, [1, (2, 0), (4, 0), (3, 0), 5, (2, 5)]),
+        ('topology_table', topology_info_definition_v3, 0, [(1, 2), (2, 1), 3]),
+    ],
+}
+
+# -- archived rows are moved to <table> + ARCHIVE_SUFFIX (schema version 3 or later, see archive_transactions())
+ARCHIVE_SUFFIX = "_archive"
+
+# -- (statement, lag column) to check a replica: the names since MySQL 8.0.22, then the old ones (removed in 8.4)
+REPLICA_STATUS_QUERIES = [
+    ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+    ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+]
+
+MAX_SEARCH_COUNT = 20
+TXID_FILTER_SUFFIX = ".txid_filter"
+TXID_FILTER_STATS_INTERVAL = 1  # sec
+SEGMENT_STORE_SUFFIX = ".segments"
+_SEARCH_CURSOR = struct.Struct('<BBQ')  # version, direction, last id in asset_info_table
+_SHARDED_SEARCH_CURSOR = struct.Struct('<BBB')  # version, direction, number of shards (followed by the last ids)
+SEARCH_CURSOR_VERSION = 1
+SHARDED_SEARCH_CURSOR_VERSION = 2
+TIMED_SEARCH_CURSOR_VERSION = 3  # -- sharded, followed by (timestamp, last id) in each shard
+
+
+def make_search_cursor(direction, last_id):
+    """Make an opaque continuation cursor for search_transaction_with_cursor()
+
+    Args:
+        direction (int): 0: descend, 1: ascend
+        last_id (int|list): last id in asset_info_table (list of the last ids in the shards, None for no record, or
+                            of the tuples (timestamp, last id) in the shards)
+    """
+    if isinstance(last_id, (list, tuple)) and any(isinstance(i, tuple) for i in last_id):
+        values = [val for i in last_id for val in ((0, 0) if i is None else i)]
+        return _SHARDED_SEARCH_CURSOR.pack(TIMED_SEARCH_CURSOR_VERSION, direction, len(last_id)) + \
+               struct.pack('<%dQ' % len(values), *values)
+    if isinstance(last_id, (list, tuple)):
+        return _SHARDED_SEARCH_CURSOR.pack(SHARDED_SEARCH_CURSOR_VERSION, direction, len(last_id)) + \
+               struct.pack('<%dQ' % len(last_id), *[0 if i is None else i for i in last_id])
+    return _SEARCH_CURSOR.pack(SEARCH_CURSOR_VERSION, direction, last_id)
+
+
+def parse_search_cursor(cursor):
+    """Parse a continuation cursor
+
+    Returns:
+        int: direction (None if the cursor is invalid)
+        int|list: last id in asset_info_table (list for a cursor of sharded DBs, of tuples (timestamp, last id) if
+                  ordered by the timestamp)
+    """
+    if len(cursor) == _SEARCH_CURSOR.size and cursor[0] == SEARCH_CURSOR_VERSION:
+        version, direction, last_id = _SEARCH_CURSOR.unpack(cursor)
+    elif len(cursor) >= _SHARDED_SEARCH_CURSOR.size and cursor[0] == SHARDED_SEARCH_CURSOR_VERSION:
+        version, direction, num = _SHARDED_SEARCH_CURSOR.unpack_from(cursor, 0)
+        if len(cursor) != _SHARDED_SEARCH_CURSOR.size + 8 * num:
+            return None, None
+        last_id = [None if i == 0 else i
+                   for i in struct.unpack_from('<%dQ' % num, cursor, _SHARDED_SEARCH_CURSOR.size)]
+    elif len(cursor) >= _SHARDED_SEARCH_CURSOR.size and cursor[0] == TIMED_SEARCH_CURSOR_VERSION:
+        version, direction, num = _SHARDED_SEARCH_CURSOR.unpack_from(cursor, 0)
+        if len(cursor) != _SHARDED_SEARCH_CURSOR.size + 16 * num:
+            return None, None
+        values = struct.unpack_from('<%dQ' % (2 * num), cursor, _SHARDED_SEARCH_CURSOR.size)
+        last_id = [None if values[2*i+1] == 0 else (values[2*i], values[2*i+1]) for i in range(num)]
+    else:
+        return None, None
+    if direction not in (0, 1):
+        return None, None
+    return direction, last_id
+
+
+def shard_index(transaction_id, num_shards):
+    """Return the shard that stores the transaction (transaction_ids are hash values, so the prefix is uniform)"""
+    return int.from_bytes(bytes(transaction_id[:8]), "big") % num_shards
+
+
+def body_value_column(value):
+    """Return the column of body_index_table for the value and the value to store
+
+    Numbers are stored in num_value, and strings (UTF-8) and bytes in str_value.
+
+    Returns:
+        str: "num_value" or "str_value" (None if the value cannot be indexed)
+        float|bytes: value for the column
+    """
+    if isinstance(value, bool):
+        return None, None
+    if isinstance(value, (int, float)):
+        return "num_value", float(value)
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, (bytes, bytearray)) and len(value) <= MAX_BODY_VALUE_LEN:
+        return "str_value", bytes(value)
+    return None, None
+
+
+def extract_body_fields(asset_body, fields):
+    """Extract the values of the fields from a dict asset body
+
+    Args:
+        asset_body (dict): asset body
+        fields (list): field names (nested fields are given as "a.b")
+    Returns:
+        list: list of tuple (field, num_value, str_value)
+    """
+    values = list()
+    if not isinstance(asset_body, dict):
+        return values
+    for field in fields:
+        value = asset_body
+        for key in field.split("."):
+            value = value.get(key, None) if isinstance(value, dict) else None
+        column, value = body_value_column(value)
+        if column == "num_value":
+            values.append((field, value, None))
+        elif column == "str_value":
+            values.append((field, None, value))
+    return values
+
+
+COUNTER_ASSET_GROUP = 1
+COUNTER_USER = 2
+COUNTER_ASSET_GROUP_USER = 3
+
+
+def make_counter_key(asset_group_id=None, user_id=None):
+    """Make the key of counter_table for asset_group_id, user_id or the pair of them
+
+    Returns:
+        bytes: counter key (kind, length of the first id, the ids), None if neither id is given
+    """
+    if asset_group_id is not None and user_id is not None:
+        return bytes([COUNTER_ASSET_GROUP_USER, len(asset_group_id)]) + bytes(asset_group_id) + bytes(user_id)
+    if asset_group_id is not None:
+        return bytes([COUNTER_ASSET_GROUP, len(asset_group_id)]) + bytes(asset_group_id)
+    if user_id is not None:
+        return bytes([COUNTER_USER, len(user_id)]) + bytes(user_id)
+    return None
+
+
+def pack_ids(ids):
+    """Concatenate length-prefixed ids (e.g., asset_group_ids in change_feed_table)"""
+    return b''.join(bytes([len(i)]) + bytes(i) for i in ids)
+
+
+def unpack_ids(dat):
+    """Split the ids concatenated by pack_ids()"""
+    ids = list()
+    ptr = 0
+    while ptr < len(dat):
+        ids.append(bytes(dat[ptr+1:ptr+1+dat[ptr]]))
+        ptr += 1 + dat[ptr]
+    return ids
+
+
+def _get_transaction_id(txdata):
+    """Return the transaction_id of a serialized transaction"""
+    txobj = bbclib.scan_transaction(txdata)
+    if txobj is None:
+        txobj = bbclib.BBcTransaction(deserialize=txdata)
+    return txobj.transaction_id
+
 
 class DataHandler:
-    """DB and storage handler"""
+    """DB and storage handler
+
+    The background workers (the journal, the indexer of deferred indexing, the archiver and the pruner of the change
+    feed) are started only if start_workers is True, i.e., in the core. Maintenance tools open the DB without them so
+    that they do not replay the journal of the running core.
+    """
 
-    def __init__(self, networking=None, default_config=None, config=None, workingdir=None, domain_id=None):
+    def __init__(self, networking=None, default_config=None, config=None, workingdir=None, domain_id=None,
+                 start_workers=False):
         self.networking = networking
-        self.core = networking.core
-        self.stats = networking.core.stats
-        self.logger = networking.logger
+        if networking is not None:
+            self.core = networking.core
+            self.stats = networking.core.stats
+            self.logger = networking.logger
+        else:
+            # -- used by maintenance tools in utils/ without a running core
+            self.core = None
+            self.stats = bbc_stats.BBcStats()
+            self.logger = logging.getLogger("data_handler")
         self.domain_id = domain_id
         self.domain_id_str = bbclib.convert_id_to_string(domain_id)[:16]
         self.config = config
         self.working_dir = workingdir
         self.db_adaptor = None
+        self.txid_filter = None
+        self.txid_filter_exclusive = False
+        self.txid_filter_max_staleness = 0
+        self.txid_filter_refreshed_at = 0  # -- start time of the last refresh_txid_filter()
+        self.txid_filter_marks = dict()  # -- (table, shard) -> deque of (time, the largest id read until then)
+        self.txid_filter_stats_time = 0
+        self.deferred_indexing = 'deferred_indexing' in self.config
+        self.index_adaptor = None
+        self.index_condition = threading.Condition()
+        self.index_event = threading.Event()
+        self.indexed_up_to = 0
+        self.last_index_sequence = 0
+        self.shards = list()
+        self.replicas = list()
+        self.replica_counter = 0
+        self.recent_writes = OrderedDict()  # -- transaction_id/asset_group_id/... -> time written
+        self.change_feed = 'change_feed' in self.config
+        self.change_feed_condition = threading.Condition()
+        self.change_feed_generation = 0  # -- incremented by every insert in this core (see _notify_change_feed())
+        self.change_feed_commit_lag = self.config.get('change_feed', {}).get('commit_lag',
+                                                                             DEFAULT_CHANGE_FEED_COMMIT_LAG)
+        self.change_feed_max_wait = self.config.get('change_feed', {}).get('max_wait', DEFAULT_CHANGE_FEED_MAX_WAIT)
+        self.change_feed_id_steps = list()
+        # -- asset_group_id -> names of the fields indexed in body_index_table
+        self.body_index_fields = {bytes.fromhex(asset_group_id): fields
+                                  for asset_group_id, fields in self.config.get('body_index', {}).items()}
         self._db_setup(default_config)
+        self.segment_store = None
+        if 'segment_store' in self.config and workingdir is not None:
+            conf = self.config['segment_store']
+            self.segment_store = SegmentStore(os.path.join(workingdir, self.domain_id_str + SEGMENT_STORE_SUFFIX),
+                                              segment_size=conf.get("segment_size", DEFAULT_SEGMENT_SIZE),
+                                              sync=conf.get("fsync", True))
+            self.stats.update_stats("segment_store", self.domain_id_str, self.segment_store.get_stats())
+        if 'bloom_filter' in self.config:
+            if self.segment_store is None:
+                self._setup_txid_filter(self.config['bloom_filter'])
+            else:
+                self.logger.warning("bloom_filter is ignored with segment_store (its index is in the memory)")
+        self.journal = None
+        if not start_workers:
+            return
+        if len(self.replicas) > 0:
+            th = threading.Thread(target=self._replica_monitor_loop, args=(self.replica_check_interval,))
+            th.setDaemon(True)
+            th.start()
+        if self.deferred_indexing:
+            th = threading.Thread(target=self._indexer_loop, args=(self.config['deferred_indexing'],))
+            th.setDaemon(True)
+            th.start()
+        if 'archive' in self.config:
+            th = threading.Thread(target=self._archive_loop, args=(self.config['archive'],))
+            th.setDaemon(True)
+            th.start()
+        if self.change_feed:
+            th = threading.Thread(target=self._change_feed_prune_loop, args=(self.config['change_feed'],))
+            th.setDaemon(True)
+            th.start()
+        if self.txid_filter is not None and not self.txid_filter_exclusive:
+            th = threading.Thread(target=self._txid_filter_refresh_loop, args=(self.config['bloom_filter'],))
+            th.setDaemon(True)
+            th.start()
+        if 'journal' in self.config and workingdir is not None:
+            conf = self.config['journal']
+            self.journal = InsertJournal(os.path.join(workingdir, self.domain_id_str + JOURNAL_SUFFIX),
+                                         _get_transaction_id, max_size=conf.get("max_size", 64*1024*1024))
+            th = threading.Thread(target=self._journal_apply_loop, args=(conf,))
+            th.setDaemon(True)
+            th.start()
 
     def _db_setup(self, default_config):
-        """Setup DB"""
+        """Setup DB
+
+        New tables are created in the schema version given by "schema_version" in the config (default:
+        SCHEMA_VERSION). Existing tables are used as they are (see utils/bbc_schema_migrate.py for migration).
+
+        "shards" in the config is a list of additional DBs (db_name, db_addr, ...). A transaction is stored with its
+        asset info, topology (as the base) and counters in the shard given by shard_index() of its transaction_id,
+        with the DB given by "db" as the first shard. Searches by the other conditions are sent to all the shards
+        in parallel and merged.
+        """
         if 'db' in self.config:
             dbconf = self.config['db']
-            db_name = dbconf.get("db_name", self.domain_id_str)
-            db_addr = dbconf.get("db_addr", "127.0.0.1")
-            db_port = dbconf.get("db_port", 3306)
-            db_user = dbconf.get("db_user", "user")
-            db_pass = dbconf.get("db_pass", "pass")
-            db_rootuser = dbconf.get("db_rootuser", "root")
-            db_rootpass = dbconf.get("db_rootpass", "password")
-            table_engine = dbconf.get("engine", "MyISAM")
         else:
-            db_name = default_config.get("db_name", self.domain_id_str)
-            db_addr = default_config.get("db_addr", "127.0.0.1")
-            db_port = default_config.get("db_port", 3306)
-            db_user = default_config.get("db_user", "user")
-            db_pass = default_config.get("db_pass", "pass")
-            db_rootuser = default_config.get("db_rootuser", "root")
-            db_rootpass = default_config.get("db_rootpass", "password")
-            table_engine = default_config.get("engine", "MyISAM")
+            dbconf = default_config
+        db_name = dbconf.get("db_name", self.domain_id_str)
+        db_addr = dbconf.get("db_addr", "127.0.0.1")
+        db_port = dbconf.get("db_port", 3306)
+        db_user = dbconf.get("db_user", "user")
+        db_pass = dbconf.get("db_pass", "pass")
+        db_rootuser = dbconf.get("db_rootuser", "root")
+        db_rootpass = dbconf.get("db_rootpass", "password")
+        schema_version = dbconf.get("schema_version", SCHEMA_VERSION)
+        table_engine = dbconf.get("engine", "MyISAM" if schema_version == 1 else "InnoDB")
 
         self.db_adaptor = MysqlAdaptor(self, db_name=db_name, server_info=(db_addr, db_port, db_user, db_pass),
                                        engine=table_engine)
 
         self.db_adaptor.open_db(db_rootuser, db_rootpass)
-        self.db_adaptor.create_table('transaction_table', transaction_tbl_definition, primary_key=0, indices=[0])
-        self.db_adaptor.create_table('asset_info_table', asset_info_definition, primary_key=0, indices=[0, 1, 2, 3, 4])
-        self.db_adaptor.create_table('topology_table', topology_info_definition, primary_key=0, indices=[0, 1, 2])
+        self.schema_version = self.db_adaptor.get_schema_version()
+        if self.schema_version is None:
+            self.schema_version = schema_version
+        elif self.schema_version < schema_version:
+            self.logger.warning("DB %s is in schema version %d (run utils/bbc_schema_migrate.py to migrate)" %
+                                (self.db_adaptor.db_name, self.schema_version))
+        self.shards = [self.db_adaptor]
+        for i, shard in enumerate(dbconf.get("shards", []), start=1):
+            adaptor = MysqlAdaptor(self, db_name=shard.get("db_name", "%s_%d" % (db_name, i)),
+                                   server_info=(shard.get("db_addr", db_addr), shard.get("db_port", db_port),
+                                                shard.get("db_user", db_user), shard.get("db_pass", db_pass)),
+                                   engine=table_engine)
+            adaptor.open_db(shard.get("db_rootuser", db_rootuser), shard.get("db_rootpass", db_rootpass))
+            self.shards.append(adaptor)
+        new_counter_table = False
+        new_head_table = False
+        for adaptor in self.shards:
+            for tbl, definition, primary_key, indices in table_schemas[self.schema_version]:
+                adaptor.create_table(tbl, definition, primary_key=primary_key, indices=indices)
+                if self.schema_version >= 3:
+                    adaptor.create_table(tbl + ARCHIVE_SUFFIX, definition, primary_key=primary_key, indices=indices)
+            if len(self.body_index_fields) > 0:
+                adaptor.create_table('body_index_table', body_index_definition, primary_key=0,
+                                     indices=body_index_indices)
+            if len(adaptor.check_table_existence('counter_table')) == 0:
+                adaptor.create_table('counter_table', counter_table_definition, primary_key=0)
+                new_counter_table = True
+            if self.change_feed:
+                adaptor.create_table('change_feed_table', change_feed_definition, primary_key=0, indices=[3])
+                ret = self.exec_sql(sql="SELECT @@auto_increment_increment", db_adaptor=adaptor)
+                self.change_feed_id_steps.append(int(ret[0][0]) if ret else 1)
+            if len(adaptor.check_table_existence('head_table')) == 0:
+                adaptor.create_table('head_table', head_table_definition, primary_key=0, indices=[1])
+                new_head_table = True
+        if new_counter_table:
+            self.rebuild_counters()
+        if new_head_table:
+            self.rebuild_heads()
+        if len(self.shards) > 1 and self.deferred_indexing:
+            self.logger.warning("deferred_indexing is not available with shards")
+            self.deferred_indexing = False
+        if self.deferred_indexing:
+            self.db_adaptor.create_table('pending_index_table', pending_index_definition, primary_key=0)
+            # -- the background indexer has its own connection not to run in the DB transactions of inserts
+            self.index_adaptor = MysqlAdaptor(self, db_name=db_name, server_info=(db_addr, db_port, db_user, db_pass),
+                                              engine=table_engine)
+            self.index_adaptor.connect()
+            self.index_lock_name = "bbc_index_" + self.db_adaptor.db_name  # -- named locks are server-wide
+        self.replica_policy = dbconf.get("replica_policy", "round_robin")
+        self.read_your_writes_window = dbconf.get("read_your_writes_window", 5)
+        if len(self.shards) > 1 and len(dbconf.get("replicas", [])) > 0:
+            self.logger.warning("replicas are not available with shards")
+            return
+        for replica in dbconf.get("replicas", []):
+            self._add_replica(db_name, (replica.get("db_addr", db_addr), replica.get("db_port", db_port),
+                                        replica.get("db_user", db_user), replica.get("db_pass", db_pass)), table_engine)
+        self.replica_check_interval = dbconf.get("replica_check_interval", 1)
+
+    def _add_replica(self, db_name, server_info, table_engine):
+        """Connect to a read replica of the DB
+
+        A replica has two connections, one for reads and the other for the lag/latency checks by
+        _replica_monitor_loop(), so that the checks do not interleave with the reads.
+        """
+        adaptor = MysqlAdaptor(self, db_name=db_name, server_info=server_info, engine=table_engine)
+        probe = MysqlAdaptor(self, db_name=db_name, server_info=server_info, engine=table_engine)
+        try:
+            adaptor.connect()
+            probe.connect()
+        except Exception as e:
+            self.logger.error("cannot connect to the replica %s:%d (%s)" % (server_info[0], server_info[1], e))
+            return
+        self.replicas.append({
+            "name": "%s@%s:%d" % (self.domain_id_str, server_info[0], server_info[1]),
+            "adaptor": adaptor,
+            "probe": probe,
+            "available": False,
+            "lag": None,
+            "latency": 0,
+            "reads": 0,
+            "status_query": 0,  # -- index in REPLICA_STATUS_QUERIES
+        })
+
+    def _replica_monitor_loop(self, interval):
+        """Measure the replication lag and the latency of the replicas
+
+        A replica is used for reads only while its lag (Seconds_Behind_Source) is less than read_your_writes_window,
+        so that a transaction older than the window can be read from any replica in use. The DB user needs the
+        REPLICATION CLIENT privilege on the replicas. The statement before MySQL 8.0.22 (SHOW SLAVE STATUS) is used
+        if the replica does not support SHOW REPLICA STATUS.
+        """
+        while True:
+            for replica in self.replicas:
+                probe = replica["probe"]
+                start = time.time()
+                statement, column = REPLICA_STATUS_QUERIES[replica["status_query"]]
+                ret = self.exec_sql(sql=statement, db_adaptor=probe)
+                if ret is None and replica["status_query"] + 1 < len(REPLICA_STATUS_QUERIES):
+                    replica["status_query"] += 1
+                    statement, column = REPLICA_STATUS_QUERIES[replica["status_query"]]
+                    start = time.time()
+                    ret = self.exec_sql(sql=statement, db_adaptor=probe)
+                latency = time.time() - start
+                lag = None
+                if ret is not None and len(ret) > 0:
+                    lag = dict(zip(probe.db_cur.column_names, ret[0])).get(column, None)
+                replica["lag"] = lag
+                replica["latency"] = latency if replica["latency"] == 0 else replica["latency"] * 0.8 + latency * 0.2
+                replica["available"] = lag is not None and lag < self.read_your_writes_window
+                self.stats.update_stats("db_replica", replica["name"], {
+                    "available": replica["available"],
+                    "lag": lag,
+                    "latency": replica["latency"],
+                    "reads": replica["reads"],
+                })
+            time.sleep(interval)
+
+    def _record_write(self, txobj):
+        """Remember the ids written by the transaction for read_your_writes_window seconds"""
+        if len(self.replicas) == 0:
+            return
+        now = time.time()
+        keys = [txobj.transaction_id]
+        for asset_group_id, asset_id, user_id in self.get_asset_info(txobj):
+            keys.extend((asset_group_id, asset_id, user_id))
+        for base, point_to in self._get_topology_info(txobj):
+            keys.append(point_to)
+        for key in keys:
+            self.recent_writes.pop(key, None)
+            self.recent_writes[key] = now
+
+    def _select_replica(self, *keys):
+        """Select a replica for a read
+
+        Args:
+            keys (bytes): ids in the conditions of the read
+        Returns:
+            dict: the replica (None if the read should go to the primary)
+        """
+        if len(self.replicas) == 0:
+            return None
+        expire = time.time() - self.read_your_writes_window
+        while len(self.recent_writes) > 0 and next(iter(self.recent_writes.values())) < expire:
+            self.recent_writes.popitem(last=False)
+        for key in keys:
+            if key is not None and key in self.recent_writes:
+                self.stats.update_stats_increment("data_handler", "read_primary_recent_write", 1)
+                return None
+        candidates = [r for r in self.replicas if r["available"]]
+        if len(candidates) == 0:
+            return None
+        if self.replica_policy == "least_latency":
+            replica = min(candidates, key=lambda r: r["latency"])
+        else:
+            self.replica_counter += 1
+            replica = candidates[self.replica_counter % len(candidates)]
+        replica["reads"] += 1
+        return replica
+
+    def _exec_read(self, replica, sql, args=(), db_adaptor=None):
+        """exec_sql() on the replica (or db_adaptor if replica is None), falling back to the primary on errors"""
+        if replica is None:
+            return self.exec_sql(sql=sql, args=args, db_adaptor=db_adaptor)
+        ret = self.exec_sql(sql=sql, args=args, db_adaptor=replica["adaptor"])
+        if ret is None:
+            replica["available"] = False
+            self.stats.update_stats_increment("data_handler", "read_replica_fallback", 1)
+            ret = self.exec_sql(sql=sql, args=args)
+        return ret
 
-    def exec_sql(self, sql=None, args=(), commit=False, fetch_one=False):
+    def _shard(self, transaction_id):
+        """Return the adaptor of the shard that stores the transaction"""
+        if len(self.shards) == 1:
+            return self.shards[0]
+        return self.shards[shard_index(transaction_id, len(self.shards))]
+
+    def _fan_out(self, func):
+        """Call func(shard number, adaptor) for all the shards in parallel
+
+        Returns:
+            list: return values of func in the order of the shards
+        """
+        if len(self.shards) == 1:
+            return [func(0, self.shards[0])]
+        results = [None] * len(self.shards)
+
+        def run(i):
+            results[i] = func(i, self.shards[i])
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(self.shards))]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        return results
+
+    def _read_all_shards(self, replica, sql, args=()):
+        """Read the records from all the shards (from the replica if the DB is not sharded)
+
+        Returns:
+            list: records of all the shards (None if failed in any shard)
+        """
+        if len(self.shards) == 1:
+            return self._exec_read(replica, sql, args)
+        results = self._fan_out(lambda i, adaptor: self.exec_sql(sql=sql, args=args, db_adaptor=adaptor))
+        if None in results:
+            return None
+        return [row for rows in results for row in rows]
+
+    def _txid_filter_path(self):
+        if self.working_dir is None:
+            return None
+        return os.path.join(self.working_dir, self.domain_id_str + TXID_FILTER_SUFFIX)
+
+    def _setup_txid_filter(self, conf):
+        """Build the Bloom filter of the transaction_ids in the DB (transaction_table and its archive)
+
+        The snapshot saved by save_txid_filter() is used if no transaction has been inserted since then. The snapshot
+        is removed after loading, so that the filter is rebuilt from the DB if the core stops without saving it.
+
+        Args:
+            conf (dict): "initial_capacity", "error_rate", "snapshot" (bool), "exclusive" (bool: True if no other
+                         core or tool inserts transactions into the DB, see _check_txid_filter()), "max_staleness",
+                         "refresh_interval" and "refresh_overlap" (sec, see refresh_txid_filter())
+        """
+        self.txid_filter_exclusive = conf.get("exclusive", False)
+        self.txid_filter_max_staleness = conf.get("max_staleness", 3)
+        watermark = self._txid_filter_watermark()
+        num = self._count_transaction_rows()
+        if watermark is None or num is None or not self._init_txid_filter_marks():
+            return
+        path = self._txid_filter_path()
+        if conf.get("snapshot", True) and path is not None and os.path.exists(path):
+            txid_filter, tag = ScalableBloomFilter.load(path)
+            os.remove(path)
+            if txid_filter is not None and tag == watermark:
+                self.txid_filter = txid_filter
+                self._update_txid_filter_stats()
+                self.logger.info("txid filter is loaded from %s" % path)
+                return
+        txid_filter = ScalableBloomFilter(initial_capacity=max(conf.get("initial_capacity", 100000), num),
+                                          error_rate=conf.get("error_rate", 0.001))
+        tables = ["transaction_table"]
+        if self.schema_version >= 3:
+            tables.append("transaction_table" + ARCHIVE_SUFFIX)  # -- so that an archived one is not inserted again
+        for adaptor in self.shards:
+            for tbl in tables:
+                last = None
+                while True:
+                    if last is None:
+                        rows = self.exec_sql(sql="SELECT transaction_id FROM %s ORDER BY transaction_id LIMIT 10000" %
+                                                 tbl, db_adaptor=adaptor)
+                    else:
+                        rows = self.exec_sql(sql="SELECT transaction_id FROM %s WHERE transaction_id > %s "
+                                                 "ORDER BY transaction_id LIMIT 10000" % (tbl, adaptor.placeholder),
+                                             args=(last,), db_adaptor=adaptor)
+                    if rows is None:
+                        return
+                    if len(rows) == 0:
+                        break
+                    for row in rows:
+                        txid_filter.add(bytes(row[0]))
+                    last = rows[-1][0]
+        self.txid_filter = txid_filter
+        self._update_txid_filter_stats()
+        self.logger.info("txid filter is built from %d transactions" % len(txid_filter))
+
+    def _txid_filter_tables(self):
+        """Return the tables of which AUTO_INCREMENT ids grow at inserts (read by refresh_txid_filter())"""
+        if self.deferred_indexing:
+            return ["asset_info_table", "pending_index_table"]
+        return ["asset_info_table"]
+
+    def _init_txid_filter_marks(self):
+        """Set the position of refresh_txid_filter() to the end of the tables before the filter is built"""
+        now = time.time()
+        for tbl in self._txid_filter_tables():
+            rows = self._read_all_shards(None, "SELECT MAX(id) FROM %s" % tbl)
+            if rows is None:
+                return False
+            for i, row in enumerate(rows):
+                self.txid_filter_marks[(tbl, i)] = deque([(now, row[0] or 0)])
+        return True
+
+    def refresh_txid_filter(self, overlap=10):
+        """Add the transactions inserted into the DB by other cores (or tools) to the Bloom filter
+
+        The rows of asset_info_table (and pending_index_table) after the largest id read overlap seconds ago are
+        read, so that a row committed later than a larger id within overlap seconds is not missed. A transaction
+        without asset info is not found by this (only by NOTIFY_INSERTED or a DB lookup).
+
+        Args:
+            overlap (float): seconds to read again (the commit lag of the other cores)
+        Returns:
+            bool: True if refreshed
+        """
+        if self.txid_filter is None:
+            return False
+        start = time.time()
+        for (tbl, i), marks in self.txid_filter_marks.items():
+            while len(marks) > 1 and marks[1][0] <= start - overlap:
+                marks.popleft()
+            last_id = marks[0][1]
+            while True:
+                rows = self.exec_sql(sql="SELECT id, transaction_id FROM %s WHERE id > %s ORDER BY id LIMIT 10000" %
+                                         (tbl, self.shards[i].placeholder), args=(last_id,),
+                                     db_adaptor=self.shards[i])
+                if rows is None:
+                    return False
+                for row in rows:
+                    self.txid_filter.add(bytes(row[1]))
+                if len(rows) > 0:
+                    last_id = rows[-1][0]
+                if len(rows) < 10000:
+                    break
+            marks.append((start, max(last_id, marks[-1][1])))
+        self.txid_filter_refreshed_at = start
+        self._update_txid_filter_stats()
+        return True
+
+    def _txid_filter_refresh_loop(self, conf):
+        """Refresh the Bloom filter periodically (when it is not exclusive)
+
+        Args:
+            conf (dict): "refresh_interval" (sec) and "refresh_overlap" (sec)
+        """
+        interval = conf.get("refresh_interval", 1)
+        overlap = conf.get("refresh_overlap", 10)
+        while True:
+            if not self.refresh_txid_filter(overlap):
+                self.logger.warning("Failed to refresh the txid filter")
+            time.sleep(interval)
+
+    def _update_txid_filter_stats(self, force=True):
+        now = time.time()
+        if not force and now - self.txid_filter_stats_time < TXID_FILTER_STATS_INTERVAL:
+            return
+        self.txid_filter_stats_time = now
+        self.stats.update_stats("txid_filter", self.domain_id_str, {
+            "count": len(self.txid_filter),
+            "filters": len(self.txid_filter.filters),
+            "memory": self.txid_filter.memory_size(),
+            "estimated_error_rate": self.txid_filter.estimated_error_rate(),
+        })
+
+    def save_txid_filter(self):
+        """Save the Bloom filter of transaction_ids to be loaded at the next startup
+
+        Returns:
+            bool: True if saved
+        """
+        path = self._txid_filter_path()
+        if self.txid_filter is None or path is None or not self.config['bloom_filter'].get("snapshot", True):
+            return False
+        watermark = self._txid_filter_watermark()
+        if watermark is None:
+            return False
+        self.txid_filter.save(path, tag=watermark)
+        return True
+
+    def _txid_filter_watermark(self):
+        """Return a value that changes when transactions are inserted into the DB (the tag of the filter snapshot)
+
+        The number of rows alone does not change if as many transactions are removed or archived, so the last
+        AUTO_INCREMENT ids of asset_info_table (and pending_index_table, change_feed_table) are also taken. They
+        always grow at inserts. Removes may also change the value, which just makes the filter rebuilt.
+
+        Returns:
+            int: 64-bit digest of the row count and the last ids (None if failed)
+        """
+        values = [self._count_transaction_rows()]
+        tables = ["asset_info_table"]
+        if self.deferred_indexing:
+            tables.append("pending_index_table")
+        if self.change_feed:
+            tables.append("change_feed_table")
+        for tbl in tables:
+            rows = self._read_all_shards(None, "SELECT MAX(id) FROM %s" % tbl)
+            if rows is None:
+                return None
+            values.extend(row[0] for row in rows)
+        if values[0] is None:
+            return None
+        return int.from_bytes(hashlib.blake2b(repr(values).encode(), digest_size=8).digest(), "big")
+
+    def _count_transaction_rows(self):
+        """Return the number of rows in transaction_table of all the shards (None if failed)"""
+        rows = self._read_all_shards(None, "SELECT COUNT(*) FROM transaction_table")
+        if rows is None:
+            return None
+        return sum(row[0] for row in rows)
+
+    def add_to_txid_filter(self, transaction_id):
+        """Add a transaction_id inserted into the DB (by this or another core) to the Bloom filter"""
+        if self.txid_filter is None:
+            return
+        self.txid_filter.add(bytes(transaction_id))
+        self._update_txid_filter_stats(force=False)
+
+    def _check_txid_filter(self, transaction_id):
+        """Return False if the transaction is not in the DB (as of max_staleness seconds ago at most)
+
+        A negative is definite if the filter is "exclusive" (no other core or tool inserts into the DB). Otherwise,
+        the transactions inserted by the other cores are added by NOTIFY_INSERTED and refresh_txid_filter(), so a
+        negative is trusted only while the last refresh is within max_staleness. If the refresh is stale (or not
+        running, e.g., in the tools), the DB is checked and _verify_txid_filter() adds the missed transaction.
+        """
+        if self.txid_filter is None:
+            return True
+        if bytes(transaction_id) in self.txid_filter:
+            self.stats.update_stats_increment("txid_filter", "positive", 1)
+            return True
+        self.stats.update_stats_increment("txid_filter", "negative", 1)
+        if self.txid_filter_exclusive or time.time() - self.txid_filter_refreshed_at <= self.txid_filter_max_staleness:
+            return False
+        self.stats.update_stats_increment("txid_filter", "stale_negative", 1)
+        return True
+
+    def _verify_txid_filter(self, transaction_id, found):
+        """Update the filter by the result of the DB lookup after _check_txid_filter() returned True"""
+        if self.txid_filter is None:
+            return
+        if bytes(transaction_id) in self.txid_filter:
+            if not found:
+                self.stats.update_stats_increment("txid_filter", "false_positive", 1)
+        elif found:
+            self.stats.update_stats_increment("txid_filter", "missed_insert", 1)
+            self.add_to_txid_filter(transaction_id)
+
+    def has_transaction(self, transaction_id):
+        """Check whether the transaction is in the DB (including the archive with schema version 3 or later)
+
+        Args:
+            transaction_id (bytes): target transaction_id
+        Returns:
+            bool: True if exists
+        """
+        if self.segment_store is not None:
+            return transaction_id in self.segment_store
+        if not self._check_txid_filter(transaction_id):
+            return False
+        sql = "SELECT 1 FROM transaction_table WHERE transaction_id = %s" % self.db_adaptor.placeholder
+        args = (transaction_id,)
+        if self.schema_version >= 3:
+            sql += " UNION ALL SELECT 1 FROM transaction_table%s WHERE transaction_id = %s" % \
+                   (ARCHIVE_SUFFIX, self.db_adaptor.placeholder)
+            args = (transaction_id, transaction_id)
+        ret = self.exec_sql(sql=sql, args=args, db_adaptor=self._shard(transaction_id))
+        if ret is None:
+            return False
+        self._verify_txid_filter(transaction_id, len(ret) > 0)
+        return len(ret) > 0
+
+    def exec_sql(self, sql=None, args=(), commit=False, fetch_one=False, db_adaptor=None):
         """Execute sql sentence
 
         Args:
@@ -81,6 +856,7 @@ class DataHandler:
             args (list): Args for the SQL
             commit (bool): If True, commit is performed
             fetch_one (bool): If True, fetch just one record
+            db_adaptor (DbAdaptor): connection to use (default: self.db_adaptor)
         Returns:
             list: list of records
         """
@@ -88,19 +864,23 @@ class DataHandler:
         #print("sql=", sql)
         #if len(args) > 0:
         #    print("args=", args)
+        if db_adaptor is None:
+            db_adaptor = self.db_adaptor
         try:
-            if len(args) > 0:
-                self.db_adaptor.db_cur.execute(sql, args)
-            else:
-                self.db_adaptor.db_cur.execute(sql)
-            if commit:
-                self.db_adaptor.db.commit()
-                ret = None
-            else:
-                if fetch_one:
-                    ret = self.db_adaptor.db_cur.fetchone()
+            with db_adaptor.lock:
+                if len(args) > 0:
+                    db_adaptor.db_cur.execute(sql, args)
                 else:
-                    ret = self.db_adaptor.db_cur.fetchall()
+                    db_adaptor.db_cur.execute(sql)
+                if commit:
+                    if not db_adaptor.in_transaction:
+                        db_adaptor.db.commit()
+                    ret = None
+                else:
+                    if fetch_one:
+                        ret = db_adaptor.db_cur.fetchone()
+                    else:
+                        ret = db_adaptor.db_cur.fetchall()
         except:
             self.logger.error(traceback.format_exc())
             traceback.print_exc()
@@ -115,10 +895,12 @@ class DataHandler:
         """Retrieve asset information from transaction object
 
         Args:
-            txobj (BBcTransaction): transaction object to analyze
+            txobj (BBcTransaction|BBcTransactionIndex): transaction object (or its index) to analyze
         Returns:
             list: list of list [asset_group_id, asset_id, user_id, False, file_digest]
         """
+        if isinstance(txobj, bbclib.BBcTransactionIndex):
+            return list(txobj.asset_info)
         info = list()
         for idx, evt in enumerate(txobj.events):
             ast = evt.asset
@@ -136,10 +918,12 @@ class DataHandler:
         This method returns (from, to) list that describe the topology of transactions
 
         Args:
-            txobj (BBcTransaction): transaction object to analyze
+            txobj (BBcTransaction|BBcTransactionIndex): transaction object (or its index) to analyze
         Returns:
             list: list of tuple (base transaction_id, pointing transaction_id)
         """
+        if isinstance(txobj, bbclib.BBcTransactionIndex):
+            return [(txobj.transaction_id, point_to) for point_to in txobj.pointers]
         info = list()
         for reference in txobj.references:
             info.append((txobj.transaction_id, reference.transaction_id))  # (base, point_to)
@@ -148,6 +932,217 @@ class DataHandler:
                 info.append((txobj.transaction_id, pt.transaction_id))  # (base, point_to)
         return info
 
+    def _get_counter_keys(self, txobj):
+        """Return the keys of counter_table that the transaction is counted in"""
+        keys = set()
+        for asset_group_id, asset_id, user_id in self.get_asset_info(txobj):
+            keys.add(make_counter_key(asset_group_id=asset_group_id))
+            if user_id is not None:
+                keys.add(make_counter_key(user_id=user_id))
+                keys.add(make_counter_key(asset_group_id=asset_group_id, user_id=user_id))
+        return keys
+
+    def _update_counters(self, deltas, db_adaptor=None):
+        """Add deltas to the counters (in the DB transaction of the caller)
+
+        Args:
+            deltas (dict): key of counter_table -> delta (the number of inserted transactions, negative for remove)
+            db_adaptor (DbAdaptor): connection to use (default: self.db_adaptor)
+        Returns:
+            bool: True if successful
+        """
+        if len(deltas) == 0:
+            return True
+        keys = sorted(deltas.keys())  # -- lock the rows in the same order to avoid deadlocks
+        placeholder = self.db_adaptor.placeholder
+        sql = "INSERT INTO counter_table (counter_key, tx_count) VALUES %s " \
+              "ON DUPLICATE KEY UPDATE tx_count = tx_count + VALUES(tx_count)" % \
+              ",".join(["(%s, %s)" % (placeholder, placeholder)] * len(keys))
+        args = [val for key in keys for val in (key, deltas[key])]
+        return self.exec_sql(sql=sql, args=args, commit=True, db_adaptor=db_adaptor) is not None
+
+    def rebuild_counters(self, batch_size=1000):
+        """Recompute counter_table from asset_info_table and its archive (in each shard)
+
+        The counters are exact if no transaction is inserted, removed or archived during the rebuild.
+
+        Args:
+            batch_size (int): counters per INSERT statement
+        Returns:
+            int: the number of counters (None if failed)
+        """
+        total = 0
+        for adaptor in self.shards:
+            num = self._rebuild_counters_in_shard(adaptor, batch_size)
+            if num is None:
+                return None
+            total += num
+        return total
+
+    def _rebuild_counters_in_shard(self, adaptor, batch_size):
+        counts = dict()
+        source = "asset_info_table"
+        if self.schema_version >= 3:
+            # -- the counters keep counting the archived transactions
+            source = "(SELECT * FROM asset_info_table UNION ALL SELECT * FROM asset_info_table%s) AS t" % ARCHIVE_SUFFIX
+        for columns in [("asset_group_id",), ("user_id",), ("asset_group_id", "user_id")]:
+            ret = self.exec_sql(sql="SELECT %s, COUNT(DISTINCT transaction_id) FROM %s GROUP BY %s" %
+                                    (",".join(columns), source, ",".join(columns)), db_adaptor=adaptor)
+            if ret is None:
+                return None
+            for row in ret:
+                if None in row[:-1]:
+                    continue
+                counts[make_counter_key(**dict(zip(columns, row[:-1])))] = row[-1]
+        placeholder = adaptor.placeholder
+        rows = sorted(counts.items())
+        adaptor.begin()
+        if self.exec_sql(sql="DELETE FROM counter_table", commit=True, db_adaptor=adaptor) is None:
+            adaptor.rollback()
+            return None
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i+batch_size]
+            sql = "INSERT INTO counter_table (counter_key, tx_count) VALUES %s " \
+                  "ON DUPLICATE KEY UPDATE tx_count = VALUES(tx_count)" % \
+                  ",".join(["(%s, %s)" % (placeholder, placeholder)] * len(batch))
+            if self.exec_sql(sql=sql, args=[val for row in batch for val in row], commit=True,
+                             db_adaptor=adaptor) is None:
+                adaptor.rollback()
+                return None
+        adaptor.commit()
+        return len(rows)
+
+    def _get_head_keys(self, txobj):
+        """Return the keys of head_table for the transaction (key -> (asset_group_id, asset_id, user_id))"""
+        heads = dict()
+        for asset_group_id, asset_id, user_id in self.get_asset_info(txobj):
+            if user_id is not None:
+                heads[make_counter_key(asset_group_id=asset_group_id, user_id=user_id)] = \
+                    (asset_group_id, asset_id, user_id)
+        return heads
+
+    def _upsert_heads(self, rows, adaptor):
+        """Write rows (head_key, transaction_id, asset_id, timestamp) into head_table"""
+        if len(rows) == 0:
+            return True
+        placeholder = adaptor.placeholder
+        sql = "INSERT INTO head_table (head_key, transaction_id, asset_id, timestamp) VALUES %s " \
+              "ON DUPLICATE KEY UPDATE transaction_id = VALUES(transaction_id), asset_id = VALUES(asset_id), " \
+              "timestamp = VALUES(timestamp)" % ",".join(["(%s)" % ",".join([placeholder] * 4)] * len(rows))
+        return self.exec_sql(sql=sql, args=[val for row in rows for val in row], commit=True,
+                             db_adaptor=adaptor) is not None
+
+    def _update_heads(self, txobj, adaptor):
+        """Make the transaction the head of its (asset_group_id, user_id) pairs (in the DB transaction of the caller)
+
+        The current head is replaced unless the transaction is older than it and does not point to it, so that a
+        late insert of an old transaction (e.g., in the repair) does not move the head back.
+
+        Returns:
+            bool: True if successful
+        """
+        heads = self._get_head_keys(txobj)
+        if len(heads) == 0:
+            return True
+        keys = sorted(heads.keys())  # -- lock the rows in the same order to avoid deadlocks
+        placeholder = adaptor.placeholder
+        ret = self.exec_sql(sql="SELECT head_key, transaction_id, timestamp FROM head_table WHERE head_key IN (%s) "
+                                "FOR UPDATE" % ",".join([placeholder] * len(keys)),
+                            args=keys, db_adaptor=adaptor)
+        if ret is None:
+            return False
+        current = {bytes(row[0]): (bytes(row[1]), row[2]) for row in ret}
+        pointers = set(bytes(point_to) for base, point_to in self._get_topology_info(txobj))
+        rows = list()
+        for key in keys:
+            if key in current and current[key][0] not in pointers and txobj.timestamp < current[key][1]:
+                continue
+            rows.append((key, txobj.transaction_id, heads[key][1], txobj.timestamp))
+        return self._upsert_heads(rows, adaptor)
+
+    def _revert_heads(self, txobj, adaptor):
+        """Replace the heads at the removed transaction with the latest remaining ones in asset_info_table
+
+        Returns:
+            bool: True if successful
+        """
+        heads = self._get_head_keys(txobj)
+        if len(heads) == 0:
+            return True
+        placeholder = adaptor.placeholder
+        ret = self.exec_sql(sql="SELECT head_key FROM head_table WHERE transaction_id = %s" % placeholder,
+                            args=(txobj.transaction_id,), db_adaptor=adaptor)
+        if ret is None:
+            return False
+        timestamp = "timestamp" if self.schema_version >= 3 else "0"
+        rows = list()
+        for key in sorted(bytes(row[0]) for row in ret):
+            if key not in heads:
+                continue
+            asset_group_id, asset_id, user_id = heads[key]
+            latest = self.exec_sql(sql="SELECT transaction_id, asset_id, %s FROM asset_info_table WHERE "
+                                       "asset_group_id = %s AND user_id = %s ORDER BY id DESC LIMIT 1" %
+                                       (timestamp, placeholder, placeholder),
+                                   args=(asset_group_id, user_id), db_adaptor=adaptor)
+            if latest is None:
+                return False
+            if len(latest) == 0:
+                if self.exec_sql(sql="DELETE FROM head_table WHERE head_key = %s" % placeholder, args=(key,),
+                                 commit=True, db_adaptor=adaptor) is None:
+                    return False
+                continue
+            rows.append((key,) + tuple(latest[0]))
+        return self._upsert_heads(rows, adaptor)
+
+    def rebuild_heads(self, batch_size=1000):
+        """Recompute head_table from asset_info_table (the latest row of each pair in each shard)
+
+        Returns:
+            int: the number of heads (None if failed)
+        """
+        timestamp = "a.timestamp" if self.schema_version >= 3 else "0"
+        total = 0
+        for adaptor in self.shards:
+            ret = self.exec_sql(sql="SELECT a.asset_group_id, a.user_id, a.transaction_id, a.asset_id, %s FROM "
+                                    "asset_info_table a JOIN (SELECT MAX(id) AS id FROM asset_info_table WHERE "
+                                    "user_id IS NOT NULL GROUP BY asset_group_id, user_id) m ON a.id = m.id" %
+                                    timestamp, db_adaptor=adaptor)
+            if ret is None:
+                return None
+            rows = sorted((make_counter_key(asset_group_id=row[0], user_id=row[1]),) + tuple(row[2:]) for row in ret)
+            adaptor.begin()
+            ok = self.exec_sql(sql="DELETE FROM head_table", commit=True, db_adaptor=adaptor) is not None
+            for i in range(0, len(rows), batch_size):
+                ok = ok and self._upsert_heads(rows[i:i+batch_size], adaptor)
+            if not ok:
+                adaptor.rollback()
+                return None
+            adaptor.commit()
+            total += len(rows)
+        return total
+
+    def get_head(self, asset_group_id, user_id):
+        """Return the latest transaction of the asset group of the user (a primary key lookup in head_table)
+
+        With shards, the heads in the shards are compared by the timestamp.
+
+        Args:
+            asset_group_id (bytes): asset_group_id
+            user_id (bytes): user_id of the asset owner
+        Returns:
+            bytes: transaction_id of the head (None if not found)
+            bytes: asset_id of the asset in the head
+        """
+        self.stats.update_stats_increment("data_handler", "get_head", 1)
+        ret = self._read_all_shards(self._select_replica(asset_group_id, user_id),
+                                    sql="SELECT transaction_id, asset_id, timestamp FROM head_table WHERE "
+                                        "head_key = %s" % self.db_adaptor.placeholder,
+                                    args=(make_counter_key(asset_group_id=asset_group_id, user_id=user_id),))
+        if ret is None or len(ret) == 0:
+            return None, None
+        head = max(ret, key=lambda row: row[2])
+        return bytes(head[0]), bytes(head[1])
+
     def insert_transaction(self, txdata, txobj=None):
         """Insert transaction data and its asset files
 
@@ -155,7 +1150,7 @@ class DataHandler:
 
         Args:
             txdata (bytes): serialized transaction data
-            txobj (BBcTransaction): transaction object to insert
+            txobj (BBcTransaction|BBcTransactionIndex): transaction object (or its index) to insert
         Returns:
             set: set of asset_group_ids in the transaction
         """
@@ -164,7 +1159,10 @@ class DataHandler:
             txobj = self.core.validate_transaction(txdata)
             if txobj is None:
                 return None
-        if not self._insert_transaction_into_a_db(txobj):
+        if self.journal is not None:
+            if not self._append_to_journal(txobj):
+                return None
+        elif not self._insert_transaction_into_a_db(txobj):
             return None
 
         asset_group_ids = set()
@@ -172,35 +1170,388 @@ class DataHandler:
             asset_group_ids.add(asset_group_id)
         return asset_group_ids
 
+    def _append_to_journal(self, txobj):
+        """Append the transaction to the journal (it is applied to the DB by _journal_apply_loop())
+
+        Duplicates are detected by the journal and has_transaction() (the Bloom filter, if enabled, saves the lookup
+        in the DB for a new transaction).
+
+        Returns:
+            bool: True if the transaction is durable in the journal
+        """
+        if txobj.transaction_data is None:
+            txobj.serialize()
+        if self.journal.get_pending_transaction(txobj.transaction_id) is not None or \
+                self.has_transaction(txobj.transaction_id):
+            self.stats.update_stats_increment("data_handler", "insert_duplicate", 1)
+            return False
+        self.journal.append(txobj.transaction_id, txobj.transaction_data)
+        return True
+
+    def _journal_apply_loop(self, conf):
+        """Apply the records in the journal to the DB in order
+
+        A record that fails to be applied (e.g., the DB is down) is retried after retry_interval.
+
+        Args:
+            conf (dict): "batch_size" (records applied at a time) and "retry_interval" (sec)
+        """
+        batch_size = conf.get("batch_size", 100)
+        retry_interval = conf.get("retry_interval", 1)
+        while True:
+            records = self.journal.get_unapplied(batch_size)
+            if len(records) == 0:
+                self._update_journal_stats()
+                self.journal.append_event.wait(retry_interval)
+                self.journal.append_event.clear()
+                continue
+            applied = None
+            num = 0
+            for seq, txdata in records:
+                txobj = bbclib.scan_transaction(txdata)
+                if txobj is None:
+                    txobj = bbclib.BBcTransaction(deserialize=txdata)
+                if not self._insert_transaction_into_a_db(txobj) and not self.has_transaction(txobj.transaction_id):
+                    break
+                applied = seq
+                num += 1
+            if applied is not None:
+                self.journal.mark_applied(applied)
+                self.stats.update_stats_increment("data_handler", "journal_applied", num)
+            self._update_journal_stats()
+            if applied != records[-1][0]:
+                self.logger.warning("Failed to apply the journal (retry in %s sec)" % retry_interval)
+                time.sleep(retry_interval)
+
+    def _update_journal_stats(self):
+        num, age = self.journal.lag()
+        self.stats.update_stats("journal", self.domain_id_str, {
+            "appended": self.journal.sequence,
+            "applied": self.journal.applied,
+            "lag": num,
+            "lag_seconds": age,
+        })
+
     def _insert_transaction_into_a_db(self, txobj):
         """Insert transaction data into the transaction table of the specified DB
 
+        The transaction, its asset info, topology and the counters are inserted/updated in a DB transaction.
+        In the deferred indexing mode, the transaction is queued in pending_index_table instead of writing its asset
+        info, topology and counters, which are written by the background indexer (see _index_batch()).
+
         Args:
-            txobj (BBcTransaction): transaction object to insert
+            txobj (BBcTransaction|BBcTransactionIndex): transaction object (or its index) to insert
         Returns:
             bool: True if successful
         """
         #print("_insert_transaction_into_a_db: for txid =", txobj.transaction_id.hex())
         if txobj.transaction_data is None:
             txobj.serialize()
-        ret = self.exec_sql(sql="INSERT INTO transaction_table VALUES (%s,%s)" % (self.db_adaptor.placeholder,
-                                                                                  self.db_adaptor.placeholder),
-                            args=(txobj.transaction_id, txobj.transaction_data), commit=True)
-        if ret is None:
+        # -- the primary key of transaction_table rejects a duplicate in it, but not one in the archive
+        if self.segment_store is not None or self.schema_version >= 3:
+            duplicate = self.has_transaction(txobj.transaction_id)
+        else:
+            # -- with the Bloom filter, a positive is checked to count the duplicate
+            duplicate = self.txid_filter is not None and bytes(txobj.transaction_id) in self.txid_filter and \
+                self.has_transaction(txobj.transaction_id)
+        if duplicate:
+            self.stats.update_stats_increment("data_handler", "insert_duplicate", 1)
+            return False
+        adaptor = self._shard(txobj.transaction_id)
+        adaptor.begin()
+        try:
+            written = self._write_transaction(txobj, adaptor)
+            sequence = adaptor.db_cur.lastrowid if written and self.deferred_indexing else None
+        except Exception:
+            # -- an exception (e.g., of the segment store) must not leave the connection locked
+            self._rollback_insert(txobj, adaptor)
+            raise
+        if not written:
+            self._rollback_insert(txobj, adaptor)
+            return False
+        adaptor.commit()
+        self.add_to_txid_filter(txobj.transaction_id)
+        if self.deferred_indexing:
+            self.last_index_sequence = max(self.last_index_sequence, sequence)
+            self.index_event.set()
+        self._record_write(txobj)
+        self._notify_change_feed()
+        if self.segment_store is not None:
+            self.stats.update_stats("segment_store", self.domain_id_str, self.segment_store.get_stats())
+        return True
+
+    def _write_transaction(self, txobj, adaptor):
+        """Write the transaction and its rows in the DB transaction begun by _insert_transaction_into_a_db()
+
+        In the deferred indexing mode, the last row written is the one of pending_index_table.
+
+        Args:
+            txobj (BBcTransaction|BBcTransactionIndex): transaction object (or its index) to insert
+            adaptor (DbAdaptor): shard of the transaction
+        Returns:
+            bool: True if successful (the caller commits or rolls back the DB transaction)
+        """
+        placeholder = adaptor.placeholder
+        if self.segment_store is not None:
+            self.segment_store.append(txobj.transaction_id, txobj.transaction_data)
+        elif self.schema_version >= 3:
+            ret = self.exec_sql(sql="INSERT INTO transaction_table VALUES (%s,%s,%s)" % (placeholder, placeholder,
+                                                                                         placeholder),
+                                args=(txobj.transaction_id, txobj.transaction_data, txobj.timestamp), commit=True,
+                                db_adaptor=adaptor)
+            if ret is None:
+                return False
+        else:
+            ret = self.exec_sql(sql="INSERT INTO transaction_table VALUES (%s,%s)" % (placeholder, placeholder),
+                                args=(txobj.transaction_id, txobj.transaction_data), commit=True, db_adaptor=adaptor)
+            if ret is None:
+                return False
+        if self.change_feed:
+            asset_group_ids = sorted(set(info[0] for info in self.get_asset_info(txobj)))
+            ret = self.exec_sql(sql="INSERT INTO change_feed_table(transaction_id, asset_group_ids, inserted_at) "
+                                    "VALUES (%s,%s,%s)" % (placeholder, placeholder, placeholder),
+                                args=(txobj.transaction_id, pack_ids(asset_group_ids), int(time.time())),
+                                commit=True, db_adaptor=adaptor)
+            if ret is None:
+                return False
+
+        if self.deferred_indexing:
+            return self.exec_sql(sql="INSERT INTO pending_index_table(transaction_id) VALUES (%s)" % placeholder,
+                                 args=(txobj.transaction_id,), commit=True, db_adaptor=adaptor) is not None
+
+        for row in self._get_asset_info_rows(txobj):
+            ret = self.exec_sql(sql="INSERT INTO asset_info_table(%s) VALUES (%s)" %
+                                    (self._asset_info_columns(), ",".join([placeholder] * len(row))),
+                                args=row, commit=True, db_adaptor=adaptor)
+            if ret is None:
+                return False
+        for row in self._get_topology_rows(txobj):
+            ret = self.exec_sql(sql="INSERT INTO topology_table(%s) VALUES (%s)" %
+                                    (self._topology_columns(), ",".join([placeholder] * len(row))),
+                                args=row, commit=True, db_adaptor=adaptor)
+            if ret is None:
+                return False
+        if not self._insert_body_index_rows(self._get_body_index_rows(txobj), adaptor):
             return False
+        return self._update_counters({key: 1 for key in self._get_counter_keys(txobj)}, db_adaptor=adaptor) and \
+            self._update_heads(txobj, adaptor)
 
+    def _asset_info_columns(self):
+        if self.schema_version >= 3:
+            return "transaction_id, asset_group_id, asset_id, user_id, timestamp"
+        return "transaction_id, asset_group_id, asset_id, user_id"
+
+    def _topology_columns(self):
+        if self.schema_version >= 3:
+            return "base, point_to, timestamp"
+        return "base, point_to"
+
+    def _get_asset_info_rows(self, txobj):
+        """Return the rows of asset_info_table for the transaction (in the order of _asset_info_columns())"""
+        rows = list()
         for asset_group_id, asset_id, user_id in self.get_asset_info(txobj):
-            self.exec_sql(sql="INSERT INTO asset_info_table(transaction_id, asset_group_id, asset_id, user_id) "
-                              "VALUES (%s, %s, %s, %s)" % (
-                              self.db_adaptor.placeholder, self.db_adaptor.placeholder,
-                              self.db_adaptor.placeholder, self.db_adaptor.placeholder),
-                          args=(txobj.transaction_id, asset_group_id, asset_id, user_id), commit=True)
-        for base, point_to in self._get_topology_info(txobj):
-            self.exec_sql(sql="INSERT INTO topology_table(base, point_to) VALUES (%s, %s)" %
-                              (self.db_adaptor.placeholder, self.db_adaptor.placeholder),
-                          args=(base, point_to), commit=True)
-            #print("topology: base:%s, point_to:%s" % (base.hex(), point_to.hex()))
-        return True
+            row = (txobj.transaction_id, asset_group_id, asset_id, user_id)
+            rows.append(row + (txobj.timestamp,) if self.schema_version >= 3 else row)
+        return rows
+
+    def _get_topology_rows(self, txobj):
+        """Return the rows of topology_table for the transaction (in the order of _topology_columns())"""
+        if self.schema_version >= 3:
+            return [(base, point_to, txobj.timestamp) for base, point_to in self._get_topology_info(txobj)]
+        return self._get_topology_info(txobj)
+
+    def _get_body_index_rows(self, txobj):
+        """Return the rows of body_index_table for the transaction (transaction_id, asset_group_id, field, num_value,
+        str_value)"""
+        if len(self.body_index_fields) == 0:
+            return []
+        if isinstance(txobj, bbclib.BBcTransactionIndex):
+            if not any(info[0] in self.body_index_fields for info in txobj.asset_info):
+                return []
+            txobj = txobj.get_transaction()  # -- asset bodies are not in the index
+            if txobj is None:
+                return []
+        rows = set()
+        for part in txobj.events + txobj.relations:
+            fields = self.body_index_fields.get(part.asset_group_id, None)
+            if fields is None or part.asset is None:
+                continue
+            for field, num_value, str_value in extract_body_fields(part.asset.asset_body, fields):
+                rows.add((txobj.transaction_id, part.asset_group_id, field, num_value, str_value))
+        return sorted(rows, key=lambda row: row[2])
+
+    def _insert_body_index_rows(self, rows, adaptor):
+        """Insert rows of body_index_table (in the DB transaction of the caller)
+
+        Returns:
+            bool: True if successful
+        """
+        if len(rows) == 0:
+            return True
+        values = ",".join(["(%s)" % ",".join([adaptor.placeholder] * 5)] * len(rows))
+        return self.exec_sql(sql="INSERT INTO body_index_table(transaction_id, asset_group_id, field, num_value, "
+                                 "str_value) VALUES %s" % values,
+                             args=[val for row in rows for val in row], commit=True, db_adaptor=adaptor) is not None
+
+    def _rollback_insert(self, txobj, adaptor):
+        """Rollback the DB transaction of _insert_transaction_into_a_db()"""
+        adaptor.rollback()
+        if self.segment_store is not None:
+            self.segment_store.remove(txobj.transaction_id)
+
+    def _indexer_loop(self, conf):
+        """Write the asset info, topology and counters of the transactions in pending_index_table
+
+        Args:
+            conf (dict): "batch_size" (transactions per DB transaction) and "interval" (sec to sleep when idle)
+        """
+        batch_size = conf.get("batch_size", 500)
+        interval = conf.get("interval", 1)
+        while True:
+            num = self._index_batch(batch_size)
+            if num is None:
+                time.sleep(interval)
+            elif num < batch_size:
+                self.index_event.wait(interval)
+                self.index_event.clear()
+
+    def _index_batch(self, batch_size):
+        """Index a batch of pending transactions in a DB transaction and advance the watermark
+
+        The cores (and tools) sharing the DB run their own indexers, so a batch is indexed only by the one holding
+        the named lock of the domain (GET_LOCK on the indexer connection). The others just advance the watermark.
+
+        Returns:
+            int: the number of indexed transactions (None if failed)
+        """
+        adaptor = self.index_adaptor
+        ret = self.exec_sql(sql="SELECT GET_LOCK(%s, 0)" % adaptor.placeholder, args=(self.index_lock_name,),
+                            db_adaptor=adaptor)
+        if ret is None:
+            return None
+        if ret[0][0] == 1:
+            try:
+                rows = self._index_pending_transactions(batch_size)
+            finally:
+                self.exec_sql(sql="SELECT RELEASE_LOCK(%s)" % adaptor.placeholder, args=(self.index_lock_name,),
+                              db_adaptor=adaptor)
+            if rows is None:
+                return None
+        else:
+            rows = []  # -- another indexer is working on the batch
+
+        last_sequence = self.last_index_sequence  # -- committed before the MIN(id) below
+        ret = self.exec_sql(sql="SELECT MIN(id) FROM pending_index_table", db_adaptor=adaptor)
+        if ret is None:
+            return None
+        with self.index_condition:
+            if ret[0][0] is not None:
+                self.indexed_up_to = max(self.indexed_up_to, ret[0][0] - 1)
+            else:
+                self.indexed_up_to = max(self.indexed_up_to, last_sequence, rows[-1][0] if len(rows) > 0 else 0)
+            self.index_condition.notify_all()
+        self.stats.update_stats("deferred_indexing", self.domain_id_str, {
+            "indexed_up_to": self.indexed_up_to,
+            "last_sequence": self.last_index_sequence,
+            "lag": max(0, self.last_index_sequence - self.indexed_up_to),
+        })
+        return len(rows)
+
+    def _index_pending_transactions(self, batch_size):
+        """Write the asset info, topology and counters of the oldest pending transactions in a DB transaction
+
+        Returns:
+            list: list of (sequence, transaction data) of the indexed transactions (None if failed)
+        """
+        adaptor = self.index_adaptor
+        if self.segment_store is not None:
+            rows = self.exec_sql(sql="SELECT id, transaction_id FROM pending_index_table ORDER BY id LIMIT %d" %
+                                     batch_size, db_adaptor=adaptor)
+            if rows is not None:
+                rows = [(seq, self.segment_store.get(txid)) for seq, txid in rows]
+        else:
+            rows = self.exec_sql(sql="SELECT p.id, t.transaction_data FROM pending_index_table p LEFT JOIN "
+                                     "transaction_table t ON p.transaction_id = t.transaction_id ORDER BY p.id "
+                                     "LIMIT %d" % batch_size, db_adaptor=adaptor)
+        if rows is None:
+            return None
+        if len(rows) > 0:
+            asset_info = list()
+            topology = list()
+            body_index = list()
+            deltas = Counter()
+            txobjs = list()
+            for seq, txdata in rows:
+                if txdata is None:
+                    continue  # -- removed before indexed
+                txobj = bbclib.scan_transaction(bytes(txdata))
+                if txobj is None:
+                    txobj = bbclib.BBcTransaction(deserialize=bytes(txdata))
+                asset_info.extend(self._get_asset_info_rows(txobj))
+                topology.extend(self._get_topology_rows(txobj))
+                body_index.extend(self._get_body_index_rows(txobj))
+                deltas.update(self._get_counter_keys(txobj))
+                txobjs.append(txobj)
+            adaptor.begin()
+            try:
+                ok = self._write_index_rows(adaptor, rows, asset_info, topology, body_index, deltas, txobjs)
+            except Exception:
+                adaptor.rollback()
+                raise
+            if not ok:
+                adaptor.rollback()
+                return None
+            adaptor.commit()
+            for txobj in txobjs:
+                self._record_write(txobj)
+            self.stats.update_stats_increment("data_handler", "indexed_transactions", len(rows))
+        return rows
+
+    def _write_index_rows(self, adaptor, rows, asset_info, topology, body_index, deltas, txobjs):
+        """Write the rows of a batch of _index_pending_transactions() in the DB transaction begun by it
+
+        Returns:
+            bool: True if successful (the caller commits or rolls back the DB transaction)
+        """
+        placeholder = adaptor.placeholder
+        ok = True
+        if len(asset_info) > 0:
+            values = ",".join(["(%s)" % ",".join([placeholder] * len(asset_info[0]))] * len(asset_info))
+            ok = self.exec_sql(sql="INSERT INTO asset_info_table(%s) VALUES %s" %
+                                   (self._asset_info_columns(), values),
+                               args=[val for row in asset_info for val in row], commit=True,
+                               db_adaptor=adaptor) is not None
+        if ok and len(topology) > 0:
+            values = ",".join(["(%s)" % ",".join([placeholder] * len(topology[0]))] * len(topology))
+            ok = self.exec_sql(sql="INSERT INTO topology_table(%s) VALUES %s" % (self._topology_columns(), values),
+                               args=[val for row in topology for val in row], commit=True,
+                               db_adaptor=adaptor) is not None
+        ok = ok and self._insert_body_index_rows(body_index, adaptor)
+        ok = ok and self._update_counters(deltas, db_adaptor=adaptor)
+        for txobj in txobjs:
+            ok = ok and self._update_heads(txobj, adaptor)
+        if ok:
+            ok = self.exec_sql(sql="DELETE FROM pending_index_table WHERE id IN (%s)" %
+                                   ",".join([placeholder] * len(rows)),
+                               args=[row[0] for row in rows], commit=True, db_adaptor=adaptor) is not None
+        return ok
+
+    def wait_for_index(self, sequence=None, timeout=10):
+        """Wait until the transactions up to the sequence number are indexed (read-your-writes)
+
+        Args:
+            sequence (int): index sequence number of an insert (default: the last insert in this handler)
+            timeout (float): timeout in seconds
+        Returns:
+            bool: True if indexed (always True if the deferred indexing is disabled)
+        """
+        if not self.deferred_indexing:
+            return True
+        if sequence is None:
+            sequence = self.last_index_sequence
+        self.index_event.set()
+        with self.index_condition:
+            return self.index_condition.wait_for(lambda: self.indexed_up_to >= sequence, timeout)
 
     def remove(self, transaction_id, txobj=None):
         """Delete all data regarding the specified transaction_id
@@ -214,25 +1565,410 @@ class DataHandler:
         if transaction_id is None:
             return
         if txobj is None:
-            txdata = self.exec_sql(sql="SELECT * FROM transaction_table WHERE transaction_id = %s" %
-                                   self.db_adaptor.placeholder, args=(transaction_id,))
-            txobj = bbclib.BBcTransaction(deserialize=txdata[0][1])
+            txdata = self._get_transaction_data(transaction_id)
+            if txdata is None:
+                return
+            txobj = bbclib.scan_transaction(txdata)
+            if txobj is None:
+                txobj = bbclib.BBcTransaction(deserialize=bytes(txdata))
         elif txobj.transaction_id != transaction_id:
             return
         self._remove_transaction(txobj)
 
-    def _remove_transaction(self, txobj):
-        """Remove transaction from DB"""
+    def _remove_transaction(self, txobj, adaptor=None):
+        """Remove transaction from DB (the counters are decremented in the same DB transaction)
+
+        Args:
+            txobj (BBcTransaction|BBcTransactionIndex): transaction to remove
+            adaptor (DbAdaptor): shard to remove the transaction from (default: the shard of the transaction_id)
+        Returns:
+            bool: True if removed
+        """
         #print("_remove_transaction: for txid =", txobj.transaction_id.hex())
-        self.exec_sql(sql="DELETE FROM transaction_table WHERE transaction_id = %s" % self.db_adaptor.placeholder,
-                      args=(txobj.transaction_id,), commit=True)
-        for base, point_to in self._get_topology_info(txobj):
-            self.exec_sql(sql="DELETE FROM topology_table WHERE base = %s AND point_to = %s" %
-                          (self.db_adaptor.placeholder,self.db_adaptor.placeholder),
-                          args=(base, point_to), commit=True)
+        if adaptor is None:
+            adaptor = self._shard(txobj.transaction_id)
+        self._record_write(txobj)
+        adaptor.begin()
+        try:
+            removed = self._delete_transaction(txobj, adaptor)
+        except Exception:
+            adaptor.rollback()
+            raise
+        if not removed:
+            adaptor.rollback()
+            return False
+        adaptor.commit()
+        return True
+
+    def _delete_transaction(self, txobj, adaptor):
+        """Delete the transaction and its rows in the DB transaction begun by _remove_transaction()
+
+        Returns:
+            bool: True if successful (the caller commits or rolls back the DB transaction)
+        """
+        placeholder = adaptor.placeholder
+        if self.segment_store is not None:
+            if not self.segment_store.remove(txobj.transaction_id):
+                return False
+        else:
+            ret = self.exec_sql(sql="DELETE FROM transaction_table WHERE transaction_id = %s" % placeholder,
+                                args=(txobj.transaction_id,), commit=True, db_adaptor=adaptor)
+            if ret is None or adaptor.db_cur.rowcount == 0:
+                return False
+        if self.deferred_indexing:
+            ret = self.exec_sql(sql="DELETE FROM pending_index_table WHERE transaction_id = %s" % placeholder,
+                                args=(txobj.transaction_id,), commit=True, db_adaptor=adaptor)
+            if ret is not None and adaptor.db_cur.rowcount > 0:
+                return True  # -- not indexed yet
+        self.exec_sql(sql="DELETE FROM asset_info_table WHERE transaction_id = %s" % placeholder,
+                      args=(txobj.transaction_id,), commit=True, db_adaptor=adaptor)
+        # -- all the topology rows of which base is the transaction are removed at once (on idx_base_point_to)
+        self.exec_sql(sql="DELETE FROM topology_table WHERE base = %s" % placeholder,
+                      args=(txobj.transaction_id,), commit=True, db_adaptor=adaptor)
+        if len(self.body_index_fields) > 0:
+            self.exec_sql(sql="DELETE FROM body_index_table WHERE transaction_id = %s" % placeholder,
+                          args=(txobj.transaction_id,), commit=True, db_adaptor=adaptor)
+        return self._update_counters({key: -1 for key in self._get_counter_keys(txobj)}, db_adaptor=adaptor) and \
+            self._revert_heads(txobj, adaptor)
+
+    def rebalance_shards(self, batch_size=1000):
+        """Move the transactions stored in a shard other than the one given by shard_index()
+
+        This is used after shards are added to the config. Each transaction is inserted into its new shard and then
+        removed from the old one, so that a transaction left in both shards by an interruption is moved at the next
+        run. Inserts and removes should be stopped during the rebalancing.
+
+        Args:
+            batch_size (int): transaction_ids read at a time from a shard
+        Returns:
+            int: the number of moved transactions (None if failed)
+        """
+        if self.segment_store is not None:
+            self.logger.error("rebalance_shards is not available with segment_store")
+            return None
+        moved = 0
+        for i, adaptor in enumerate(self.shards):
+            last = b''
+            while True:
+                rows = self.exec_sql(sql="SELECT transaction_id FROM transaction_table WHERE transaction_id > %s "
+                                         "ORDER BY transaction_id LIMIT %d" % (adaptor.placeholder, batch_size),
+                                     args=(last,), db_adaptor=adaptor)
+                if rows is None:
+                    return None
+                if len(rows) == 0:
+                    break
+                last = rows[-1][0]
+                for row in rows:
+                    txid = bytes(row[0])
+                    if shard_index(txid, len(self.shards)) == i:
+                        continue
+                    txdata = self.exec_sql(sql="SELECT transaction_data FROM transaction_table WHERE "
+                                               "transaction_id = %s" % adaptor.placeholder,
+                                           args=(txid,), db_adaptor=adaptor)
+                    if txdata is None or len(txdata) == 0:
+                        return None
+                    txobj = bbclib.scan_transaction(txdata[0][0])
+                    if txobj is None:
+                        txobj = bbclib.BBcTransaction(deserialize=txdata[0][0])
+                    if not self.has_transaction(txid) and not self._insert_transaction_into_a_db(txobj):
+                        return None
+                    if not self._remove_transaction(txobj, adaptor=adaptor):
+                        return None
+                    moved += 1
+        self.stats.update_stats_increment("data_handler", "rebalanced_transactions", moved)
+        return moved
+
+    def backfill_body_index(self, batch_size=1000):
+        """Write body_index_table for the transactions inserted before their fields are declared in "body_index"
+
+        The rows of a transaction are replaced in a DB transaction, so that the backfill can be run again (e.g., after
+        fields are added to the config) while the core is running.
+
+        Args:
+            batch_size (int): asset_info_table rows read at a time
+        Returns:
+            int: the number of indexed transactions (None if failed)
+        """
+        if len(self.body_index_fields) == 0:
+            return 0
+        indexed = 0
+        asset_group_ids = list(self.body_index_fields.keys())
+        for adaptor in self.shards:
+            placeholder = adaptor.placeholder
+            last = 0
+            while True:
+                rows = self.exec_sql(sql="SELECT id, transaction_id FROM asset_info_table WHERE asset_group_id IN (%s) "
+                                         "AND id > %s ORDER BY id LIMIT %d" %
+                                         (",".join([placeholder] * len(asset_group_ids)), placeholder, batch_size),
+                                     args=asset_group_ids + [last], db_adaptor=adaptor)
+                if rows is None:
+                    return None
+                if len(rows) == 0:
+                    break
+                last = rows[-1][0]
+                txids = list(OrderedDict((bytes(row[1]), True) for row in rows).keys())
+                body_index = list()
+                for txid in txids:
+                    txdata = self._get_transaction_data(txid)
+                    if txdata is None:
+                        continue
+                    txobj = bbclib.scan_transaction(txdata)
+                    if txobj is None:
+                        txobj = bbclib.BBcTransaction(deserialize=bytes(txdata))
+                    body_index.extend(self._get_body_index_rows(txobj))
+                adaptor.begin()
+                ok = self.exec_sql(sql="DELETE FROM body_index_table WHERE transaction_id IN (%s)" %
+                                       ",".join([placeholder] * len(txids)),
+                                   args=txids, commit=True, db_adaptor=adaptor) is not None
+                ok = ok and self._insert_body_index_rows(body_index, adaptor)
+                if not ok:
+                    adaptor.rollback()
+                    return None
+                adaptor.commit()
+                indexed += len(txids)
+        self.stats.update_stats_increment("data_handler", "body_index_backfilled", indexed)
+        return indexed
+
+    def _notify_change_feed(self):
+        """Wake up the readers waiting in read_change_feed()"""
+        if not self.change_feed:
+            return
+        with self.change_feed_condition:
+            self.change_feed_generation += 1
+            self.change_feed_condition.notify_all()
+
+    def _change_feed_prune_loop(self, conf):
+        """Delete the entries of the change feed older than the retention periodically
+
+        Args:
+            conf (dict): "retention" (sec) and "prune_interval" (sec)
+        """
+        retention = conf.get("retention", 7*24*3600)
+        interval = conf.get("prune_interval", 3600)
+        while True:
+            horizon = int(time.time()) - retention
+            for adaptor in self.shards:
+                self.exec_sql(sql="DELETE FROM change_feed_table WHERE inserted_at < %s" % adaptor.placeholder,
+                              args=(horizon,), commit=True, db_adaptor=adaptor)
+            time.sleep(interval)
+
+    def get_change_feed_token(self):
+        """Return the token at the end of the change feed (to read only the transactions inserted after this call)
+
+        The token points at the end of the ids committed without a gap (see _committed_feed_rows()), so an insert
+        committed later by another core with a smaller id is not skipped.
+
+        Returns:
+            bytes: resume token for read_change_feed() (None if failed)
+        """
+        now = int(time.time())
+        last_ids = list()
+        for i, adaptor in enumerate(self.shards):
+            ret = self.exec_sql(sql="SELECT MAX(id) FROM change_feed_table WHERE inserted_at <= %s" %
+                                    adaptor.placeholder, args=(now - self.change_feed_commit_lag,),
+                                db_adaptor=adaptor)
+            if ret is None:
+                return None
+            last_id = ret[0][0] or 0
+            while True:
+                rows = self._read_feed_rows(adaptor, last_id, MAX_CHANGE_FEED_BATCH)
+                if rows is None:
+                    return None
+                rows = self._committed_feed_rows(i, last_id, rows, now)
+                if len(rows) == 0:
+                    break
+                last_id = rows[-1][0]
+            last_ids.append(last_id)
+        return make_search_cursor(1, last_ids if len(self.shards) > 1 else last_ids[0])
+
+    def _read_feed_rows(self, adaptor, last_id, count):
+        """Read the entries of the change feed in a shard after last_id in the order of the ids"""
+        return self.exec_sql(sql="SELECT id, transaction_id, asset_group_ids, inserted_at FROM change_feed_table "
+                                 "WHERE id > %s ORDER BY id LIMIT %d" % (adaptor.placeholder, count),
+                             args=(last_id,), db_adaptor=adaptor)
+
+    def _committed_feed_rows(self, shard, last_id, rows, now):
+        """Return the leading rows up to the first gap in the ids that may still be filled
+
+        With several cores writing the same DB, an id is taken at the INSERT but becomes visible at the commit, so
+        a smaller id can be committed after a larger one. A gap is skipped only when the row after it is older than
+        the commit lag (the insert of the missing id is then taken as rolled back or pruned).
+
+        Args:
+            shard (int): index of the shard
+            last_id (int): the last id already read (0: the rows start at the oldest entry)
+            rows (list): rows of _read_feed_rows()
+            now (int): current time
+        Returns:
+            list: the rows that can be read without skipping an id committed later
+        """
+        step = self.change_feed_id_steps[shard] if shard < len(self.change_feed_id_steps) else 1
+        for n, row in enumerate(rows):
+            if row[0] != last_id + step and row[3] > now - self.change_feed_commit_lag:
+                return rows[:n]
+            last_id = row[0]
+        return rows
+
+    def read_change_feed(self, token=None, count=100, include_data=False, wait=0):
+        """Read the transactions inserted after the position given by the token
+
+        The insert sequence is the id of change_feed_table, which is written in the DB transaction of the insert.
+        The ids may be committed out of order by several cores, so the entries after a gap in the ids are returned
+        only when the gap is older than the commit lag (conf "commit_lag" of change_feed). With shards, the token has
+        the last id in each shard, and the entries of the shards are merged in the order of the insert time.
+
+        Args:
+            token (bytes): resume token returned by the previous read (None: from the oldest entry in the feed)
+            count (int): the maximum number of entries (up to MAX_CHANGE_FEED_BATCH)
+            include_data (bool): If True, the entries include the transaction data
+            wait (float): seconds to wait for an insert if no entry is available (the DB is polled every
+                          CHANGE_FEED_WAIT_SLICE for the inserts by other cores)
+        Returns:
+            list: entries [sequence, transaction_id, list of asset_group_ids] (+ [transaction_data] if include_data)
+            bytes: resume token for the next read (None if failed)
+        """
+        if not self.change_feed:
+            self.logger.error("change_feed is not enabled")
+            return None, None
+        last_ids = [0] * len(self.shards)
+        if token is not None:
+            direction, last_id = parse_search_cursor(token)
+            if direction is None:
+                return None, None
+            last_ids = last_id if isinstance(last_id, list) else [last_id]
+            if len(last_ids) != len(self.shards):
+                return None, None
+        count = max(1, min(count, MAX_CHANGE_FEED_BATCH))
+
+        deadline = time.time() + wait
+        while True:
+            with self.change_feed_condition:
+                generation = self.change_feed_generation
+            # -- the DB is read without the condition, so that the inserts are not blocked by the readers
+            results = self._fan_out(lambda i, adaptor: self._read_feed_rows(adaptor, last_ids[i], count))
+            if None in results:
+                return None, None
+            now = int(time.time())
+            results = [self._committed_feed_rows(i, last_ids[i], rows, now) for i, rows in enumerate(results)]
+            if any(len(rows) > 0 for rows in results) or time.time() >= deadline:
+                break
+            with self.change_feed_condition:
+                if self.change_feed_generation == generation:
+                    # -- the inserts (and the commits filling a gap) by other cores do not notify this condition
+                    self.change_feed_condition.wait(min(deadline - time.time(), CHANGE_FEED_WAIT_SLICE))
+        records = list()
+        for i, rows in enumerate(results):
+            inserted_at = 0
+            for row in rows:
+                inserted_at = max(inserted_at, row[3])  # -- keep the order of the ids in a shard
+                records.append((inserted_at, i, row[0], row))
+        entries = list()
+        for inserted_at, i, seq, row in sorted(records)[:count]:
+            entry = [row[0], bytes(row[1]), unpack_ids(row[2])]
+            if include_data:
+                txdata = self._get_transaction_data(bytes(row[1]))
+                entry.append(bytes(txdata) if txdata is not None else b'')
+            entries.append(entry)
+            last_ids[i] = row[0]
+        self.stats.update_stats_increment("change_feed", "read_entries", len(entries))
+        next_token = make_search_cursor(1, last_ids if len(self.shards) > 1 else last_ids[0])
+        return entries, next_token
+
+    def _archive_loop(self, conf):
+        """Archive the transactions older than the retention periodically
+
+        Args:
+            conf (dict): "retention" (sec), "interval" (sec) and "batch_size" (rows moved at a time)
+        """
+        retention = conf.get("retention", 365*24*3600)
+        interval = conf.get("interval", 3600)
+        batch_size = conf.get("batch_size", 1000)
+        while True:
+            self.archive_transactions(int(time.time()) - retention, batch_size=batch_size)
+            time.sleep(interval)
+
+    def archive_transactions(self, horizon, batch_size=1000):
+        """Move the rows of the transactions older than horizon to the archive tables (<table>_archive)
+
+        The rows are moved in batches (INSERT ... SELECT and DELETE in a DB transaction) on the timestamp index, in
+        the order of asset_info_table, topology_table and transaction_table, so that a search without "deep" does
+        not find an asset_info row of which transaction is already archived. The archived rows keep their ids, so
+        a deep search merges both tables in the order of id. Rows of timestamp 0 (not backfilled after the
+        migration to schema version 3) are not archived. The counters keep counting the archived transactions.
+        The cores (and tools) sharing the DB run their own archivers, so the rows are moved only by the one holding
+        the named lock of the domain (GET_LOCK on the main connection). The others return 0.
+
+        Args:
+            horizon (int): rows of which timestamp (unix time) is less than this are archived
+            batch_size (int): rows moved in a DB transaction
+        Returns:
+            int: the number of archived rows (None if failed)
+        """
+        if self.schema_version < 3:
+            self.logger.error("archive_transactions needs schema version 3 or later")
+            return None
+        lock_name = "bbc_archive_" + self.db_adaptor.db_name  # -- named locks are server-wide
+        ret = self.exec_sql(sql="SELECT GET_LOCK(%s, 0)" % self.db_adaptor.placeholder, args=(lock_name,))
+        if ret is None:
+            return None
+        if ret[0][0] != 1:
+            self.logger.info("archive_transactions: another archiver is working")
+            return 0
+        try:
+            return self._archive_batches(horizon, batch_size)
+        finally:
+            self.exec_sql(sql="SELECT RELEASE_LOCK(%s)" % self.db_adaptor.placeholder, args=(lock_name,))
+
+    def _archive_batches(self, horizon, batch_size):
+        """Move the rows older than horizon to the archive tables in batches (under the lock of archive_transactions)
+
+        Args:
+            horizon (int): rows of which timestamp (unix time) is less than this are archived
+            batch_size (int): rows moved in a DB transaction
+        Returns:
+            int: the number of archived rows (None if failed)
+        """
+        start = time.time()
+        archived = 0
+        for adaptor in self.shards:
+            placeholder = adaptor.placeholder
+            for tbl, key in [("asset_info_table", "id"), ("topology_table", "id"),
+                             ("transaction_table", "transaction_id")]:
+                while True:
+                    rows = self.exec_sql(sql="SELECT %s FROM %s WHERE timestamp > 0 AND timestamp < %s "
+                                             "ORDER BY timestamp LIMIT %d" % (key, tbl, placeholder, batch_size),
+                                         args=(horizon,), db_adaptor=adaptor)
+                    if rows is None:
+                        return None
+                    if len(rows) == 0:
+                        break
+                    keys = [row[0] for row in rows]
+                    condition = "%s IN (%s)" % (key, ",".join([placeholder] * len(keys)))
+                    adaptor.begin()
+                    try:
+                        ok = self.exec_sql(sql="INSERT INTO %s%s SELECT * FROM %s WHERE %s" %
+                                               (tbl, ARCHIVE_SUFFIX, tbl, condition),
+                                           args=keys, commit=True, db_adaptor=adaptor) is not None
+                        ok = ok and self.exec_sql(sql="DELETE FROM %s WHERE %s" % (tbl, condition), args=keys,
+                                                  commit=True, db_adaptor=adaptor) is not None
+                    except Exception:
+                        adaptor.rollback()
+                        raise
+                    if not ok:
+                        adaptor.rollback()
+                        return None
+                    adaptor.commit()
+                    archived += len(keys)
+        self.stats.update_stats_increment("data_handler", "archived_rows", archived)
+        self.stats.update_stats("archive", self.domain_id_str, {
+            "horizon": horizon,
+            "archived_rows": archived,
+            "elapsed": time.time() - start,
+        })
+        return archived
 
     def search_transaction(self, transaction_id=None, asset_group_id=None, asset_id=None, user_id=None,
-                           direction=0, count=1):
+                           direction=0, count=1, deep=False):
         """Search transaction data
 
         When Multiple conditions are given, they are considered as AND condition.
@@ -244,93 +1980,323 @@ class DataHandler:
             user_id (bytes): user_id that target transactions should have
             direction (int): 0: descend, 1: ascend
             count (int): The maximum number of transactions to retrieve
+            deep (bool): If True, archived transactions are also searched
+        Returns:
+            dict: mapping from transaction_id to BBcTransactionIndex (BBcTransaction if the data is broken)
+        """
+        if transaction_id is None:
+            return self.search_transaction_with_cursor(asset_group_id=asset_group_id, asset_id=asset_id,
+                                                       user_id=user_id, direction=direction, count=count,
+                                                       deep=deep)[0]
+        if self.journal is not None:
+            txdata = self.journal.get_pending_transaction(transaction_id)
+            if txdata is not None:
+                return self._make_search_result([(transaction_id, txdata)])
+        txdata = self._get_transaction_data(transaction_id, replica=self._select_replica(transaction_id), deep=deep)
+        if txdata is None:
+            return None
+        return self._make_search_result([(transaction_id, txdata)])
+
+    def _get_transaction_data(self, transaction_id, replica=None, deep=False):
+        """Read transaction data from the segment store or transaction_table
+
+        Args:
+            transaction_id (bytes): target transaction_id
+            replica (dict): replica to read transaction_table from (None: the primary)
+            deep (bool): If True, transaction_table_archive is read if not found in transaction_table
         Returns:
-            dict: mapping from transaction_id to serialized transaction data
-            dict: dictionary of {asset_id: content} for the transaction
+            bytes|memoryview: serialized transaction (None if not found)
         """
-        if transaction_id is not None:
-            txinfo = self.exec_sql(
-                sql="SELECT * FROM transaction_table WHERE transaction_id = %s" % self.db_adaptor.placeholder,
-                args=(transaction_id,))
-            if len(txinfo) == 0:
+        if self.segment_store is not None:
+            return self.segment_store.get(transaction_id)
+        # -- the Bloom filter is built from transaction_table and its archive
+        if not self._check_txid_filter(transaction_id):
+            return None
+        txinfo = self._exec_read(replica, sql="SELECT * FROM transaction_table WHERE transaction_id = %s" %
+                                              self.db_adaptor.placeholder, args=(transaction_id,),
+                                 db_adaptor=self._shard(transaction_id))
+        if txinfo is None:
+            return None
+        if len(txinfo) == 0 and deep and self.schema_version >= 3:
+            txinfo = self._exec_read(replica, sql="SELECT * FROM transaction_table%s WHERE transaction_id = %s" %
+                                                  (ARCHIVE_SUFFIX, self.db_adaptor.placeholder),
+                                     args=(transaction_id,), db_adaptor=self._shard(transaction_id))
+            if txinfo is None:
                 return None
-        else:
-            dire = "DESC"
-            if direction == 1:
-                dire = "ASC"
-            sql = "SELECT * from asset_info_table WHERE "
-            conditions = list()
-            if asset_group_id is not None:
-                conditions.append("asset_group_id = %s " % self.db_adaptor.placeholder)
-            if asset_id is not None:
-                conditions.append("asset_id = %s " % self.db_adaptor.placeholder)
-            if user_id is not None:
-                conditions.append("user_id = %s " % self.db_adaptor.placeholder)
-            sql += "AND ".join(conditions) + "ORDER BY id %s" % dire
+            if len(txinfo) > 0:
+                self.stats.update_stats_increment("data_handler", "deep_search_hit", 1)
+        if len(txinfo) > 0 or deep or self.schema_version < 3:
+            # -- not a false positive if not found in transaction_table without deep (it may be archived)
+            self._verify_txid_filter(transaction_id, len(txinfo) > 0)
+        if len(txinfo) == 0:
+            return None
+        return txinfo[0][1]
+
+    def _select_with_archive(self, table, where, args, order_limit, deep):
+        """Make a SELECT on the table (and its archive table with UNION ALL in the deep mode)
+
+        Args:
+            table (str): table name
+            where (str): WHERE clause (may be empty)
+            args (list): args for the WHERE clause
+            order_limit (str): ORDER BY and LIMIT clauses (may be empty) applied to each table and the union
+            deep (bool): If True, the archive table is also searched
+        Returns:
+            str: SQL
+            list: args
+        """
+        if not deep or self.schema_version < 3:
+            return "SELECT * FROM %s %s %s" % (table, where, order_limit), list(args)
+        return "(SELECT * FROM %s %s %s) UNION ALL (SELECT * FROM %s%s %s %s) %s" % (
+            table, where, order_limit, table, ARCHIVE_SUFFIX, where, order_limit, order_limit), list(args) * 2
+
+    def _time_range_conditions(self, since, until):
+        """Make conditions on the timestamp column of asset_info_table
+
+        Args:
+            since (int): timestamp (unix time) >= since
+            until (int): timestamp (unix time) < until
+        Returns:
+            list: conditions for the WHERE clause (None if the schema version does not have timestamps)
+            list: args for the conditions
+        """
+        conditions = list()
+        args = list()
+        if since is None and until is None:
+            return conditions, args
+        if self.schema_version < 3:
+            self.logger.error("time-range search needs schema version 3 or later")
+            return None, None
+        for operator, val in [(">=", since), ("<", until)]:
+            if val is not None:
+                conditions.append("timestamp %s %s " % (operator, self.db_adaptor.placeholder))
+                args.append(val)
+        return conditions, args
+
+    def search_transaction_with_cursor(self, asset_group_id=None, asset_id=None, user_id=None, direction=0, count=1,
+                                       cursor=None, deep=False, since=None, until=None):
+        """Search transaction data page by page
+
+        A page is the next "count" records in asset_info_table after the position given by the cursor. The search
+        resumes with "WHERE id < (or >) last_id", so that any page costs the same as the first page. With shards, the
+        cursor has the last id in each shard, so every record is returned once. The ids in different shards are not
+        related, so the records are ordered by (timestamp, id) instead with schema version 3 or later.
+
+        Args:
+            asset_group_id (bytes): asset_group_id that target transactions should have
+            asset_id (bytes): asset_id that target transactions should have
+            user_id (bytes): user_id that target transactions should have
+            direction (int): 0: descend, 1: ascend (ignored if cursor is given)
+            count (int): The maximum number of records to retrieve (up to MAX_SEARCH_COUNT)
+            cursor (bytes): continuation cursor returned by the previous search
+            deep (bool): If True, archived transactions are also searched (archived rows keep their ids)
+            since (int): transactions with timestamp (unix time) >= since are retrieved
+            until (int): transactions with timestamp (unix time) < until are retrieved
+        Returns:
+            dict: mapping from transaction_id to BBcTransactionIndex (BBcTransaction if the data is broken)
+            bytes: continuation cursor for the next page (None if this is the last page)
+        """
+        conditions, args = self._time_range_conditions(since, until)
+        if conditions is None:
+            return None, None
+        for column, val in [("asset_group_id", asset_group_id), ("asset_id", asset_id), ("user_id", user_id)]:
+            if val is not None:
+                conditions.append("%s = %s " % (column, self.db_adaptor.placeholder))
+                args.append(val)
+        return self._search_with_cursor("asset_info_table", conditions, args, direction, count, cursor,
+                                        self._select_replica(asset_group_id, asset_id, user_id), deep)
+
+    def search_transaction_by_body_field(self, asset_group_id, field, value=None, lower=None, upper=None,
+                                         direction=0, count=1, cursor=None):
+        """Search transactions by a field of the dict asset bodies in body_index_table
+
+        The field must be declared for the asset_group_id in "body_index" of the domain config.
+
+        Args:
+            asset_group_id (bytes): asset_group_id of the assets
+            field (str): field name (nested fields are given as "a.b")
+            value (int|float|str|bytes): value of the field
+            lower (int|float|str|bytes): lower bound of the value (inclusive, ignored if value is given)
+            upper (int|float|str|bytes): upper bound of the value (inclusive, ignored if value is given)
+            direction (int): 0: descend, 1: ascend (ignored if cursor is given)
+            count (int): The maximum number of records to retrieve (up to MAX_SEARCH_COUNT)
+            cursor (bytes): continuation cursor returned by the previous search
+        Returns:
+            dict: mapping from transaction_id to BBcTransactionIndex (BBcTransaction if the data is broken)
+            bytes: continuation cursor for the next page (None if this is the last page)
+        """
+        if field not in self.body_index_fields.get(asset_group_id, []):
+            self.logger.error("field %s is not indexed in the asset group" % field)
+            return None, None
+        placeholder = self.db_adaptor.placeholder
+        conditions = ["asset_group_id = %s " % placeholder, "field = %s " % placeholder]
+        args = [asset_group_id, field]
+        bounds = [("=", value)] if value is not None else [(">=", lower), ("<=", upper)]
+        columns = set()
+        for operator, val in bounds:
+            if val is None:
+                continue
+            column, val = body_value_column(val)
+            if column is None:
+                self.logger.error("the value of field %s cannot be searched" % field)
+                return None, None
+            conditions.append("%s %s %s " % (column, operator, placeholder))
+            args.append(val)
+            columns.add(column)
+        if len(columns) > 1:
+            self.logger.error("the bounds of field %s are of different types" % field)
+            return None, None
+        self.stats.update_stats_increment("data_handler", "search_by_body_field", 1)
+        return self._search_with_cursor("body_index_table", conditions, args, direction, count, cursor,
+                                        self._select_replica(asset_group_id))
+
+    def _search_with_cursor(self, table, conditions, args, direction, count, cursor, replica, deep=False):
+        """Read a page of an index table (id, transaction_id, ...) and the transactions in it
+
+        Args:
+            table (str): asset_info_table or body_index_table
+            conditions (list): conditions for the WHERE clause
+            args (list): args for the conditions
+            direction (int): 0: descend, 1: ascend (ignored if cursor is given)
+            count (int): The maximum number of records to retrieve (up to MAX_SEARCH_COUNT)
+            cursor (bytes): continuation cursor returned by the previous search
+            replica (dict): replica to read from (None: the primary)
+            deep (bool): If True, the archive table is also searched
+        Returns:
+            dict: mapping from transaction_id to BBcTransactionIndex (BBcTransaction if the data is broken)
+            bytes: continuation cursor for the next page (None if this is the last page)
+        """
+        # -- the ids in different shards are not related, so the shards are merged in the order of the timestamp
+        timed = len(self.shards) > 1 and self.schema_version >= 3 and table == "asset_info_table"
+        last_ids = [None] * len(self.shards)
+        if cursor is not None:
+            direction, last_id = parse_search_cursor(cursor)
+            if direction is None:
+                return None, None
+            last_ids = last_id if isinstance(last_id, list) else [last_id]
+            if len(last_ids) != len(self.shards) or \
+                    any(i is not None and isinstance(i, tuple) != timed for i in last_ids):
+                return None, None
+        if count > 0:
+            count = min(count, MAX_SEARCH_COUNT)
+        order = "DESC" if direction == 0 else "ASC"
+        operator = "<" if direction == 0 else ">"
+
+        def query(i, adaptor):
+            shard_conditions = list(conditions)
+            shard_args = list(args)
+            if last_ids[i] is not None and timed:
+                shard_conditions.append("(timestamp %s %s OR (timestamp = %s AND id %s %s)) " % (
+                    operator, adaptor.placeholder, adaptor.placeholder, operator, adaptor.placeholder))
+                shard_args.extend((last_ids[i][0], last_ids[i][0], last_ids[i][1]))
+            elif last_ids[i] is not None:
+                shard_conditions.append("id %s %s " % (operator, adaptor.placeholder))
+                shard_args.append(last_ids[i])
+            where = "WHERE " + "AND ".join(shard_conditions) if len(shard_conditions) > 0 else ""
+            order_limit = "ORDER BY timestamp %s, id %s" % (order, order) if timed else "ORDER BY id %s" % order
             if count > 0:
-                if count > 20:
-                    count = 20
-                sql += " limit %d" % count
-            sql += ";"
-            args = list(filter(lambda a: a is not None, (asset_group_id, asset_id, user_id)))
-            ret = self.exec_sql(sql=sql, args=args)
-            txinfo = list()
-            for record in ret:
-                tx = self.exec_sql(
-                    sql="SELECT * FROM transaction_table WHERE transaction_id = %s" % self.db_adaptor.placeholder,
-                    args=(record[1],))
-                if tx is not None and len(tx) == 1:
-                    txinfo.append(tx[0])
+                order_limit += " limit %d" % count
+            sql, shard_args = self._select_with_archive(table, where, shard_args, order_limit, deep)
+            if len(self.shards) == 1:
+                return self._exec_read(replica, sql=sql, args=shard_args)
+            return self.exec_sql(sql=sql, args=shard_args, db_adaptor=adaptor)
+
+        results = self._fan_out(query)
+        if None in results:
+            return None, None
+        if timed:
+            timestamp_idx = len(asset_info_definition_v3) - 1
+            records = sorted((((row[timestamp_idx], i, row[0]), i, row)
+                              for i, rows in enumerate(results) for row in rows), reverse=(direction == 0))
+        else:
+            # -- the records of the shards are merged in the order of id, which only orders the records within a shard
+            records = sorted(((row[0], i, row) for i, rows in enumerate(results) for row in rows),
+                             reverse=(direction == 0))
+        if count > 0:
+            records = records[:count]
+        txinfo = list()
+        for key, i, record in records:
+            txdata = self._get_transaction_data(record[1], replica=replica, deep=deep)
+            if txdata is not None:
+                txinfo.append((record[1], txdata))
+            last_ids[i] = (key[0], key[2]) if timed else key
+        next_cursor = None
+        if count > 0 and len(records) == count:
+            next_cursor = make_search_cursor(direction, last_ids if len(self.shards) > 1 else last_ids[0])
+        return self._make_search_result(txinfo), next_cursor
 
+    def _make_search_result(self, txinfo):
+        """Make a mapping from transaction_id to the index of the transaction (from records of transaction_table)"""
         result_txobj = dict()
         for txid, txdata in txinfo:
-            txobj = bbclib.BBcTransaction(deserialize=txdata)
+            txobj = bbclib.scan_transaction(txdata)
+            if txobj is None:
+                txobj = bbclib.BBcTransaction(deserialize=bytes(txdata))
             result_txobj[txid] = txobj
         return result_txobj
 
-    def count_transactions(self, asset_group_id=None, asset_id=None, user_id=None):
+    def count_transactions(self, asset_group_id=None, asset_id=None, user_id=None, since=None, until=None):
         """Count transactions that matches the given conditions
 
         When Multiple conditions are given, they are considered as AND condition.
+        The counts for asset_group_id, user_id and (asset_group_id, user_id) are read from counter_table.
+        Other combinations and time ranges are counted by scanning asset_info_table.
 
         Args:
             asset_group_id (bytes): asset_group_id that target transactions should have
             asset_id (bytes): asset_id that target transactions should have
             user_id (bytes): user_id that target transactions should have
+            since (int): transactions with timestamp (unix time) >= since are counted
+            until (int): transactions with timestamp (unix time) < until are counted
         Returns:
             int: the number of transactions
         """
+        conditions, args = self._time_range_conditions(since, until)
+        if conditions is None:
+            return None
+        if asset_id is None and len(conditions) == 0 and (asset_group_id is not None or user_id is not None):
+            self.stats.update_stats_increment("data_handler", "count_by_counter", 1)
+            ret = self._read_all_shards(self._select_replica(asset_group_id, user_id),
+                                        sql="SELECT tx_count FROM counter_table WHERE counter_key = %s" %
+                                            self.db_adaptor.placeholder,
+                                        args=(make_counter_key(asset_group_id=asset_group_id, user_id=user_id),))
+            if ret is None:
+                return None
+            return sum(row[0] for row in ret)
         sql = "SELECT count( DISTINCT transaction_id ) from asset_info_table WHERE "
-        conditions = list()
-        if asset_group_id is not None:
-            conditions.append("asset_group_id = %s " % self.db_adaptor.placeholder)
-        if asset_id is not None:
-            conditions.append("asset_id = %s " % self.db_adaptor.placeholder)
-        if user_id is not None:
-            conditions.append("user_id = %s " % self.db_adaptor.placeholder)
+        for column, val in [("asset_group_id", asset_group_id), ("asset_id", asset_id), ("user_id", user_id)]:
+            if val is not None:
+                conditions.append("%s = %s " % (column, self.db_adaptor.placeholder))
+                args.append(val)
         sql += "AND ".join(conditions)
-        args = list(filter(lambda a: a is not None, (asset_group_id, asset_id, user_id)))
-        ret = self.exec_sql(sql=sql, args=args)
-        return ret[0][0]
+        ret = self._read_all_shards(self._select_replica(asset_group_id, asset_id, user_id), sql=sql, args=args)
+        if ret is None:
+            return None
+        return sum(row[0] for row in ret)
 
-    def search_transaction_topology(self, transaction_id, traverse_to_past=True):
+    def search_transaction_topology(self, transaction_id, traverse_to_past=True, deep=False):
         """Search in topology info
 
         Args:
             transaction_id (bytes): base transaction_id
             traverse_to_past (bool): True: search backward (to past), False: search forward (to future)
+            deep (bool): If True, archived topology rows are also searched
         Returns:
             list: list of records of topology table
         """
         if transaction_id is None:
             return None
+        replica = self._select_replica(transaction_id)
         if traverse_to_past:
-            return self.exec_sql(sql="SELECT * FROM topology_table WHERE base = %s" %
-                                 self.db_adaptor.placeholder, args=(transaction_id,))
+            # -- topology rows are stored in the shard of the base transaction
+            sql, args = self._select_with_archive("topology_table", "WHERE base = %s" % self.db_adaptor.placeholder,
+                                                  (transaction_id,), "", deep)
+            return self._exec_read(replica, sql=sql, args=args, db_adaptor=self._shard(transaction_id))
 
         else:
-            return self.exec_sql(sql="SELECT * FROM topology_table WHERE point_to = %s" %
-                                 self.db_adaptor.placeholder, args=(transaction_id,))
+            sql, args = self._select_with_archive("topology_table", "WHERE point_to = %s" %
+                                                  self.db_adaptor.placeholder, (transaction_id,), "", deep)
+            return self._read_all_shards(replica, sql=sql, args=args)
 
 
 class DbAdaptor:
@@ -341,11 +2307,27 @@ class DbAdaptor:
         self.db_cur = None
         self.db_name = "dom"+db_name
         self.placeholder = ""
+        self.in_transaction = False
+        # -- held from begin() to commit()/rollback() and by exec_sql(), so that the greenlets (or threads) sharing
+        # -- the connection never run their statements in the DB transaction of another one
+        self.lock = threading.RLock()
 
     def open_db(self, rootuser, rootpass):
         """Open the DB"""
         pass
 
+    def begin(self):
+        """Start a DB transaction (exec_sql(commit=True) does not commit until commit() is called)"""
+        pass
+
+    def commit(self):
+        """Commit the DB transaction"""
+        pass
+
+    def rollback(self):
+        """Rollback the DB transaction"""
+        pass
+
     def create_table(self, tbl, tbl_definition, primary_key=0, indices=[]):
         """Create a table"""
         pass
@@ -396,8 +2378,46 @@ class MysqlAdaptor(DbAdaptor):
             password=self.db_pass,
             charset='utf8'
         )
+        # -- so that SELECTs on InnoDB tables do not keep reading an old snapshot
+        self.db.autocommit = True
         self.db_cur = self.db.cursor(buffered=True)
 
+    def connect(self):
+        """Open another connection to the DB created by open_db()"""
+        self.db = mysql.connector.connect(host=self.db_addr, port=self.db_port, db=self.db_name, user=self.db_user,
+                                          password=self.db_pass, charset='utf8')
+        self.db.autocommit = True
+        self.db_cur = self.db.cursor(buffered=True)
+
+    def begin(self):
+        """Start a DB transaction (exec_sql(commit=True) does not commit until commit() is called)
+
+        The connection is locked until commit() or rollback() is called.
+        """
+        self.lock.acquire()
+        try:
+            self.db.start_transaction()
+        except:
+            self.lock.release()
+            raise
+        self.in_transaction = True
+
+    def commit(self):
+        """Commit the DB transaction"""
+        try:
+            self.in_transaction = False
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+    def rollback(self):
+        """Rollback the DB transaction"""
+        try:
+            self.in_transaction = False
+            self.db.rollback()
+        finally:
+            self.lock.release()
+
     def create_table(self, tbl, tbl_definition, primary_key=0, indices=[]):
         """Create a table
 
@@ -405,7 +2425,7 @@ class MysqlAdaptor(DbAdaptor):
             tbl (str): table name
             tbl_definition (list): schema of the table [["column_name", "data type"],["colmun_name", "data type"],,]
             primary_key (int): index (column) of the primary key of the table
-            indices (list): list of indices to create index
+            indices (list): list of indices to create index (a tuple of indices makes a composite index)
         """
         if len(self.check_table_existence(tbl)) == 1:
             return
@@ -423,14 +2443,39 @@ class MysqlAdaptor(DbAdaptor):
         else:
             sql += ", PRIMARY KEY (%s)" % tbl_definition[primary_key][0]
         sql += ") CHARSET=utf8 ENGINE=%s;" % self.table_engine
-        self.handler.exec_sql(sql=sql, commit=True)
+        self.handler.exec_sql(sql=sql, commit=True, db_adaptor=self)
         for idx in indices:
-            if tbl_definition[idx][1] in ["BLOB", "TEXT"]:
-                self.handler.exec_sql(sql="ALTER TABLE %s ADD INDEX (%s(32));" % (tbl, tbl_definition[idx][0]), commit=True)
+            if isinstance(idx, tuple):
+                columns = [self._index_column(tbl_definition[i]) for i in idx]
+                name = "idx_" + "_".join(tbl_definition[i][0] for i in idx)
+                self.handler.exec_sql(sql="ALTER TABLE %s ADD INDEX %s (%s);" % (tbl, name, ",".join(columns)),
+                                      commit=True, db_adaptor=self)
             else:
-                self.handler.exec_sql(sql="ALTER TABLE %s ADD INDEX (%s);" % (tbl, tbl_definition[idx][0]), commit=True)
+                self.handler.exec_sql(sql="ALTER TABLE %s ADD INDEX (%s);" %
+                                          (tbl, self._index_column(tbl_definition[idx])), commit=True, db_adaptor=self)
+
+    def _index_column(self, column_definition):
+        """Return the column specification in an index (BLOB/TEXT columns need a prefix length)"""
+        if column_definition[1] in ["BLOB", "TEXT"]:
+            return "%s(32)" % column_definition[0]
+        return column_definition[0]
 
     def check_table_existence(self, tblname):
         """Check whether the table exists or not"""
         sql = "show tables from %s like '%s';" % (self.db_name, tblname)
-        return self.handler.exec_sql(sql=sql)
+        return self.handler.exec_sql(sql=sql, db_adaptor=self)
+
+    def get_schema_version(self):
+        """Return the schema version of the existing tables (None if the tables do not exist)"""
+        if len(self.check_table_existence('asset_info_table')) == 0:
+            return None
+        ret = self.handler.exec_sql(sql="SHOW COLUMNS FROM asset_info_table LIKE 'asset_group_id';", db_adaptor=self)
+        if ret is None or len(ret) == 0:
+            return None
+        coltype = ret[0][1]
+        if isinstance(coltype, bytes):
+            coltype = coltype.decode()
+        if coltype.lower() == "blob":
+            return 1
+        ret = self.handler.exec_sql(sql="SHOW COLUMNS FROM transaction_table LIKE 'timestamp';", db_adaptor=self)
+        return 3 if ret is not None and len(ret) > 0 else 2
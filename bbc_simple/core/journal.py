@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2018 quvox.net
+
+Write-ahead journal of inserted transactions (see DataHandler)
+
+A record is (sequence number, length, crc32) followed by the serialized transaction. Appends are written and
+fsync'ed in groups by the flusher thread, and append() returns when the record is durable. The sequence number
+of the last record applied to the DB is kept in <journal>.applied, and the journal is truncated when all the
+records are applied and it exceeds max_size.
+"""
+import collections
+import os
+import struct
+import threading
+import time
+import zlib
+
+JOURNAL_SUFFIX = ".journal"
+APPLIED_SUFFIX = ".applied"
+_RECORD_HEADER = struct.Struct('<QII')  # sequence number, length, crc32 of the data
+
+
+def cooperative_fsync(fd):
+    """os.fsync that does not block the other greenlets in bbc_core (gevent)"""
+    try:
+        from gevent import monkey, get_hub
+        if monkey.is_module_patched("os"):
+            get_hub().threadpool.apply(os.fsync, (fd,))
+            return
+    except ImportError:
+        pass
+    os.fsync(fd)
+
+
+class InsertJournal:
+    """Append-only journal with group commit"""
+    def __init__(self, path, get_transaction_id, max_size=64*1024*1024):
+        """
+        Args:
+            path (str): path to the journal file
+            get_transaction_id (callable): function returning the transaction_id of a serialized transaction
+            max_size (int): the journal is truncated if it exceeds this size when all the records are applied
+        """
+        self.path = path
+        self.get_transaction_id = get_transaction_id
+        self.applied_path = path + APPLIED_SUFFIX
+        self.max_size = max_size
+        self.applied = self._read_applied()
+        # -- sequence number -> (transaction_id, transaction_data, appended time)
+        self.pending = collections.OrderedDict()
+        self.pending_txids = dict()
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.synced_condition = threading.Condition(self.lock)
+        self.flush_event = threading.Event()
+        self.append_event = threading.Event()
+        self.sequence = self._replay()
+        self.synced = self.sequence
+        self.file = open(self.path, "ab")
+        th = threading.Thread(target=self._flush_loop)
+        th.setDaemon(True)
+        th.start()
+
+    def _read_applied(self):
+        if not os.path.exists(self.applied_path):
+            return 0
+        with open(self.applied_path, "r") as f:
+            return int(f.read().strip() or 0)
+
+    def _write_applied(self):
+        tmp = self.applied_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("%d" % self.applied)
+        os.replace(tmp, self.applied_path)
+
+    def _replay(self):
+        """Load the records not applied yet and truncate a torn record at the tail
+
+        Returns:
+            int: the last sequence number
+        """
+        last = self.applied
+        if not os.path.exists(self.path):
+            return last
+        with open(self.path, "rb") as f:
+            dat = f.read()
+        ptr = 0
+        while ptr + _RECORD_HEADER.size <= len(dat):
+            seq, length, crc = _RECORD_HEADER.unpack_from(dat, ptr)
+            txdata = dat[ptr+_RECORD_HEADER.size:ptr+_RECORD_HEADER.size+length]
+            if len(txdata) != length or zlib.crc32(txdata) != crc:
+                break
+            ptr += _RECORD_HEADER.size + length
+            if seq > self.applied:
+                txid = self.get_transaction_id(txdata)
+                self.pending[seq] = (txid, txdata, time.time())
+                self.pending_txids[txid] = seq
+            last = max(last, seq)
+        if ptr < len(dat):
+            with open(self.path, "r+b") as f:
+                f.truncate(ptr)
+        return last
+
+    def _flush_loop(self):
+        while True:
+            self.flush_event.wait()
+            with self.lock:
+                self.flush_event.clear()
+                dat = bytes(self.buffer)
+                self.buffer = bytearray()
+                sequence = self.sequence
+            if len(dat) > 0:
+                self.file.write(dat)
+                self.file.flush()
+                cooperative_fsync(self.file.fileno())
+            with self.lock:
+                self.synced = sequence
+                self.synced_condition.notify_all()
+
+    def append(self, transaction_id, txdata):
+        """Append a transaction and wait until it is durable
+
+        Args:
+            transaction_id (bytes): transaction_id
+            txdata (bytes): serialized transaction
+        Returns:
+            int: sequence number of the record
+        """
+        with self.lock:
+            self.sequence += 1
+            seq = self.sequence
+            self.buffer.extend(_RECORD_HEADER.pack(seq, len(txdata), zlib.crc32(txdata)))
+            self.buffer.extend(txdata)
+            self.pending[seq] = (transaction_id, txdata, time.time())
+            self.pending_txids[transaction_id] = seq
+            self.flush_event.set()
+            self.synced_condition.wait_for(lambda: self.synced >= seq)
+        self.append_event.set()
+        return seq
+
+    def get_pending_transaction(self, transaction_id):
+        """Return the transaction data in the journal that is not applied yet (None if not found)"""
+        seq = self.pending_txids.get(transaction_id, None)
+        if seq is None:
+            return None
+        entry = self.pending.get(seq, None)
+        return None if entry is None else entry[1]
+
+    def get_unapplied(self, limit=100):
+        """Return the durable records not applied yet
+
+        Returns:
+            list: list of (sequence number, transaction data)
+        """
+        with self.lock:
+            ret = list()
+            for seq, (txid, txdata, appended) in self.pending.items():
+                if seq > self.synced or len(ret) >= limit:
+                    break
+                ret.append((seq, txdata))
+            return ret
+
+    def mark_applied(self, sequence):
+        """Record that the records up to the sequence number are applied to the DB"""
+        with self.lock:
+            while len(self.pending) > 0:
+                seq = next(iter(self.pending))
+                if seq > sequence:
+                    break
+                txid, txdata, appended = self.pending.pop(seq)
+                self.pending_txids.pop(txid, None)
+            self.applied = sequence
+            self._write_applied()
+            if len(self.pending) == 0 and len(self.buffer) == 0 and self.file.tell() > self.max_size:
+                self.file.truncate(0)
+                self.file.seek(0)
+
+    def lag(self):
+        """Return the number of records not applied yet and the age of the oldest one in seconds"""
+        with self.lock:
+            if len(self.pending) == 0:
+                return 0, 0
+            return len(self.pending), time.time() - next(iter(self.pending.values()))[2]
@@ -254,6 +254,18 @@ class KeyType:
     direction = to_4byte(6, 0x60)
     hop_count = to_4byte(7, 0x60)
     all_included = to_4byte(8, 0x60)
+    cursor = to_4byte(9, 0x60)
+    index_sequence = to_4byte(10, 0x60)
+    deep = to_4byte(11, 0x60)
+    since = to_4byte(12, 0x60)
+    until = to_4byte(13, 0x60)
+    body_field = to_4byte(14, 0x60)
+    body_value = to_4byte(15, 0x60)
+    body_lower = to_4byte(16, 0x60)
+    body_upper = to_4byte(17, 0x60)
+    include_transaction_data = to_4byte(18, 0x60)
+    feed_wait = to_4byte(19, 0x60)
+    coalesce_notification = to_4byte(20, 0x60)
 
     transaction_data = to_4byte(0, 0x70)
     transactions = to_4byte(1, 0x70)
@@ -268,6 +280,7 @@ class KeyType:
     txid_having_cross_ref = to_4byte(10, 0x70)
     cross_ref_verification_info = to_4byte(11, 0x70)
     transaction_data_format = to_4byte(12, 0x70)
+    change_feed = to_4byte(13, 0x70)
 
     compromised_transaction_data = to_4byte(0, 0x90)
     compromised_transactions = to_4byte(1, 0x90)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2018 quvox.net
+
+Append-only segment file store of transaction data (see DataHandler)
+
+Transaction data is appended to <dir>/<segment number>.seg, and a new segment is started when the current one
+exceeds segment_size. For each segment, <dir>/<segment number>.idx has the records of the transactions in it
+(transaction_id, offset, length) and the removal records of transactions. The index (transaction_id ->
+segment number, offset, length) is loaded from the .idx files at startup, and reads are served from
+memory-mapped segments.
+"""
+import mmap
+import os
+import struct
+import threading
+
+from bbc_simple.core.journal import cooperative_fsync
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+DEFAULT_SEGMENT_SIZE = 256*1024*1024
+
+_INDEX_HEADER = struct.Struct('<BB')  # operation, length of transaction_id
+_LOCATION = struct.Struct('<IQI')  # segment number, offset, length
+_OP_ADD = 1
+_OP_REMOVE = 0
+
+
+class SegmentStore:
+    """Transaction data store on append-only segment files"""
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, sync=True):
+        """
+        Args:
+            directory (str): directory of the segment files
+            segment_size (int): size to start a new segment
+            sync (bool): fsync the segment and the index at every append
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        self.index = dict()  # transaction_id -> packed location
+        self.maps = dict()  # segment number -> mmap
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(int(f[:-len(SEGMENT_SUFFIX)]) for f in os.listdir(directory) if f.endswith(SEGMENT_SUFFIX))
+        for seg in segments:
+            self._load_index(seg)
+        self.segment = segments[-1] if len(segments) > 0 else 0
+        self._open_segment()
+
+    def _path(self, seg, suffix):
+        return os.path.join(self.directory, "%08d%s" % (seg, suffix))
+
+    def _load_index(self, seg):
+        """Load the index of a segment (records pointing beyond the end of the segment are ignored)"""
+        path = self._path(seg, INDEX_SUFFIX)
+        if not os.path.exists(path):
+            return
+        seg_size = os.path.getsize(self._path(seg, SEGMENT_SUFFIX))
+        with open(path, "rb") as f:
+            dat = f.read()
+        ptr = 0
+        while ptr + _INDEX_HEADER.size <= len(dat):
+            op, id_len = _INDEX_HEADER.unpack_from(dat, ptr)
+            end = ptr + _INDEX_HEADER.size + id_len + (_LOCATION.size if op == _OP_ADD else 0)
+            if end > len(dat):
+                break
+            txid = dat[ptr+_INDEX_HEADER.size:ptr+_INDEX_HEADER.size+id_len]
+            if op == _OP_ADD:
+                location = dat[end-_LOCATION.size:end]
+                s, offset, length = _LOCATION.unpack(location)
+                if offset + length <= seg_size:
+                    self.index[txid] = location
+            else:
+                self.index.pop(txid, None)
+            ptr = end
+        if ptr < len(dat):
+            with open(path, "r+b") as f:
+                f.truncate(ptr)
+
+    def _open_segment(self):
+        self.segment_file = open(self._path(self.segment, SEGMENT_SUFFIX), "ab")
+        self.index_file = open(self._path(self.segment, INDEX_SUFFIX), "ab")
+
+    def _write_index(self, dat):
+        self.index_file.write(dat)
+        self.index_file.flush()
+        if self.sync:
+            cooperative_fsync(self.index_file.fileno())
+
+    def __contains__(self, transaction_id):
+        return bytes(transaction_id) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, transaction_id, txdata):
+        """Append transaction data
+
+        Args:
+            transaction_id (bytes): transaction_id
+            txdata (bytes): serialized transaction
+        Returns:
+            tuple: (segment number, offset, length)
+        """
+        transaction_id = bytes(transaction_id)
+        with self.lock:
+            offset = self.segment_file.tell()
+            if offset > 0 and offset + len(txdata) > self.segment_size:
+                self.segment_file.close()
+                self.index_file.close()
+                self.segment += 1
+                self._open_segment()
+                offset = 0
+            self.segment_file.write(txdata)
+            self.segment_file.flush()
+            if self.sync:
+                cooperative_fsync(self.segment_file.fileno())
+            location = _LOCATION.pack(self.segment, offset, len(txdata))
+            self._write_index(_INDEX_HEADER.pack(_OP_ADD, len(transaction_id)) + transaction_id + location)
+            self.index[transaction_id] = location
+        return self.segment, offset, len(txdata)
+
+    def remove(self, transaction_id):
+        """Remove a transaction from the index (the data remains in the segment)
+
+        Returns:
+            bool: True if removed
+        """
+        transaction_id = bytes(transaction_id)
+        with self.lock:
+            if transaction_id not in self.index:
+                return False
+            self._write_index(_INDEX_HEADER.pack(_OP_REMOVE, len(transaction_id)) + transaction_id)
+            del self.index[transaction_id]
+        return True
+
+    def get(self, transaction_id):
+        """Read transaction data
+
+        Returns:
+            memoryview: transaction data on the memory-mapped segment (None if not found)
+        """
+        location = self.index.get(bytes(transaction_id), None)
+        if location is None:
+            return None
+        seg, offset, length = _LOCATION.unpack(location)
+        m = self.maps.get(seg, None)
+        if m is None or len(m) < offset + length:
+            # -- the current segment has grown. The old map is left to GC because returned views may refer to it
+            with open(self._path(seg, SEGMENT_SUFFIX), "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[seg] = m
+        return memoryview(m)[offset:offset+length]
+
+    def get_stats(self):
+        return {
+            "transactions": len(self.index),
+            "segments": self.segment + 1,
+            "current_segment_size": self.segment_file.tell(),
+        }
@@ -17,6 +17,7 @@ limitations under the License.
 import logging
 import threading
 import queue
+import time
 import os
 import sys
 sys.path.extend(["../../", os.path.abspath(os.path.dirname(__file__))])
@@ -24,23 +25,63 @@ from bbc_simple.core.message_key_types import PayloadType, KeyType
 from bbc_simple.core import message_key_types, bbc_network, bbclib
 
 
+DEFAULT_COALESCE_WINDOW = 0.1
+DEFAULT_COALESCE_MAX_BATCH = 100
+
+
+def _parse_asset_info(dat):
+    """Parse the asset info in a notification broadcast (see BBcCoreService.send_inserted_notification())
+
+    Returns:
+        list: list of (asset_group_id, asset_id, user_id)
+    """
+    num = int.from_bytes(dat[:2], 'big')
+    ptr = 2
+    asset_info = list()
+    for i in range(num):
+        info = list()
+        for j in range(3):
+            info.append(bytes(dat[ptr+1:ptr+1+dat[ptr]]))
+            ptr += 1 + dat[ptr]
+        asset_info.append(tuple(info))
+    return asset_info
+
+
 def direct_send_to_user(sock, msg):
     sock.sendall(message_key_types.make_message(PayloadType.Type_msgpack, msg))
 
 
 class UserMessageRouting:
     """Handle message for clients"""
-    def __init__(self, networking, domain_id):
+    def __init__(self, networking, domain_id, config=None):
+        """
+        Args:
+            networking (BBcNetwork): networking object
+            domain_id (bytes): target domain_id
+            config (dict): "insert_notification" part of the domain config ("coalesce_window" (sec) and
+                           "coalesce_max_batch" for the coalesced notification)
+        """
         self.networking = networking
         self.stats = networking.core.stats
         self.domain_id = domain_id
         self.logger = networking.logger
         self.registered_users = dict()
         self.insert_notification_list = dict()
+        self.coalesced_notification_list = dict()  # -- asset_group_id -> user_ids requesting coalesced notification
+        self.notification_filters = dict()  # -- (asset_group_id, user_id) -> (user_id, asset_id) of the assets
+        # -- (asset_group_id, filter) -> [time of the first transaction, transaction_ids]
+        self.pending_notifications = dict()
+        self.notification_condition = threading.Condition()
+        conf = config if config is not None else dict()
+        self.coalesce_window = conf.get("coalesce_window", DEFAULT_COALESCE_WINDOW)
+        self.coalesce_max_batch = conf.get("coalesce_max_batch", DEFAULT_COALESCE_MAX_BATCH)
         self.queue = queue.Queue()
         th = threading.Thread(target=self._message_loop)
         th.setDaemon(True)
         th.start()
+        th = threading.Thread(target=self._coalesce_loop)
+        th.setDaemon(True)
+        th.start()
 
     def register_user(self, user_id, socket, on_multiple_nodes=False):
         """Register user to forward message
@@ -56,6 +97,8 @@ class UserMessageRouting:
     def unregister_user(self, user_id, socket):
         """Unregister user from the list and delete AES key if exists
 
+        The insert notifications of the user are also unregistered when the last socket of the user is closed.
+
         Args:
             user_id (bytes): user_id of the client
             socket (Socket): socket for the client
@@ -65,16 +108,36 @@ class UserMessageRouting:
         self.registered_users[user_id].remove(socket)
         if len(self.registered_users[user_id]) == 0:
             self.registered_users.pop(user_id, None)
+            for asset_group_id in [a for a, users in self.insert_notification_list.items() if user_id in users]:
+                self.unregister_notification(asset_group_id, user_id)
 
-    def register_notification(self, asset_group_id, user_id):
+    def register_notification(self, asset_group_id, user_id, coalesce=False, filter_user_id=None,
+                              filter_asset_id=None):
         """Register user to insert notification list
 
+        The node is also registered in the cluster-wide registry in redis while it has a subscriber of the asset
+        group, so that the cores can skip the broadcast of the transactions nobody watches.
+
         Args:
             asset_group_id (bytes): asset_group_id to watch
             user_id (bytes): user_id of the notified client
+            coalesce (bool): If True, the transactions inserted in coalesce_window are notified in a message
+            filter_user_id (bytes): If given, only the transactions having an asset of the user are notified
+            filter_asset_id (bytes): If given, only the transactions having the asset are notified
         """
-        self.insert_notification_list.setdefault(asset_group_id, set())
+        if asset_group_id not in self.insert_notification_list:
+            self.insert_notification_list[asset_group_id] = set()
+            self.networking.register_notification_subscriber(self.domain_id, asset_group_id)
         self.insert_notification_list[asset_group_id].add(user_id)
+        if filter_user_id is not None or filter_asset_id is not None:
+            self.notification_filters[(asset_group_id, user_id)] = (filter_user_id, filter_asset_id)
+        else:
+            self.notification_filters.pop((asset_group_id, user_id), None)
+        if coalesce:
+            self.coalesced_notification_list.setdefault(asset_group_id, set())
+            self.coalesced_notification_list[asset_group_id].add(user_id)
+        elif asset_group_id in self.coalesced_notification_list:
+            self._discard_coalesced_notification(asset_group_id, user_id)
 
     def unregister_notification(self, asset_group_id, user_id):
         """Unregister user from insert notification list
@@ -83,11 +146,20 @@ class UserMessageRouting:
             asset_group_id (bytes): watching asset_group_id
             user_id (bytes): user_id of the notified client
         """
-        if asset_group_id not in self.insert_notification_list:
+        if user_id not in self.insert_notification_list.get(asset_group_id, ()):
             return
         self.insert_notification_list[asset_group_id].remove(user_id)
         if len(self.insert_notification_list[asset_group_id]) == 0:
             del self.insert_notification_list[asset_group_id]
+            self.networking.unregister_notification_subscriber(self.domain_id, asset_group_id)
+        self.notification_filters.pop((asset_group_id, user_id), None)
+        if asset_group_id in self.coalesced_notification_list:
+            self._discard_coalesced_notification(asset_group_id, user_id)
+
+    def _discard_coalesced_notification(self, asset_group_id, user_id):
+        self.coalesced_notification_list[asset_group_id].discard(user_id)
+        if len(self.coalesced_notification_list[asset_group_id]) == 0:
+            del self.coalesced_notification_list[asset_group_id]
 
     def put_message(self, msg=None):
         """append a message to the queue"""
@@ -174,7 +246,25 @@ class UserMessageRouting:
                 dat = dst_info[3+int(dst_info[1])+int(dst_info[2]):]
                 if domain_id != self.domain_id:
                     continue
-                self._send_notification(transaction_id, dat)
+                # -- the transaction may have been inserted by another core sharing the DB
+                data_handler = self.networking.domains.get(domain_id, dict()).get('data', None)
+                if data_handler is not None:
+                    data_handler.add_to_txid_filter(transaction_id)
+                id_num = dat[0]
+                id_len = int((len(dat)-1)/id_num)
+                self._send_notification(transaction_id, [dat[1+i*id_len:1+(i+1)*id_len] for i in range(id_num)])
+            elif dst_info[0] == 2:
+                transaction_id = dst_info[3:3+int(dst_info[1])]
+                domain_id = dst_info[3+int(dst_info[1]):3+int(dst_info[1])+int(dst_info[2])]
+                dat = dst_info[3+int(dst_info[1])+int(dst_info[2]):]
+                if domain_id != self.domain_id:
+                    continue
+                data_handler = self.networking.domains.get(domain_id, dict()).get('data', None)
+                if data_handler is not None:
+                    data_handler.add_to_txid_filter(transaction_id)
+                asset_info = _parse_asset_info(dat)
+                asset_group_ids = list(dict.fromkeys(info[0] for info in asset_info))
+                self._send_notification(transaction_id, asset_group_ids, asset_info)
 
     def _process_msg_queue(self, socks, dst_info):
         cnt = 3
@@ -185,16 +275,40 @@ class UserMessageRouting:
             self.networking.redis_msg.expire(dst_info, bbc_network.MSG_EXPIRE_SECONDS)
             cnt -= 1
 
-    def _send_notification(self, transaction_id, dat):
-        id_num = dat[0]
-        id_len = int((len(dat)-1)/id_num)
-        asset_group_ids = list()
-        for i in range(id_num):
-            asset_group_ids.append(dat[1+i*id_len:1+(i+1)*id_len])
+    def _match_filter(self, asset_group_id, user_id, asset_info):
+        """Return True if the transaction matches the filter of the subscriber (always True without asset_info)"""
+        flt = self.notification_filters.get((asset_group_id, user_id), None)
+        if flt is None or asset_info is None:
+            return True
+        for info_group_id, asset_id, owner_id in asset_info:
+            if info_group_id == asset_group_id and flt[0] in (None, owner_id) and flt[1] in (None, asset_id):
+                return True
+        return False
+
+    def _send_notification(self, transaction_id, asset_group_ids, asset_info=None):
+        """Send NOTIFY_INSERTED to the subscribers of the asset groups
+
+        The filters of the subscribers are evaluated before the messages are built, so the subscribers that do not
+        match are not woken up.
+
+        Args:
+            transaction_id (bytes): inserted transaction_id
+            asset_group_ids (list): list of asset_group_ids in the transaction
+            asset_info (list): list of (asset_group_id, asset_id, user_id) in the transaction (None if unknown)
+        """
         user_list = set()
+        batches = set()
         for asset_group_id in asset_group_ids:
-            if asset_group_id in self.insert_notification_list:
-                user_list = user_list.union(self.insert_notification_list[asset_group_id])
+            coalesced = self.coalesced_notification_list.get(asset_group_id, ())
+            for user_id in list(self.insert_notification_list.get(asset_group_id, ())):
+                if not self._match_filter(asset_group_id, user_id, asset_info):
+                    continue
+                if user_id in coalesced:
+                    batches.add((asset_group_id, self.notification_filters.get((asset_group_id, user_id), None)))
+                else:
+                    user_list.add(user_id)
+        for key in batches:
+            self._add_coalesced_notification(key, transaction_id)
         if len(user_list) == 0:
             return
         msg = {
@@ -210,6 +324,62 @@ class UserMessageRouting:
                 continue
             self._send(socks, msg)
 
+    def _add_coalesced_notification(self, key, transaction_id):
+        """Add a transaction to a batch (sent when it is full or coalesce_window has passed)
+
+        Args:
+            key (tuple): (asset_group_id, filter of the subscribers (None for no filter))
+            transaction_id (bytes): inserted transaction_id
+        """
+        with self.notification_condition:
+            batch = self.pending_notifications.get(key, None)
+            if batch is None:
+                self.pending_notifications[key] = [time.time(), [transaction_id]]
+                self.notification_condition.notify()
+                return
+            batch[1].append(transaction_id)
+            if len(batch[1]) < self.coalesce_max_batch:
+                return
+            del self.pending_notifications[key]
+        self._send_coalesced_notification(key, batch[1])
+
+    def _coalesce_loop(self):
+        """Send the batches of the coalesced notification of which coalesce_window has passed"""
+        while True:
+            with self.notification_condition:
+                while len(self.pending_notifications) == 0:
+                    self.notification_condition.wait()
+                now = time.time()
+                oldest = min(batch[0] for batch in self.pending_notifications.values())
+                if oldest + self.coalesce_window > now:
+                    self.notification_condition.wait(oldest + self.coalesce_window - now)
+                    continue
+                batches = [(key, self.pending_notifications.pop(key)[1])
+                           for key, batch in list(self.pending_notifications.items())
+                           if batch[0] + self.coalesce_window <= now]
+            for key, transaction_ids in batches:
+                self._send_coalesced_notification(key, transaction_ids)
+
+    def _send_coalesced_notification(self, key, transaction_ids):
+        """Send a NOTIFY_INSERTED having the list of transaction_ids (KeyType.transaction_id_list)"""
+        asset_group_id, flt = key
+        msg = {
+            KeyType.domain_id: self.domain_id,
+            KeyType.command: bbclib.MsgType.NOTIFY_INSERTED,
+            KeyType.transaction_id_list: transaction_ids,
+            KeyType.asset_group_id: asset_group_id,
+            KeyType.asset_group_ids: [asset_group_id],
+        }
+        for user_id in list(self.coalesced_notification_list.get(asset_group_id, ())):
+            if self.notification_filters.get((asset_group_id, user_id), None) != flt:
+                continue
+            socks = self.registered_users.get(user_id, None)
+            msg[KeyType.destination_user_id] = user_id
+            if socks is None:
+                continue
+            self._send(socks, msg)
+        self.stats.update_stats_increment("user_message", "coalesced_notification", len(transaction_ids))
+
 
 class UserMessageRoutingDummy(UserMessageRouting):
     """Dummy class for bbc_core.py"""
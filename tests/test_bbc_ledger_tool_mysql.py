@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import shutil
+import sys
+sys.path.extend(["../", "../utils"])
+from bbc_simple.core import bbclib
+import bbc_ledger_tool
+
+user_id1 = bbclib.get_new_id("destination_id_test1")[:bbclib.DEFAULT_ID_LEN]
+asset_group_id1 = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
+src_domain_id_str = bbclib.convert_id_to_string(bbclib.get_new_id("ledger_tool_src"))
+dst_domain_id_str = bbclib.convert_id_to_string(bbclib.get_new_id("ledger_tool_dst"))
+keypair1 = bbclib.KeyPair()
+keypair1.generate()
+
+WORKING_DIR = ".bbc_ledger_tool"
+DUMP_DIR = ".bbc_ledger_dump"
+TX_NUM = 25
+
+transactions = list()
+
+
+class Args:
+    def __init__(self, domain_id_str, verify=0):
+        self.workingdir = WORKING_DIR
+        self.domain_id = domain_id_str
+        self.directory = DUMP_DIR
+        self.page_size = 7
+        self.batch_size = 3
+        self.verify = verify
+
+
+class TestBBcLedgerTool(object):
+
+    def test_01_chunk(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        definition = bbc_ledger_tool.TABLES["asset_info_table"][0]
+        rows = [(1, b'txid', b'asset_group_id', b'asset_id', None), (2, b'', b'a', b'b', b'c')]
+        dat = bbc_ledger_tool.encode_rows(definition, rows)
+        num, size = bbc_ledger_tool._CHUNK_HEADER.unpack_from(dat, 0)
+        assert num == 2
+        assert bbc_ledger_tool.decode_rows(definition, num, dat[bbc_ledger_tool._CHUNK_HEADER.size:]) == rows
+
+    def test_02_prepare(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        handler = bbc_ledger_tool.open_data_handler(WORKING_DIR, src_domain_id_str)
+        for i in range(TX_NUM):
+            txobj = bbclib.make_transaction(relation_num=1, witness=True)
+            bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                      asset_body=b'ledger %d' % i)
+            if i > 0:
+                bbclib.add_relation_pointer(txobj, relation_idx=0, ref_transaction_id=transactions[-1].transaction_id)
+            txobj.witness.add_witness(user_id1)
+            sig = txobj.sign(keypair=keypair1)
+            txobj.witness.add_signature(user_id=user_id1, signature=sig)
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+            transactions.append(txobj)
+
+    def test_03_export_import(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        bbc_ledger_tool.command_export(Args(src_domain_id_str))
+        bbc_ledger_tool.command_import(Args(dst_domain_id_str, verify=2))
+        handler = bbc_ledger_tool.open_data_handler(WORKING_DIR, dst_domain_id_str)
+        ret = handler.search_transaction(asset_group_id=asset_group_id1, count=0)
+        assert set(ret.keys()) == set(txobj.transaction_id for txobj in transactions)
+        ret = handler.search_transaction_topology(transactions[1].transaction_id)
+        assert len(ret) == 1 and ret[0][2] == transactions[0].transaction_id
+        src = bbc_ledger_tool.open_data_handler(WORKING_DIR, src_domain_id_str)
+        for table in bbc_ledger_tool.TABLES:
+            indexes = [set((r[2], r[4], r[7]) for r in h.exec_sql(sql="SHOW INDEX FROM %s" % table))
+                       for h in [handler, src]]
+            assert indexes[0] == indexes[1]
+        shutil.rmtree(DUMP_DIR)
+        shutil.rmtree(WORKING_DIR)
@@ -2,6 +2,8 @@
 import pytest
 
 import binascii
+import hashlib
+import random
 import sys
 sys.path.extend(["../"])
 from bbc_simple.core.bbclib import BBcTransaction, BBcEvent, BBcReference, BBcWitness, BBcRelation, BBcAsset, \
@@ -36,6 +38,146 @@ print("private_key(pem):\n", keypair1.get_private_key_in_pem())
 print("public_key:", binascii.b2a_hex(keypair1.public_key))
 
 
+def legacy_serialize(txobj, for_id=False):
+    """Reference encoder (the previous implementation of BBcTransaction.serialize in FORMAT_BINARY)"""
+    def bigint(val, size=32):
+        return bbclib.to_2byte(size) + bytes(val)
+
+    def part(dat, prefix=bbclib.to_4byte):
+        return prefix(len(dat)) + dat
+
+    def asset_dat(ast):
+        dat = bigint(ast.asset_id, ast.id_length) + bigint(ast.user_id, ast.id_length)
+        dat += bbclib.to_2byte(len(ast.nonce)) + ast.nonce + bbclib.to_4byte(ast.asset_file_size)
+        if ast.asset_file_size > 0:
+            dat += bigint(ast.asset_file_digest, ast.id_length)
+        if isinstance(ast.asset_body, dict):
+            astbdy = bbclib.bson.dumps(ast.asset_body)
+            return dat + bbclib.to_2byte(1) + bbclib.to_2byte(len(astbdy)) + astbdy
+        dat += bbclib.to_2byte(0) + bbclib.to_2byte(ast.asset_body_size)
+        if ast.asset_body_size > 0:
+            dat += ast.asset_body
+        return dat
+
+    def event_dat(evt):
+        dat = bigint(evt.asset_group_id, evt.id_length) + bbclib.to_2byte(len(evt.reference_indices))
+        dat += b''.join(bbclib.to_2byte(i) for i in evt.reference_indices)
+        dat += bbclib.to_2byte(len(evt.mandatory_approvers))
+        dat += b''.join(bigint(u, evt.id_length) for u in evt.mandatory_approvers)
+        dat += bbclib.to_2byte(evt.option_approver_num_numerator)
+        dat += bbclib.to_2byte(evt.option_approver_num_denominator)
+        dat += b''.join(bigint(evt.option_approvers[i], evt.id_length)
+                        for i in range(evt.option_approver_num_denominator))
+        return dat + part(asset_dat(evt.asset))
+
+    def reference_dat(refe):
+        dat = bigint(refe.asset_group_id, refe.id_length) + bigint(refe.transaction_id, refe.id_length)
+        dat += bbclib.to_2byte(refe.event_index_in_ref) + bbclib.to_2byte(len(refe.sig_indices))
+        return dat + b''.join(bbclib.to_2byte(i) for i in refe.sig_indices)
+
+    def pointer_dat(pt):
+        dat = bigint(pt.transaction_id, pt.id_length)
+        if pt.asset_id is None:
+            return dat + bbclib.to_2byte(0)
+        return dat + bbclib.to_2byte(1) + bigint(pt.asset_id, pt.id_length)
+
+    def relation_dat(rtn):
+        dat = bigint(rtn.asset_group_id, rtn.id_length) + bbclib.to_2byte(len(rtn.pointers))
+        dat += b''.join(part(pointer_dat(pt), bbclib.to_2byte) for pt in rtn.pointers)
+        if rtn.asset is None:
+            return dat + bbclib.to_4byte(0)
+        return dat + part(asset_dat(rtn.asset))
+
+    def witness_dat(wit):
+        dat = bbclib.to_2byte(len(wit.sig_indices))
+        for i in range(len(wit.sig_indices)):
+            dat += bigint(wit.user_ids[i], wit.id_length) + bbclib.to_2byte(wit.sig_indices[i])
+        return dat
+
+    def signature_dat(sig):
+        if sig.not_initialized:
+            return bbclib.to_4byte(KeyType.NOT_INITIALIZED)
+        return bbclib.to_4byte(sig.key_type) + bbclib.to_4byte(len(sig.pubkey) * 8) + sig.pubkey + \
+            bbclib.to_4byte(len(sig.signature) * 8) + sig.signature
+
+    dat = bbclib.to_4byte(txobj.version) + bbclib.to_8byte(txobj.timestamp) + bbclib.to_2byte(txobj.id_length)
+    dat += bbclib.to_2byte(len(txobj.events)) + b''.join(part(event_dat(e)) for e in txobj.events)
+    dat += bbclib.to_2byte(len(txobj.references)) + b''.join(part(reference_dat(r)) for r in txobj.references)
+    dat += bbclib.to_2byte(len(txobj.relations)) + b''.join(part(relation_dat(r)) for r in txobj.relations)
+    if txobj.witness is not None:
+        dat += bbclib.to_2byte(1) + part(witness_dat(txobj.witness))
+    else:
+        dat += bbclib.to_2byte(0)
+    if txobj.cross_ref is not None:
+        cross = bbclib.to_2byte(1) + part(bigint(txobj.cross_ref.domain_id) + bigint(txobj.cross_ref.transaction_id))
+    else:
+        cross = bbclib.to_2byte(0)
+    if for_id:
+        return hashlib.sha256(dat).digest() + cross
+    dat += cross + bbclib.to_2byte(len(txobj.signatures))
+    dat += b''.join(part(signature_dat(sig)) for sig in txobj.signatures)
+    return bbclib.to_2byte(txobj.format_type) + dat
+
+
+def make_random_transaction(rnd):
+    """Build a transaction with random contents (signatures are random bytes and are not verifiable)"""
+    id_length = rnd.choice([8, 16, 32])
+
+    def rid():
+        return bytes(rnd.getrandbits(8) for i in range(id_length))
+
+    def rasset():
+        choice = rnd.randint(0, 3)
+        if choice == 0:
+            return BBcAsset(user_id=rid(), asset_body=bytes(rnd.randint(0, 300)), id_length=id_length)
+        elif choice == 1:
+            return BBcAsset(user_id=rid(), asset_file=bytes(rnd.randint(1, 100)), id_length=id_length)
+        elif choice == 2:
+            return BBcAsset(user_id=rid(), asset_body={"key": rnd.randint(0, 1000), "list": [1, 2]},
+                            id_length=id_length)
+        return BBcAsset(user_id=rid(), id_length=id_length)
+
+    txobj = BBcTransaction(id_length=id_length)
+    txobj.timestamp = rnd.getrandbits(63)
+    for i in range(rnd.randint(0, 3)):
+        evt = BBcEvent(asset_group_id=rid(), id_length=id_length)
+        option_approvers = [rid() for j in range(rnd.randint(0, 3))]
+        evt.add(reference_index=rnd.randint(0, 10), mandatory_approver=rid(), asset=rasset(),
+                option_approver_num_numerator=len(option_approvers),
+                option_approver_num_denominator=len(option_approvers))
+        for user in option_approvers:
+            evt.add(option_approver=user)
+        txobj.add(event=evt)
+    for i in range(rnd.randint(0, 2)):
+        refe = BBcReference(asset_group_id=rid(), transaction=txobj, id_length=id_length)
+        refe.transaction_id = rid()
+        refe.event_index_in_ref = rnd.randint(0, 3)
+        refe.sig_indices = [rnd.randint(0, 5) for j in range(rnd.randint(0, 3))]
+        txobj.add(reference=refe)
+    for i in range(rnd.randint(0, 4)):
+        rtn = BBcRelation(asset_group_id=rid(), id_length=id_length)
+        for j in range(rnd.randint(0, 3)):
+            rtn.add(pointer=bbclib.BBcPointer(transaction_id=rid(), asset_id=rnd.choice([None, rid()]),
+                                              id_length=id_length))
+        if rnd.randint(0, 4) > 0:
+            rtn.add(asset=rasset())
+        txobj.add(relation=rtn)
+    if rnd.randint(0, 1):
+        txobj.add(witness=BBcWitness(id_length=id_length))
+        for i in range(rnd.randint(0, 3)):
+            txobj.witness.add_witness(rid())
+    if rnd.randint(0, 1):
+        txobj.add(cross_ref=BBcCrossRef(domain_id=bytes(rnd.getrandbits(8) for i in range(32)),
+                                        transaction_id=bytes(rnd.getrandbits(8) for i in range(32))))
+    for i in range(len(txobj.signatures)):
+        if rnd.randint(0, 3) > 0:
+            sig = bbclib.BBcSignature(key_type=rnd.choice([KeyType.ECDSA_SECP256k1, KeyType.ECDSA_P256v1]))
+            sig.add(signature=bytes(rnd.getrandbits(8) for j in range(64)),
+                    pubkey=bytes(rnd.getrandbits(8) for j in range(65)))
+            txobj.signatures[i] = sig
+    return txobj
+
+
 class TestBBcLib(object):
 
     def test_00_keypair(self):
@@ -252,3 +394,108 @@ class TestBBcLib(object):
         digest = transaction1.digest()
         ret = transaction1.signatures[0].verify(digest)
         assert not ret
+
+    def test_09_deserialize_from_buffer(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txobj = bbclib.make_transaction(relation_num=5, witness=True, id_length=ID_LENGTH)
+        for i in range(5):
+            bbclib.add_relation_asset(txobj, relation_idx=i, asset_group_id=asset_group_id,
+                                      user_id=user_id, asset_body=bytes(range(256))*16)
+            bbclib.add_relation_pointer(txobj, i, ref_transaction_id=transaction2.digest(),
+                                        ref_asset_id=transaction2.events[0].asset.asset_id)
+        txobj.witness.add_witness(user_id)
+        sig = txobj.sign(key_type=CURVE_TYPE, private_key=keypair1.private_key, public_key=keypair1.public_key)
+        txobj.witness.add_signature(user_id=user_id, signature=sig)
+        dat = txobj.serialize()
+
+        for buf in [dat, bytearray(dat), memoryview(dat)]:
+            txobj2 = BBcTransaction(deserialize=buf)
+            assert txobj2.transaction_id == txobj.transaction_id
+            assert txobj2.transaction_data == dat
+            assert txobj2.relations[4].asset.asset_body == bytes(range(256))*16
+            assert isinstance(txobj2.relations[0].pointers[0].transaction_id, bytes)
+            assert txobj2.signatures[0].verify(txobj2.transaction_id)
+            assert txobj2.serialize() == dat
+
+    def test_10_scan_transaction(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for fmt in range(bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB+1):
+            txobj = bbclib.make_transaction(event_num=1, relation_num=2, witness=True, format_type=fmt,
+                                            id_length=ID_LENGTH)
+            bbclib.add_event_asset(txobj, 0, asset_group_id=asset_group_id, user_id=user_id, asset_body=b'eeeee')
+            bbclib.add_relation_asset(txobj, 0, asset_group_id=asset_group_id, user_id=user_id,
+                                      asset_body={"account": 10000})
+            bbclib.add_relation_asset(txobj, 1, asset_group_id=asset_group_id, user_id=user_id2, asset_body=b'r')
+            bbclib.add_relation_pointer(txobj, 0, ref_transaction_id=transaction1_id[:ID_LENGTH])
+            bbclib.add_relation_pointer(txobj, 1, ref_transaction_id=transaction2_id[:ID_LENGTH],
+                                        ref_asset_id=transaction1_id[:ID_LENGTH])
+            txobj.add(cross_ref=BBcCrossRef(domain_id=domain_id, transaction_id=transaction1_id,
+                                            format_type=fmt))
+            txobj.witness.add_witness(user_id)
+            sig = txobj.sign(key_type=CURVE_TYPE, private_key=keypair1.private_key,
+                             public_key=keypair1.public_key)
+            txobj.witness.add_signature(user_id=user_id, signature=sig)
+            dat = txobj.serialize()
+
+            idx = bbclib.scan_transaction(dat)
+            assert idx.format_type == fmt
+            assert idx.transaction_id == txobj.transaction_id
+            assert idx.transaction_base_digest == txobj.transaction_base_digest
+            assert idx.timestamp == txobj.timestamp
+            assert idx.asset_info == [(evt.asset_group_id, evt.asset.asset_id, evt.asset.user_id)
+                                      for evt in txobj.events+txobj.relations]
+            assert idx.pointers == [transaction1_id[:ID_LENGTH], transaction2_id[:ID_LENGTH]]
+            assert len(idx.signatures) == 1 and idx.signatures[0].verify(idx.transaction_id)
+            flag, valid_asset, invalid_asset = bbclib.validate_transaction_object(idx)
+            assert flag
+            assert idx.get_transaction().transaction_id == txobj.transaction_id
+        assert bbclib.scan_transaction(b'\x00\x00\x01') is None
+
+    def test_11_compact_objects(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txobj = BBcTransaction(deserialize=transaction1.serialize())
+        for obj in [txobj, txobj.relations[0], txobj.relations[0].asset, txobj.relations[0].pointers[0],
+                    txobj.witness, txobj.signatures[0], BBcEvent(), BBcReference(None, None), BBcCrossRef()]:
+            assert not hasattr(obj, '__dict__')
+        sig = txobj.signatures[0]
+        assert sig._keypair is None
+        assert sig.keypair.public_key_len.value == len(sig.pubkey)
+
+    def test_12_serialize_differential(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        rnd = random.Random(1234)
+        for i in range(300):
+            txobj = make_random_transaction(rnd)
+            dat = txobj.serialize()
+            assert dat == legacy_serialize(txobj)
+            assert txobj.transaction_base_digest == legacy_serialize(txobj, for_id=True)[:32]
+            assert txobj.serialize(for_id=True) == legacy_serialize(txobj, for_id=True)
+            txid = txobj.digest()
+            assert txid == hashlib.sha256(legacy_serialize(txobj, for_id=True)).digest()[:txobj.id_length]
+            if any(rtn.asset is None for rtn in txobj.relations):
+                continue  # BBcTransaction.deserialize requires an asset in each relation
+            txobj2 = BBcTransaction(deserialize=dat)
+            assert txobj2.transaction_id == txid
+            assert txobj2.serialize() == dat
+        for obj in [asset1, asset2, transaction1.relations[0], transaction1.witness]:
+            assert obj.serialize() == bbclib._serialize_part(obj)
+
+    def test_13_asset_body_encoded_once(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        asset = BBcAsset(user_id=user_id, asset_body={"account": 10000, "list": [1, 2]})
+        expected = asset.serialize()
+        event = BBcEvent(asset_group_id=asset_group_id, id_length=ID_LENGTH)
+        event.add(asset=asset, mandatory_approver=user_id)
+        txobj = BBcTransaction(id_length=ID_LENGTH)
+        txobj.add(event=event)
+        txdata = txobj.serialize()
+        calls = list()
+        dumps = bbclib.bson.dumps
+        bbclib.bson.dumps = lambda obj: calls.append(obj) or dumps(obj)
+        try:
+            assert asset.serialize() == expected
+            assert len(calls) == 1
+            assert txobj.serialize() == txdata
+            assert len(calls) == 2
+        finally:
+            bbclib.bson.dumps = dumps
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import sys
+sys.path.extend(["../"])
+from bbc_simple.core.bbclib import BBcArchiveReader, BBcArchiveWriter, KeyPair, KeyType
+from bbc_simple.core import bbclib
+
+CURVE_TYPE = KeyType.ECDSA_P256v1
+ARCHIVE_FILE = ".test_archive.bbca"
+TX_NUM = 30
+
+user_id = bbclib.get_new_id("user_id_test1")[:bbclib.DEFAULT_ID_LEN]
+asset_group_id = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
+keypair1 = KeyPair(curvetype=CURVE_TYPE)
+keypair1.generate()
+formats = [bbclib.BBcFormat.FORMAT_BINARY, bbclib.BBcFormat.FORMAT_COMPACT, bbclib.BBcFormat.FORMAT_MSGPACK,
+           bbclib.BBcFormat.FORMAT_BSON_COMPRESS_ZLIB]
+
+transactions = list()
+
+
+def make_transaction(fmt, num):
+    txobj = bbclib.make_transaction(relation_num=1, witness=True, format_type=fmt)
+    bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id, user_id=user_id,
+                              asset_body=b'archived asset %d' % num)
+    if len(transactions) > 0:
+        bbclib.add_relation_pointer(txobj, relation_idx=0, ref_transaction_id=transactions[-1].transaction_id)
+    txobj.witness.add_witness(user_id)
+    sig = txobj.sign(keypair=keypair1)
+    txobj.witness.add_signature(user_id=user_id, signature=sig)
+    return txobj
+
+
+class TestBBcLibArchive(object):
+
+    def test_01_write(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for i in range(TX_NUM):
+            transactions.append(make_transaction(formats[i % len(formats)], i))
+        base = transactions[0].timestamp - 10
+        with BBcArchiveWriter(ARCHIVE_FILE, timestamp_base=base) as writer:
+            for i, txobj in enumerate(transactions):
+                if i % 3 == 0:
+                    assert writer.write(txobj.serialize(timestamp_base=base))
+                elif i % 3 == 1:
+                    assert writer.write(bbclib.scan_transaction(txobj.serialize(timestamp_base=base),
+                                                                timestamp_base=base))
+                else:
+                    assert writer.write(txobj)
+            assert writer.count == TX_NUM
+
+    def test_02_read_index(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for use_mmap in [True, False]:
+            with BBcArchiveReader(ARCHIVE_FILE, use_mmap=use_mmap) as reader:
+                assert reader.timestamp_base == transactions[0].timestamp - 10
+                idxs = list(reader)
+                assert not reader.broken
+            assert [idx.transaction_id for idx in idxs] == [txobj.transaction_id for txobj in transactions]
+            assert [idx.format_type for idx in idxs] == [txobj.format_type for txobj in transactions]
+            assert idxs[1].pointers == [transactions[0].transaction_id]
+
+    def test_03_read_transactions(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        with BBcArchiveReader(ARCHIVE_FILE) as reader:
+            for txobj, txobj2 in zip(transactions, reader.transactions()):
+                assert txobj2.transaction_id == txobj.transaction_id
+                assert txobj2.timestamp == txobj.timestamp
+                assert txobj2.relations[0].asset.asset_body == txobj.relations[0].asset.asset_body
+
+    def test_04_validate(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        expected = [(txobj.transaction_id, True) for txobj in transactions]
+        with BBcArchiveReader(ARCHIVE_FILE) as reader:
+            assert list(reader.validate(processes=0)) == expected
+            assert list(reader.validate(processes=2, batch_size=7)) == expected
+
+    def test_05_broken_archive(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        with open(ARCHIVE_FILE, "rb") as f:
+            dat = f.read()
+        with open(ARCHIVE_FILE, "wb") as f:
+            f.write(dat[:-5])
+        for use_mmap in [True, False]:
+            with BBcArchiveReader(ARCHIVE_FILE, use_mmap=use_mmap) as reader:
+                assert len(list(reader)) == TX_NUM - 1
+                assert reader.broken
+        with open(ARCHIVE_FILE, "wb") as f:
+            f.write(b'XXXX' + dat[4:])
+        with BBcArchiveReader(ARCHIVE_FILE) as reader:
+            assert reader.broken
+            assert len(list(reader.records())) == 0
+        os.remove(ARCHIVE_FILE)
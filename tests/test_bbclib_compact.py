@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import binascii
+import random
+import sys
+sys.path.extend(["../"])
+from bbc_simple.core.bbclib import BBcTransaction, BBcEvent, BBcReference, BBcWitness, BBcRelation, BBcAsset, \
+    BBcCrossRef, KeyPair, KeyType
+from bbc_simple.core import bbclib
+from test_bbclib import make_random_transaction
+
+ID_LENGTH = 8
+CURVE_TYPE = KeyType.ECDSA_P256v1
+
+user_id = bbclib.get_new_id("user_id_test1")[:ID_LENGTH]
+user_id2 = bbclib.get_new_id("user_id_test2")[:ID_LENGTH]
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")[:ID_LENGTH]
+keypair1 = KeyPair(curvetype=CURVE_TYPE)
+keypair1.generate()
+keypair2 = KeyPair(curvetype=CURVE_TYPE)
+keypair2.generate()
+
+transaction1 = None
+transaction2 = None
+fmt = bbclib.BBcFormat.FORMAT_COMPACT
+
+
+class TestBBcLibCompact(object):
+
+    def test_01_transaction(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global transaction1
+        transaction1 = bbclib.make_transaction(event_num=1, relation_num=1, witness=True, format_type=fmt)
+        transaction1.events[0].add(asset_group_id=asset_group_id, mandatory_approver=user_id)
+        transaction1.events[0].asset.add(user_id=user_id, asset_body=b'event asset')
+        bbclib.add_relation_asset(transaction1, relation_idx=0, asset_group_id=asset_group_id, user_id=user_id,
+                                  asset_body={"key": "value"})
+        bbclib.add_relation_pointer(transaction1, relation_idx=0,
+                                    ref_transaction_id=bbclib.get_new_id("dummy1")[:ID_LENGTH])
+        transaction1.witness.add_witness(user_id)
+        transaction1.witness.add_witness(user_id2)
+        for uid, kp in [(user_id, keypair1), (user_id2, keypair2)]:
+            sig = transaction1.sign(keypair=kp)
+            transaction1.add_signature(user_id=uid, signature=sig)
+        dat = transaction1.serialize()
+        assert bbclib.get_n_byte_int(0, 2, dat)[1] == fmt
+        print(transaction1)
+
+        txobj = BBcTransaction(deserialize=dat)
+        assert txobj.format_type == fmt
+        assert txobj.transaction_id == transaction1.transaction_id
+        assert txobj.transaction_base_digest == transaction1.transaction_base_digest
+        assert txobj.serialize() == dat
+        assert txobj.relations[0].asset.asset_body == {"key": "value"}
+        assert txobj.events[0].mandatory_approvers == [user_id]
+        assert txobj.witness.user_ids == [user_id, user_id2]
+        assert bbclib.validate_transaction_object(txobj)[0]
+
+    def test_02_transaction_with_reference_and_cross_ref(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global transaction2
+        transaction2 = bbclib.make_transaction(relation_num=1, format_type=fmt)
+        bbclib.add_relation_asset(transaction2, relation_idx=0, asset_group_id=asset_group_id, user_id=user_id2,
+                                  asset_body=b'relation asset')
+        bbclib.add_relation_pointer(transaction2, relation_idx=0, ref_transaction_id=transaction1.transaction_id,
+                                    ref_asset_id=transaction1.relations[0].asset.asset_id)
+        bbclib.add_reference_to_transaction(transaction2, asset_group_id, transaction1, 0)
+        transaction2.add(cross_ref=BBcCrossRef(domain_id=domain_id, transaction_id=bbclib.get_new_id("cross")))
+        sig = transaction2.sign(keypair=keypair1)
+        transaction2.references[0].add_signature(user_id=user_id, signature=sig)
+        dat = transaction2.serialize()
+
+        txobj = BBcTransaction(deserialize=dat)
+        assert txobj.transaction_id == transaction2.transaction_id
+        assert txobj.references[0].transaction_id == transaction1.transaction_id
+        assert txobj.relations[0].pointers[0].asset_id == transaction1.relations[0].asset.asset_id
+        assert txobj.cross_ref.domain_id == domain_id
+        assert bbclib.validate_transaction_object(txobj)[0]
+
+    def test_03_delta_timestamp(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        base = transaction1.timestamp - 100
+        dat = transaction1.serialize(timestamp_base=base)
+        assert len(dat) < len(transaction1.serialize())
+        txobj = BBcTransaction()
+        assert not txobj.deserialize(dat)
+        txobj = BBcTransaction()
+        assert txobj.deserialize(dat, timestamp_base=base)
+        assert txobj.timestamp == transaction1.timestamp
+        assert txobj.transaction_id == transaction1.transaction_id
+        assert bbclib.scan_transaction(dat) is None
+        idx = bbclib.scan_transaction(dat, timestamp_base=base)
+        assert idx.transaction_id == transaction1.transaction_id
+        assert idx.get_transaction().timestamp == transaction1.timestamp
+
+    def test_04_scan_transaction(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for txobj in [transaction1, transaction2]:
+            idx = bbclib.scan_transaction(txobj.serialize())
+            assert idx.format_type == fmt
+            assert idx.transaction_id == txobj.transaction_id
+            assert idx.transaction_base_digest == txobj.transaction_base_digest
+            assets = [(evt.asset_group_id, evt.asset.asset_id, evt.asset.user_id) for evt in txobj.events]
+            assets += [(rtn.asset_group_id, rtn.asset.asset_id, rtn.asset.user_id) for rtn in txobj.relations]
+            assert idx.asset_info == assets
+            pointers = [refe.transaction_id for refe in txobj.references]
+            pointers += [pt.transaction_id for rtn in txobj.relations for pt in rtn.pointers]
+            assert idx.pointers == pointers
+            assert bbclib.validate_transaction_object(idx)[0]
+        assert bbclib.scan_transaction(transaction1.serialize()[:-3]) is None
+
+    def test_05_compare_with_binary(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        rnd = random.Random(4321)
+        for i in range(200):
+            txobj = make_random_transaction(rnd)
+            if any(rtn.asset is None for rtn in txobj.relations):
+                continue
+            bindat = txobj.serialize()
+            txobj.format_type = fmt
+            dat = txobj.serialize()
+            assert len(dat) < len(bindat)
+            txobj2 = BBcTransaction(deserialize=dat)
+            assert txobj2.transaction_id == txobj.digest()
+            assert txobj2.serialize() == dat
+            txobj2.format_type = bbclib.BBcFormat.FORMAT_BINARY
+            assert txobj2.serialize() == bindat
+
+    def test_06_id_length_mismatch(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txobj = bbclib.make_transaction(relation_num=1, format_type=fmt)
+        bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id, user_id=user_id)
+        txobj.relations[0].asset_group_id = asset_group_id[:4]
+        with pytest.raises(ValueError):
+            txobj.serialize()
+
+    def test_07_verify_using_cross_ref(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txobj = bbclib.make_transaction(relation_num=1, witness=True, format_type=fmt, id_length=32)
+        bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=bbclib.get_new_id("asset_group_1"),
+                                  user_id=bbclib.get_new_id("user_id_test1"))
+        txobj.add(cross_ref=BBcCrossRef(domain_id=domain_id, transaction_id=bbclib.get_new_id("cross")))
+        txobj.witness.add_witness(bbclib.get_new_id("user_id_test1"))
+        sig = txobj.sign(keypair=keypair1)
+        txobj.witness.add_signature(user_id=bbclib.get_new_id("user_id_test1"), signature=sig)
+        txobj.serialize()
+
+        cross_ref_data = bytearray()
+        txobj.cross_ref._pack_compact(cross_ref_data)
+        sigdata = bytearray()
+        sig._pack_compact(sigdata)
+        assert bbclib.verify_using_cross_ref(domain_id, txobj.cross_ref.transaction_id, txobj.transaction_base_digest,
+                                             bytes(cross_ref_data), bytes(sigdata), format_type=fmt)
+        assert not bbclib.verify_using_cross_ref(domain_id, bbclib.get_new_id("other"), txobj.transaction_base_digest,
+                                                 bytes(cross_ref_data), bytes(sigdata), format_type=fmt)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import shutil
+import sys
+sys.path.extend(["../"])
+from bbc_simple.core.bbclib import BBcTransaction, BBcCrossRef, KeyPair, KeyType
+from bbc_simple.core import bbclib
+
+ID_LENGTH = 8
+CURVE_TYPE = KeyType.ECDSA_P256v1
+ZDICT_DIR = ".zdict_test"
+
+user_id = bbclib.get_new_id("user_id_test1")[:ID_LENGTH]
+user_id2 = bbclib.get_new_id("user_id_test2")[:ID_LENGTH]
+domain_id = bbclib.get_new_id("testdomain")
+asset_group_id = bbclib.get_new_id("asset_group_1")[:ID_LENGTH]
+keypair1 = KeyPair(curvetype=CURVE_TYPE)
+keypair1.generate()
+
+zdict = None
+transactions = list()
+
+
+def make_transaction(fmt, num, prev=None, cross_ref=None):
+    txobj = bbclib.make_transaction(relation_num=1, witness=True, format_type=fmt)
+    if cross_ref is not None:
+        txobj.add(cross_ref=cross_ref)
+    bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id, user_id=user_id,
+                              asset_body={"account": 10000 + num, "type": "payment", "amount": 1000, "message": "test"})
+    if prev is not None:
+        bbclib.add_relation_pointer(txobj, relation_idx=0, ref_transaction_id=prev.transaction_id,
+                                    ref_asset_id=prev.relations[0].asset.asset_id)
+    txobj.witness.add_witness(user_id)
+    sig = txobj.sign(keypair=keypair1)
+    txobj.witness.add_signature(user_id=user_id, signature=sig)
+    return txobj
+
+
+class TestBBcLibZdict(object):
+
+    def test_01_train(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global zdict
+        prev = None
+        for i in range(50):
+            prev = make_transaction(bbclib.BBcFormat.FORMAT_MSGPACK, i, prev)
+            transactions.append(prev)
+        samples = [txobj.serialize_obj(no_header=True) for txobj in transactions]
+        zdict = bbclib.train_zdict(samples, size=4096)
+        assert 0 < len(zdict) <= 4096
+        assert asset_group_id in zdict or user_id in zdict
+        bbclib.register_zdict(1, zdict)
+        assert bbclib.get_zdict(1) == zdict
+
+    def test_02_serialize(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        fmt = bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT
+        zlib_fmt = bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB
+        txobj = make_transaction(fmt, 100, transactions[-1])
+        dat = txobj.serialize()
+        assert txobj.zdict_id == 1
+        assert bbclib.get_zdict_id(dat[2:]) == 1
+        assert len(dat) < len(make_transaction(zlib_fmt, 100, transactions[-1]).serialize())
+
+        txobj2 = BBcTransaction(deserialize=dat)
+        assert txobj2.format_type == fmt
+        assert txobj2.zdict_id == 1
+        assert txobj2.transaction_id == txobj.transaction_id
+        assert txobj2.relations[0].asset.asset_body == txobj.relations[0].asset.asset_body
+        assert txobj2.serialize() == dat
+        assert bbclib.validate_transaction_object(txobj2)[0]
+        idx = bbclib.scan_transaction(dat)
+        assert idx.transaction_id == txobj.transaction_id
+        assert bbclib.validate_transaction_object(idx)[0]
+
+    def test_03_bson(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        fmt = bbclib.BBcFormat.FORMAT_BSON_COMPRESS_ZDICT
+        txobj = make_transaction(fmt, 200,
+                                 cross_ref=BBcCrossRef(domain_id=domain_id, transaction_id=bbclib.get_new_id("cross")))
+        dat = txobj.serialize()
+        txobj2 = BBcTransaction(deserialize=dat)
+        assert txobj2.transaction_id == txobj.transaction_id
+        assert txobj2.cross_ref.domain_id == domain_id
+        assert bbclib.validate_transaction_object(txobj2)[0]
+
+    def test_04_new_version(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        fmt = bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT
+        old = make_transaction(fmt, 300).serialize()
+        bbclib.register_zdict(2, zdict[:1024])
+        txobj = make_transaction(fmt, 301)
+        dat = txobj.serialize()
+        assert bbclib.get_zdict_id(dat[2:]) == 2
+        assert BBcTransaction(deserialize=old).zdict_id == 1
+        assert BBcTransaction(deserialize=dat).transaction_id == txobj.transaction_id
+
+        txobj = make_transaction(fmt, 302)
+        txobj.zdict_id = 1
+        assert bbclib.get_zdict_id(txobj.serialize()[2:]) == 1
+
+    def test_05_unknown_dictionary(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        fmt = bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT
+        txobj = make_transaction(fmt, 400)
+        txobj.zdict_id = 99
+        assert txobj.serialize() is None
+
+        dat = bytearray(make_transaction(fmt, 401).serialize())
+        dat[2:6] = (99).to_bytes(4, "little")
+        assert not BBcTransaction().deserialize(bytes(dat))
+        assert bbclib.error_code == bbclib.EBADTRANSACTION
+        assert bbclib.scan_transaction(bytes(dat)) is None
+
+    def test_06_save_and_load(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        if os.path.exists(ZDICT_DIR):
+            shutil.rmtree(ZDICT_DIR)
+        bbclib.save_zdict(ZDICT_DIR, 3, zdict)
+        bbclib.save_zdict(ZDICT_DIR, 10, zdict[:2048])
+        assert bbclib.load_zdicts(ZDICT_DIR) == [3, 10]
+        assert bbclib.get_zdict(10) == zdict[:2048]
+        txobj = make_transaction(bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT, 500)
+        assert bbclib.get_zdict_id(txobj.serialize()[2:]) == 10
+        shutil.rmtree(ZDICT_DIR)
+        assert bbclib.load_zdicts(ZDICT_DIR) == []
+
+    def test_07_loader(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        fmt = bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT
+        bbclib.register_zdict(20, zdict, default=False)
+        txobj = make_transaction(fmt, 600)
+        txobj.zdict_id = 20
+        dat = txobj.serialize()
+        del bbclib._zdict_registry[20]
+        assert not BBcTransaction().deserialize(dat)
+
+        requested = list()
+        bbclib.set_zdict_loader(lambda dict_id: requested.append(dict_id) or (zdict if dict_id == 20 else None))
+        try:
+            txobj2 = BBcTransaction()
+            assert txobj2.deserialize(dat)
+            assert txobj2.transaction_id == txobj.transaction_id
+            assert bbclib.get_zdict(20) == zdict
+            assert BBcTransaction().deserialize(dat)
+            assert requested == [20]
+        finally:
+            bbclib.set_zdict_loader(None)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import sys
+sys.path.extend(["../"])
+from bbc_simple.core import bbclib
+from bbc_simple.core.bloom_filter import ScalableBloomFilter
+
+SNAPSHOT_FILE = ".test_bloom_filter.txid_filter"
+
+txids = [bbclib.get_new_id("txid %d" % i) for i in range(3000)]
+absent_txids = [bbclib.get_new_id("absent txid %d" % i) for i in range(10000)]
+txid_filter = None
+
+
+class TestBloomFilter(object):
+
+    def test_01_add(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global txid_filter
+        txid_filter = ScalableBloomFilter(initial_capacity=1000, error_rate=0.01)
+        for txid in txids:
+            txid_filter.add(txid)
+        assert len(txid_filter) == len(txids)
+        assert len(txid_filter.filters) == 2
+        for txid in txids:
+            assert txid in txid_filter
+
+    def test_02_error_rate(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        false_positive = sum(1 for txid in absent_txids if txid in txid_filter)
+        print("false positive: %d/%d, estimated: %f, memory: %d bytes" %
+              (false_positive, len(absent_txids), txid_filter.estimated_error_rate(), txid_filter.memory_size()))
+        assert txid_filter.estimated_error_rate() < 0.02
+        assert false_positive < len(absent_txids) * 0.02
+
+    def test_03_snapshot(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txid_filter.save(SNAPSHOT_FILE, tag=len(txids))
+        loaded, tag = ScalableBloomFilter.load(SNAPSHOT_FILE)
+        assert tag == len(txids)
+        assert len(loaded) == len(txids)
+        for txid in txids:
+            assert txid in loaded
+        assert [f.bits for f in loaded.filters] == [f.bits for f in txid_filter.filters]
+        with open(SNAPSHOT_FILE, "r+b") as f:
+            f.truncate(100)
+        assert ScalableBloomFilter.load(SNAPSHOT_FILE) == (None, None)
+        os.remove(SNAPSHOT_FILE)
@@ -2,16 +2,26 @@
 import pytest
 
 import subprocess
+import threading
 import pprint
 import sys
+import time
 sys.path.extend(["../"])
 from bbc_simple.core import bbclib
 from bbc_simple.core import bbc_stats
-from bbc_simple.core.data_handler import DataHandler
+from bbc_simple.core.data_handler import DataHandler, make_search_cursor, parse_search_cursor, shard_index
 
 user_id1 = bbclib.get_new_id("destination_id_test1")[:bbclib.DEFAULT_ID_LEN]
 user_id2 = bbclib.get_new_id("destination_id_test2")[:bbclib.DEFAULT_ID_LEN]
 domain_id = bbclib.get_new_id("test_domain")
+deferred_domain_id = bbclib.get_new_id("test_domain_deferred")
+sharded_domain_id = bbclib.get_new_id("test_domain_sharded")
+body_index_domain_id = bbclib.get_new_id("test_domain_body_index")
+head_domain_id = bbclib.get_new_id("test_domain_head")
+change_feed_domain_id = bbclib.get_new_id("test_domain_change_feed")
+concurrent_domain_id = bbclib.get_new_id("test_domain_concurrent")
+shared_index_domain_id = bbclib.get_new_id("test_domain_shared_index")
+feed_order_domain_id = bbclib.get_new_id("test_domain_feed_order")
 asset_group_id1 = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
 asset_group_id2 = bbclib.get_new_id("asset_group_2")[:bbclib.DEFAULT_ID_LEN]
 txid1 = bbclib.get_new_id("dummy_txid_1")[:bbclib.DEFAULT_ID_LEN]
@@ -147,6 +157,402 @@ class TestDataHandler(object):
         assert len(ret) == 1
         assert ret[0][1] == transactions[2].transaction_id
 
+    def test_10_search_transaction_with_cursor(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        assert parse_search_cursor(make_search_cursor(1, 12345)) == (1, 12345)
+        assert parse_search_cursor(b'broken') == (None, None)
+        assert parse_search_cursor(make_search_cursor(0, [3, None, 5])) == (0, [3, None, 5])
+        assert parse_search_cursor(make_search_cursor(1, [(100, 3), None])) == (1, [(100, 3), None])
+        for direction in [0, 1]:
+            found = list()
+            cursor = None
+            while True:
+                ret_txobj, cursor = data_handler.search_transaction_with_cursor(asset_group_id=asset_group_id1,
+                                                                                direction=direction, count=3,
+                                                                                cursor=cursor)
+                found.extend(ret_txobj.keys())
+                if cursor is None:
+                    break
+                assert len(ret_txobj) == 3
+            assert len(found) == 10 and len(set(found)) == 10
+            expected = [txobj.transaction_id for txobj in transactions]
+            assert found == (expected if direction == 1 else list(reversed(expected)))
+
+    def test_11_count_transactions(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1) == 10
+        assert data_handler.count_transactions(user_id=user_id2) == 10
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1, user_id=user_id1) == 10
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1, user_id=user_id2) == 0
+        asid = transactions[3].relations[0].asset.asset_id
+        assert data_handler.count_transactions(asset_group_id=asset_group_id2, asset_id=asid) == 1
+
+        data_handler.remove(transaction_id=transactions[9].transaction_id)
+        data_handler.remove(transaction_id=transactions[9].transaction_id)
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1) == 9
+        assert data_handler.count_transactions(asset_group_id=asset_group_id2, user_id=user_id2) == 9
+
+        data_handler.exec_sql(sql="DELETE FROM counter_table", commit=True)
+        assert data_handler.count_transactions(user_id=user_id1) == 0
+        assert data_handler.rebuild_counters() == 6
+        assert data_handler.count_transactions(user_id=user_id1) == 9
+        assert data_handler.insert_transaction(transactions[9].serialize(), transactions[9]) is not None
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1, user_id=user_id1) == 10
+
+    def test_12_txid_filter(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        conf["bloom_filter"] = {"initial_capacity": 100, "error_rate": 0.01}
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir=".", domain_id=domain_id)
+        assert len(handler.txid_filter) >= 10
+        for txobj in transactions:
+            assert handler.has_transaction(txobj.transaction_id)
+            assert txobj.transaction_id in handler.search_transaction(transaction_id=txobj.transaction_id)
+        assert not handler.has_transaction(txid2)
+        assert handler.search_transaction(transaction_id=txid2) is None
+        assert handler.insert_transaction(transactions[0].serialize(), transactions[0]) is None
+        assert handler.save_txid_filter()
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir=".", domain_id=domain_id)
+        assert handler.has_transaction(transactions[5].transaction_id)
+
+        # -- a transaction inserted by another core without notification is found in the DB
+        other = DataHandler(networking=DummyCore().networking, config=conf, workingdir=None, domain_id=domain_id)
+        txobjs = list()
+        for i in range(3):
+            txobj = bbclib.make_transaction(event_num=1)
+            bbclib.add_event_asset(txobj, event_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                   asset_body=b'inserted by another core %d' % i)
+            txobj.digest()
+            txobjs.append(txobj)
+        assert other.insert_transaction(txobjs[0].serialize(), txobjs[0]) is not None
+        assert handler.has_transaction(txobjs[0].transaction_id)
+        assert handler.stats.get_stats()["txid_filter"]["missed_insert"] == 1
+
+        # -- the refresh reads the inserts of the other cores, and a negative is trusted while it is fresh
+        assert other.insert_transaction(txobjs[2].serialize(), txobjs[2]) is not None
+        assert handler.refresh_txid_filter()
+        assert txobjs[2].transaction_id in handler.txid_filter
+        num = handler.stats.get_stats()["data_handler"]["exec_sql"]
+        assert not handler.has_transaction(txid2)
+        assert handler.stats.get_stats()["data_handler"]["exec_sql"] == num
+        handler.txid_filter_refreshed_at = 0
+        assert not handler.has_transaction(txid2)
+        assert handler.stats.get_stats()["data_handler"]["exec_sql"] == num + 1
+        other.remove(transaction_id=txobjs[2].transaction_id)
+
+        # -- the snapshot is not used after as many removes as inserts
+        assert handler.save_txid_filter()
+        other.remove(transaction_id=txobjs[0].transaction_id)
+        assert other.insert_transaction(txobjs[1].serialize(), txobjs[1]) is not None
+        conf["bloom_filter"] = {"initial_capacity": 100, "error_rate": 0.01, "exclusive": True}
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir=".", domain_id=domain_id)
+        assert handler.has_transaction(txobjs[1].transaction_id)
+        assert not handler.has_transaction(txid2)
+        other.remove(transaction_id=txobjs[1].transaction_id)
+        print(handler.stats.get_stats()["txid_filter"])
+
+    def test_13_deferred_indexing(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        conf["deferred_indexing"] = {"batch_size": 4, "interval": 0.1}
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=deferred_domain_id, start_workers=True)
+        for txobj in transactions:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+        sequence = handler.last_index_sequence
+        assert handler.wait_for_index(sequence, timeout=10)
+        assert handler.indexed_up_to >= sequence
+        assert handler.count_transactions(asset_group_id=asset_group_id1) == 10
+        assert len(handler.search_transaction(asset_group_id=asset_group_id2, count=0)) == 10
+        ret = handler.search_transaction_topology(transactions[1].transaction_id, traverse_to_past=False)
+        assert len(ret) == 1
+        assert handler.exec_sql(sql="SELECT COUNT(*) FROM pending_index_table")[0][0] == 0
+        print(handler.stats.get_stats()["deferred_indexing"])
+
+    def test_14_read_replicas(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        conf["db"] = dict(conf["db"])
+        conf["db"]["replicas"] = [{"db_addr": "127.0.0.1"}, {"db_addr": "localhost"}]
+        conf["db"]["read_your_writes_window"] = 1
+        conf["db"]["replica_check_interval"] = 3600
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir", domain_id=domain_id,
+                              start_workers=True)
+        assert len(handler.replicas) == 2
+        time.sleep(0.5)
+        for replica in handler.replicas:
+            replica["available"] = True  # -- the test DB is not a replica (no Seconds_Behind_Source)
+        assert handler.count_transactions(asset_group_id=asset_group_id1) == 10
+        assert len(handler.search_transaction(asset_group_id=asset_group_id2, count=0)) == 10
+        assert len(handler.search_transaction_topology(transactions[1].transaction_id, traverse_to_past=False)) == 1
+        assert [r["reads"] for r in handler.replicas] == [1, 2]
+
+        handler.remove(transaction_id=transactions[9].transaction_id)
+        assert handler.count_transactions(asset_group_id=asset_group_id1) == 9
+        assert handler.search_transaction(transaction_id=transactions[9].transaction_id) is None
+        assert sum(r["reads"] for r in handler.replicas) == 3
+        assert handler.insert_transaction(transactions[9].serialize(), transactions[9]) is not None
+        time.sleep(1.1)
+        txid = transactions[9].transaction_id
+        assert txid in handler.search_transaction(transaction_id=txid)
+        assert sum(r["reads"] for r in handler.replicas) == 4
+
+    def test_15_shards(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=sharded_domain_id)
+        for txobj in transactions:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+        conf["db"] = dict(conf["db"])
+        conf["db"]["shards"] = [dict(), dict()]
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=sharded_domain_id)
+        assert len(handler.shards) == 3
+        assert handler.rebalance_shards(batch_size=3) > 0
+        assert handler.rebalance_shards() == 0
+        for i, adaptor in enumerate(handler.shards):
+            for row in handler.exec_sql(sql="SELECT transaction_id FROM transaction_table", db_adaptor=adaptor):
+                assert shard_index(row[0], 3) == i
+        assert handler.count_transactions(asset_group_id=asset_group_id1) == 10
+        assert handler.count_transactions(asset_group_id=asset_group_id2, user_id=user_id2) == 10
+        for txobj in transactions:
+            assert handler.has_transaction(txobj.transaction_id)
+            assert txobj.transaction_id in handler.search_transaction(transaction_id=txobj.transaction_id)
+        ret = handler.search_transaction_topology(transactions[1].transaction_id, traverse_to_past=False)
+        assert len(ret) == 1
+        found = list()
+        cursor = None
+        while True:
+            ret_txobj, cursor = handler.search_transaction_with_cursor(asset_group_id=asset_group_id1, count=3,
+                                                                       cursor=cursor)
+            found.extend(ret_txobj.keys())
+            if cursor is None:
+                break
+        assert len(found) == 10 and len(set(found)) == 10
+        timestamps = {txobj.transaction_id: txobj.timestamp for txobj in transactions}
+        assert [timestamps[txid] for txid in found] == sorted([timestamps[txid] for txid in found], reverse=True)
+
+    def test_16_time_range(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        since = min(txobj.timestamp for txobj in transactions)
+        until = max(txobj.timestamp for txobj in transactions) + 1
+        total = data_handler.count_transactions(asset_group_id=asset_group_id1)
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1, since=since, until=until) == total
+        assert data_handler.count_transactions(asset_group_id=asset_group_id1, until=since) == 0
+        assert data_handler.count_transactions(user_id=user_id2, since=until) == 0
+        ret_txobj, cursor = data_handler.search_transaction_with_cursor(asset_group_id=asset_group_id1, count=20,
+                                                                        since=since, until=until)
+        assert len(ret_txobj) == total and cursor is None
+        ret_txobj, cursor = data_handler.search_transaction_with_cursor(asset_group_id=asset_group_id1, since=until)
+        assert len(ret_txobj) == 0
+
+    def test_17_body_index(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=body_index_domain_id)
+        txobjs = list()
+        for i in range(9):
+            txobj = bbclib.make_transaction(relation_num=1)
+            bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                      asset_body={"account": 10000 + i % 3, "payer": {"name": "user%d" % i}})
+            txobj.digest()
+            txobjs.append(txobj)
+        for txobj in txobjs[:6]:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+
+        conf["body_index"] = {asset_group_id1.hex(): ["account", "payer.name"]}
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=body_index_domain_id)
+        for txobj in txobjs[6:]:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+        ret_txobj, cursor = handler.search_transaction_by_body_field(asset_group_id1, "account", value=10000, count=20)
+        assert set(ret_txobj.keys()) == {txobjs[6].transaction_id}
+        assert handler.backfill_body_index(batch_size=4) == 9
+        ret_txobj, cursor = handler.search_transaction_by_body_field(asset_group_id1, "account", value=10000, count=20)
+        assert set(ret_txobj.keys()) == {txobjs[i].transaction_id for i in [0, 3, 6]}
+        ret_txobj, cursor = handler.search_transaction_by_body_field(asset_group_id1, "payer.name", value="user4")
+        assert list(ret_txobj.keys()) == [txobjs[4].transaction_id]
+        found = list()
+        cursor = None
+        while True:
+            ret_txobj, cursor = handler.search_transaction_by_body_field(asset_group_id1, "account", lower=10001,
+                                                                         upper=10002, count=4, cursor=cursor)
+            found.extend(ret_txobj.keys())
+            if cursor is None:
+                break
+        assert len(found) == 6 and len(set(found)) == 6
+        assert handler.search_transaction_by_body_field(asset_group_id1, "amount", value=1) == (None, None)
+        handler.remove(transaction_id=txobjs[0].transaction_id)
+        ret_txobj, cursor = handler.search_transaction_by_body_field(asset_group_id1, "account", value=10000, count=20)
+        assert len(ret_txobj) == 2
+
+    def test_18_head(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = config["domains"][bbclib.convert_id_to_string(domain_id)]
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=head_domain_id)
+        assert handler.get_head(asset_group_id2, user_id2) == (None, None)
+        for txobj in transactions:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+        assert handler.get_head(asset_group_id2, user_id2) == (transactions[9].transaction_id,
+                                                               transactions[9].relations[0].asset.asset_id)
+        assert handler.get_head(asset_group_id1, user_id1)[0] == transactions[9].transaction_id
+        assert handler.get_head(asset_group_id1, user_id2) == (None, None)
+
+        handler.remove(transaction_id=transactions[9].transaction_id)
+        assert handler.get_head(asset_group_id2, user_id2) == (transactions[8].transaction_id,
+                                                               transactions[8].relations[0].asset.asset_id)
+        handler.exec_sql(sql="DELETE FROM head_table", commit=True)
+        assert handler.rebuild_heads() == 2
+        assert handler.get_head(asset_group_id2, user_id2)[0] == transactions[8].transaction_id
+        assert handler.insert_transaction(transactions[9].serialize(), transactions[9]) is not None
+        assert handler.get_head(asset_group_id2, user_id2)[0] == transactions[9].transaction_id
+
+    def test_19_change_feed(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        conf["change_feed"] = {"retention": 3600}
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=change_feed_domain_id)
+        entries, token = handler.read_change_feed()
+        assert entries == []
+        for txobj in transactions[:5]:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+        entries, token = handler.read_change_feed(count=3)
+        assert [e[1] for e in entries] == [txobj.transaction_id for txobj in transactions[:3]]
+        assert entries[0][2] == sorted([asset_group_id1, asset_group_id2])
+        assert entries[0][0] < entries[1][0] < entries[2][0]
+        entries, token = handler.read_change_feed(token=token, count=3, include_data=True)
+        assert [e[1] for e in entries] == [txobj.transaction_id for txobj in transactions[3:5]]
+        assert entries[0][3] == transactions[3].transaction_data
+        entries, token2 = handler.read_change_feed(token=token, wait=0.5)
+        assert entries == [] and token2 == token
+
+        for txobj in transactions[5:]:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+        entries, token = handler.read_change_feed(token=token)
+        assert [e[1] for e in entries] == [txobj.transaction_id for txobj in transactions[5:]]
+        entries, token2 = handler.read_change_feed(token=handler.get_change_feed_token())
+        assert entries == [] and token2 == token
+        assert handler.read_change_feed(token=b'invalid') == (None, None)
+
+    def test_20_concurrent_transactions(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = config["domains"][bbclib.convert_id_to_string(domain_id)]
+        handler = DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                              domain_id=concurrent_domain_id)
+        txobjs = list()
+        for i in range(40):
+            txobj = bbclib.make_transaction(event_num=1)
+            bbclib.add_event_asset(txobj, event_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                   asset_body=b'concurrent %d' % i)
+            txobj.digest()
+            txobjs.append(txobj)
+        for txobj in txobjs[:20]:
+            assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+
+        def insert(targets):
+            for txobj in targets:
+                assert handler.insert_transaction(txobj.serialize(), txobj) is not None
+
+        def remove(targets):
+            for txobj in targets:
+                handler.remove(transaction_id=txobj.transaction_id)
+
+        # -- the threads share the connection of the handler
+        threads = [threading.Thread(target=insert, args=(txobjs[20+i*5:25+i*5],)) for i in range(4)]
+        threads.append(threading.Thread(target=remove, args=(txobjs[:20],)))
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert not handler.db_adaptor.in_transaction
+        for txobj in txobjs[:20]:
+            assert handler.search_transaction(transaction_id=txobj.transaction_id) is None
+        for txobj in txobjs[20:]:
+            assert handler.search_transaction(transaction_id=txobj.transaction_id) is not None
+        assert handler.count_transactions(asset_group_id=asset_group_id1) == 20
+
+        # -- an exception between begin() and commit() must not leave the connection locked
+        def fail(txobj):
+            raise RuntimeError("failure in the DB transaction")
+
+        handler._get_counter_keys = fail
+        with pytest.raises(RuntimeError):
+            handler.insert_transaction(txobjs[0].serialize(), txobjs[0])
+        del handler._get_counter_keys
+
+        def lock_in_another_thread():
+            if handler.db_adaptor.lock.acquire(timeout=1):
+                handler.db_adaptor.lock.release()
+                acquired.append(True)
+
+        acquired = list()
+        th = threading.Thread(target=lock_in_another_thread)
+        th.start()
+        th.join()
+        assert acquired == [True]
+        assert handler.search_transaction(transaction_id=txobjs[0].transaction_id) is None
+
+    def test_21_indexers_sharing_db(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        conf["deferred_indexing"] = {"batch_size": 2, "interval": 0.1}
+        handlers = [DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                                domain_id=shared_index_domain_id, start_workers=True) for i in range(2)]
+        for i, txobj in enumerate(transactions):
+            assert handlers[i % 2].insert_transaction(txobj.serialize(), txobj) is not None
+        for handler in handlers:
+            assert handler.wait_for_index(handler.last_index_sequence, timeout=10)
+        assert handlers[0].exec_sql(sql="SELECT COUNT(*) FROM pending_index_table")[0][0] == 0
+        assert handlers[0].exec_sql(sql="SELECT COUNT(*) FROM asset_info_table")[0][0] == 20
+        assert handlers[1].count_transactions(asset_group_id=asset_group_id1) == 10
+        assert len(handlers[1].search_transaction(asset_group_id=asset_group_id2, count=0)) == 10
+
+    def test_22_change_feed_commit_order(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        conf = dict(config["domains"][bbclib.convert_id_to_string(domain_id)])
+        conf["change_feed"] = {"retention": 3600}
+        first, second = [DataHandler(networking=DummyCore().networking, config=conf, workingdir="testdir",
+                                     domain_id=feed_order_domain_id) for i in range(2)]
+        token = second.get_change_feed_token()
+        sql = "INSERT INTO change_feed_table(transaction_id, asset_group_ids, inserted_at) VALUES (%s,%s,%s)"
+
+        # -- the first connection takes the smaller id but commits after the second one
+        first.db_adaptor.begin()
+        first.exec_sql(sql=sql, args=(txid1, b'', int(time.time())), commit=True)
+        assert second.insert_transaction(transactions[0].serialize(), transactions[0]) is not None
+        entries, token2 = second.read_change_feed(token=token)
+        assert entries == [] and token2 == token
+        end_token = second.get_change_feed_token()
+        first.db_adaptor.commit()
+        entries, token = second.read_change_feed(token=token)
+        assert [e[1] for e in entries] == [txid1, transactions[0].transaction_id]
+        entries, token2 = second.read_change_feed(token=end_token)
+        assert len(entries) == 2 and token2 == token
+
+        # -- a rolled back insert leaves a gap, which is skipped after the commit lag
+        first.db_adaptor.begin()
+        first.exec_sql(sql=sql, args=(txid2, b'', int(time.time())), commit=True)
+        first.db_adaptor.rollback()
+        assert second.insert_transaction(transactions[1].serialize(), transactions[1]) is not None
+        entries, token2 = second.read_change_feed(token=token)
+        assert entries == []
+        second.change_feed_commit_lag = 0
+        entries, token = second.read_change_feed(token=token)
+        assert [e[1] for e in entries] == [transactions[1].transaction_id]
+
+        # -- a long poll finds an insert by another core, which does not notify the reader
+        th = threading.Timer(0.5, first.insert_transaction, args=(transactions[2].serialize(), transactions[2]))
+        th.start()
+        start = time.time()
+        entries, token = second.read_change_feed(token=token, wait=10)
+        th.join()
+        assert [e[1] for e in entries] == [transactions[2].transaction_id]
+        assert time.time() - start < 5
+
 
 if __name__ == '__main__':
     pytest.main()
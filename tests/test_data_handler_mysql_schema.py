@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import shutil
+import sys
+sys.path.extend(["../", "../utils"])
+from bbc_simple.core import bbclib
+from bbc_simple.core import bbc_stats
+from bbc_simple.core.data_handler import DataHandler
+import bbc_ledger_tool
+import bbc_schema_migrate
+
+user_id1 = bbclib.get_new_id("destination_id_test1")[:bbclib.DEFAULT_ID_LEN]
+asset_group_id1 = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
+domain_id = bbclib.get_new_id("test_domain_schema")
+v1_domain_id = bbclib.get_new_id("test_domain_schema_v1")
+keypair1 = bbclib.KeyPair()
+keypair1.generate()
+
+WORKING_DIR = ".bbc_schema_test"
+
+data_handler = None
+transactions = list()
+db_conf = {
+    "db_addr": "127.0.0.1",
+    "db_port": 3306,
+    "db_user": "user",
+    "db_pass": "pass",
+    "db_rootpass": "password",
+}
+
+
+class DummyCore:
+    class BBcNetwork:
+        def __init__(self, core):
+            self.core = core
+            self.logger = None
+
+    def __init__(self):
+        self.networking = DummyCore.BBcNetwork(self)
+        self.stats = bbc_stats.BBcStats()
+
+
+class Args:
+    def __init__(self, domain_id_str):
+        self.workingdir = WORKING_DIR
+        self.domain_id = domain_id_str
+        self.engine = "InnoDB"
+        self.batch_size = 4
+        self.sleep = 0
+        self.id_margin = 1000
+        self.drop = True
+        self.backfill = True
+
+
+def make_transactions(num):
+    txobjs = list()
+    for i in range(num):
+        txobj = bbclib.make_transaction(relation_num=1, witness=True)
+        bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                  asset_body=b'schema %d' % i)
+        if i > 0:
+            bbclib.add_relation_pointer(txobj, relation_idx=0, ref_transaction_id=txobjs[-1].transaction_id)
+        txobj.witness.add_witness(user_id1)
+        sig = txobj.sign(keypair=keypair1)
+        txobj.witness.add_signature(user_id=user_id1, signature=sig)
+        txobjs.append(txobj)
+    return txobjs
+
+
+def explain(handler, sql, args):
+    """Return the EXPLAIN output of the query as a dict"""
+    ret = handler.exec_sql(sql="EXPLAIN " + sql, args=args)
+    names = handler.db_adaptor.db_cur.column_names
+    plan = dict(zip(names, ret[0]))
+    return {k: (v.decode() if isinstance(v, bytes) else v) for k, v in plan.items()}
+
+
+class TestDataHandlerSchema(object):
+
+    def test_01_setup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global data_handler
+        dummycore = DummyCore()
+        data_handler = DataHandler(networking=dummycore.networking, config={"db": db_conf}, workingdir="testdir",
+                                   domain_id=domain_id)
+        assert data_handler.schema_version == 3
+        transactions.extend(make_transactions(10))
+        for txobj in transactions:
+            assert data_handler.insert_transaction(txobj.serialize(), txobj) is not None
+        ret = data_handler.exec_sql(sql="SHOW COLUMNS FROM asset_info_table LIKE 'asset_group_id'")
+        assert "varbinary" in str(ret[0][1])
+
+    def test_02_explain_asset_info(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for column, value in [("asset_group_id", asset_group_id1), ("user_id", user_id1),
+                              ("asset_id", transactions[0].relations[0].asset.asset_id)]:
+            for direction in ["DESC", "ASC"]:
+                plan = explain(data_handler, "SELECT * FROM asset_info_table WHERE %s = %%s ORDER BY id %s LIMIT 20" %
+                               (column, direction), (value,))
+                print(plan)
+                assert plan["key"] == "idx_%s_id" % column
+                assert "filesort" not in (plan["Extra"] or "")
+
+    def test_03_explain_topology(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        txid = transactions[1].transaction_id
+        plan = explain(data_handler, "SELECT * FROM topology_table WHERE base = %s", (txid,))
+        assert plan["key"] == "idx_base_point_to"
+        plan = explain(data_handler, "SELECT * FROM topology_table WHERE point_to = %s", (txid,))
+        assert plan["key"] == "idx_point_to_base"
+        plan = explain(data_handler, "DELETE FROM topology_table WHERE base = %s AND point_to = %s",
+                       (txid, transactions[0].transaction_id))
+        assert plan["key"] in ["idx_base_point_to", "idx_point_to_base"]
+
+    def test_04_migrate(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        dummycore = DummyCore()
+        conf = dict(db_conf)
+        conf["schema_version"] = 1
+        handler = DataHandler(networking=dummycore.networking, config={"db": conf}, workingdir="testdir",
+                              domain_id=v1_domain_id)
+        assert handler.schema_version == 1
+        txobjs = make_transactions(10)
+        for txobj in txobjs:
+            handler.insert_transaction(txobj.serialize(), txobj)
+        before = handler.search_transaction(asset_group_id=asset_group_id1, count=0)
+
+        assert bbc_schema_migrate.migrate(Args(bbclib.convert_id_to_string(v1_domain_id)))
+        handler = bbc_ledger_tool.open_data_handler(WORKING_DIR, bbclib.convert_id_to_string(v1_domain_id))
+        assert handler.schema_version == 3
+        after = handler.search_transaction(asset_group_id=asset_group_id1, count=0)
+        assert list(before.keys()) == list(after.keys())
+        ret = handler.search_transaction_topology(txobjs[1].transaction_id)
+        assert len(ret) == 1 and ret[0][2] == txobjs[0].transaction_id
+        ret = handler.exec_sql(sql="SELECT COUNT(*) FROM transaction_table WHERE timestamp = 0")
+        assert ret[0][0] == 0
+        assert handler.archive_transactions(horizon=txobjs[5].timestamp + 1) > 0
+        assert len(handler.search_transaction(asset_group_id=asset_group_id1, count=0, deep=True)) == 10
+        assert handler.has_transaction(txobjs[0].transaction_id)
+        assert handler.insert_transaction(txobjs[0].transaction_data, txobjs[0]) is None  # -- archived one
+        ret = handler.exec_sql(sql="SELECT COUNT(*) FROM transaction_table WHERE transaction_id = %s" %
+                                   handler.db_adaptor.placeholder, args=(txobjs[0].transaction_id,))
+        assert ret[0][0] == 0
+        assert not bbc_schema_migrate.migrate(Args(bbclib.convert_id_to_string(v1_domain_id)))
+        shutil.rmtree(WORKING_DIR)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import shutil
+import sys
+sys.path.extend(["../"])
+from bbc_simple.core import bbclib
+from bbc_simple.core.journal import InsertJournal, JOURNAL_SUFFIX, APPLIED_SUFFIX
+
+JOURNAL_DIR = ".test_journal"
+JOURNAL_PATH = os.path.join(JOURNAL_DIR, "domain" + JOURNAL_SUFFIX)
+
+user_id1 = bbclib.get_new_id("destination_id_test1")[:bbclib.DEFAULT_ID_LEN]
+asset_group_id1 = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
+transactions = list()
+journal = None
+
+
+def get_transaction_id(txdata):
+    return bbclib.scan_transaction(txdata).transaction_id
+
+
+class TestJournal(object):
+
+    def test_01_append(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global journal
+        shutil.rmtree(JOURNAL_DIR, ignore_errors=True)
+        os.makedirs(JOURNAL_DIR)
+        journal = InsertJournal(JOURNAL_PATH, get_transaction_id)
+        for i in range(10):
+            txobj = bbclib.make_transaction(relation_num=1)
+            bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                      asset_body=b'journal %d' % i)
+            txobj.digest()
+            transactions.append(txobj)
+            assert journal.append(txobj.transaction_id, txobj.serialize()) == i + 1
+        assert journal.synced == 10
+        assert journal.get_pending_transaction(transactions[3].transaction_id) == transactions[3].transaction_data
+        records = journal.get_unapplied(limit=4)
+        assert [seq for seq, txdata in records] == [1, 2, 3, 4]
+        assert journal.lag()[0] == 10
+
+    def test_02_apply(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        journal.mark_applied(4)
+        assert journal.lag()[0] == 6
+        assert journal.get_pending_transaction(transactions[3].transaction_id) is None
+        assert [seq for seq, txdata in journal.get_unapplied()] == [5, 6, 7, 8, 9, 10]
+        with open(JOURNAL_PATH + APPLIED_SUFFIX) as f:
+            assert f.read() == "4"
+
+    def test_03_replay(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        with open(JOURNAL_PATH, "ab") as f:
+            f.write(b'\x0b\x00\x00\x00torn record')
+        replayed = InsertJournal(JOURNAL_PATH, get_transaction_id)
+        assert replayed.sequence == 10
+        assert [seq for seq, txdata in replayed.get_unapplied()] == [5, 6, 7, 8, 9, 10]
+        assert replayed.get_pending_transaction(transactions[9].transaction_id) == transactions[9].transaction_data
+        assert os.path.getsize(JOURNAL_PATH) == journal.file.tell()
+        txobj = bbclib.make_transaction(event_num=1)
+        bbclib.add_event_asset(txobj, event_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                               asset_body=b'journal 10')
+        txobj.digest()
+        assert replayed.append(txobj.transaction_id, txobj.serialize()) == 11
+
+    def test_04_truncate(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        replayed = InsertJournal(JOURNAL_PATH, get_transaction_id, max_size=0)
+        replayed.mark_applied(11)
+        assert os.path.getsize(JOURNAL_PATH) == 0
+        replayed = InsertJournal(JOURNAL_PATH, get_transaction_id)
+        assert replayed.sequence == 11
+        assert replayed.lag() == (0, 0)
+        shutil.rmtree(JOURNAL_DIR)
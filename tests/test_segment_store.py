@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import os
+import shutil
+import sys
+sys.path.extend(["../"])
+from bbc_simple.core import bbclib
+from bbc_simple.core.segment_store import SegmentStore, SEGMENT_SUFFIX, INDEX_SUFFIX
+
+STORE_DIR = ".test_segment_store"
+
+user_id1 = bbclib.get_new_id("destination_id_test1")[:bbclib.DEFAULT_ID_LEN]
+asset_group_id1 = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
+transactions = list()
+store = None
+
+
+class TestSegmentStore(object):
+
+    def test_01_append(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        global store
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
+        store = SegmentStore(STORE_DIR, segment_size=1024, sync=False)
+        for i in range(20):
+            txobj = bbclib.make_transaction(relation_num=1)
+            bbclib.add_relation_asset(txobj, relation_idx=0, asset_group_id=asset_group_id1, user_id=user_id1,
+                                      asset_body=b'segment %d' % i)
+            txobj.digest()
+            transactions.append(txobj)
+            store.append(txobj.transaction_id, txobj.serialize())
+        assert len(store) == 20
+        assert store.segment > 0
+        print(store.get_stats())
+
+    def test_02_get(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        for txobj in transactions:
+            assert txobj.transaction_id in store
+            txdata = store.get(txobj.transaction_id)
+            assert bytes(txdata) == txobj.transaction_data
+            assert bbclib.scan_transaction(txdata).transaction_id == txobj.transaction_id
+        assert store.get(bbclib.get_new_id("not stored")) is None
+
+    def test_03_remove(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        assert store.remove(transactions[0].transaction_id)
+        assert not store.remove(transactions[0].transaction_id)
+        assert transactions[0].transaction_id not in store
+        assert store.get(transactions[0].transaction_id) is None
+        assert len(store) == 19
+
+    def test_04_reload(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        last = store.segment
+        with open(os.path.join(STORE_DIR, "%08d%s" % (last, SEGMENT_SUFFIX)), "r+b") as f:
+            f.truncate(os.path.getsize(f.name) - 1)
+        with open(os.path.join(STORE_DIR, "%08d%s" % (last, INDEX_SUFFIX)), "ab") as f:
+            f.write(b'\x01\x20torn')
+        reloaded = SegmentStore(STORE_DIR, segment_size=1024, sync=False)
+        assert reloaded.segment == last
+        assert transactions[-1].transaction_id not in reloaded
+        reloaded.append(transactions[-1].transaction_id, transactions[-1].transaction_data)
+        reloaded = SegmentStore(STORE_DIR, segment_size=1024, sync=False)
+        assert bytes(reloaded.get(transactions[-1].transaction_id)) == transactions[-1].transaction_data
+        reloaded.remove(transactions[-1].transaction_id)
+        assert len(reloaded) == 18
+        assert transactions[0].transaction_id not in reloaded
+        assert transactions[-1].transaction_id not in reloaded
+        for txobj in transactions[1:-1]:
+            assert bytes(reloaded.get(txobj.transaction_id)) == txobj.transaction_data
+        shutil.rmtree(STORE_DIR)
@@ -246,6 +246,60 @@ class TestUserMessageRouting(object):
             recv = result_queue.get()
             assert recv[KeyType.message] == 500
 
+    def test_19_coalesced_notification(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        umr = user_routings[0]
+        umr.coalesce_window = 0.5
+        umr.coalesce_max_batch = 3
+        umr.register_notification(asset_group_id, users[0], coalesce=True)
+        transaction_ids = [bbclib.get_new_id("coalesced_tx_%d" % i) for i in range(5)]
+        for txid in transaction_ids:
+            umr._send_notification(txid, [asset_group_id])
+        time.sleep(0.2)
+        assert result_queue.qsize() == 1
+        recv = result_queue.get()
+        assert recv[KeyType.command] == bbclib.MsgType.NOTIFY_INSERTED
+        assert recv[KeyType.transaction_id_list] == transaction_ids[:3]
+        time.sleep(1)
+        assert result_queue.qsize() == 1
+        assert result_queue.get()[KeyType.transaction_id_list] == transaction_ids[3:]
+
+        umr.register_notification(asset_group_id, users[0])
+        umr._send_notification(transaction_ids[0], [asset_group_id])
+        time.sleep(1)
+        assert result_queue.qsize() == 1
+        assert result_queue.get()[KeyType.transaction_id] == transaction_ids[0]
+        umr.unregister_notification(asset_group_id, users[0])
+        assert asset_group_id not in umr.coalesced_notification_list
+
+    def test_20_notification_filter(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        umr = user_routings[0]
+        assert not networkings[0].has_notification_subscribers(domain_id, [asset_group_id])
+        umr.register_notification(asset_group_id, users[0], filter_user_id=users[1])
+        assert networkings[1].has_notification_subscribers(domain_id, [asset_group_id])
+        transaction_ids = [bbclib.get_new_id("filtered_tx_%d" % i) for i in range(2)]
+        umr._send_notification(transaction_ids[0], [asset_group_id], [(asset_group_id, users[5], users[2])])
+        umr._send_notification(transaction_ids[1], [asset_group_id], [(asset_group_id, users[5], users[1])])
+        time.sleep(1)
+        assert result_queue.qsize() == 1
+        assert result_queue.get()[KeyType.transaction_id] == transaction_ids[1]
+        umr.unregister_notification(asset_group_id, users[0])
+        assert not networkings[1].has_notification_subscribers(domain_id, [asset_group_id])
+
+    def test_21_notification_registry_cleanup(self):
+        print("\n-----", sys._getframe().f_code.co_name, "-----")
+        umr = user_routings[0]
+        # -- the registration of a crashed node is ignored after its expiry
+        key = bbc_network._notification_key(domain_id, asset_group_id)
+        networkings[1].redis_msg.zadd(key, {b'crashed_node': time.time() - 1})
+        assert not networkings[1].has_notification_subscribers(domain_id, [asset_group_id])
+        umr.register_notification(asset_group_id, users[0])
+        assert networkings[1].has_notification_subscribers(domain_id, [asset_group_id])
+        umr.unregister_user(user_id=users[0], socket=client_socks[0])
+        assert asset_group_id not in umr.insert_notification_list
+        assert not networkings[1].has_notification_subscribers(domain_id, [asset_group_id])
+
 
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Bulk export/import tool for the ledger tables (transaction_table, asset_info_table and topology_table) of a domain
+
+  export: dump the tables (with their archive tables from schema version 3) into <dir>/<table>.bbcl in parallel
+          (one process per table). Rows are read with keyset pagination (WHERE key > last ORDER BY key LIMIT n), so
+          the DB never scans skipped rows.
+  import: load the dumps in parallel. Secondary indexes are dropped before loading and re-created at once afterwards,
+          and rows are inserted with multi-row INSERT statements. With --verify, the signatures of the transactions
+          are checked in a process pool, and invalid transactions are not imported. The transaction counters are
+          rebuilt with the heads (head_table), and the body index is backfilled if declared, after loading.
+  (export and import are not available with shards, or with segment_store, which keeps the transaction data out of
+  the DB)
+  rebuild_counters: recompute the transaction counters (counter_table) from asset_info_table
+  archive: move the transactions older than the retention to the archive tables (schema version 3, see
+           DataHandler.archive_transactions())
+  backfill_body_index: write the index of the fields of the dict asset bodies declared in "body_index" of the domain
+                       config for the existing transactions (see DataHandler.backfill_body_index())
+  rebalance: move the transactions to the shards given by the current "shards" config (after adding shards).
+
+The dump of a table is a header (magic, version, number of columns) followed by zlib-compressed chunks of rows.
+Each chunk is prefixed with the number of rows and the compressed size. A chunk of 0 rows terminates the dump.
+In a row, INTEGER columns are int64 and BLOB columns are uint32 length-prefixed (0xFFFFFFFF means NULL).
+"""
+from argparse import ArgumentParser
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+import sys
+
+sys.path.append("..")
+import bbc_simple.core.bbclib as bbclib
+from bbc_simple.core.bbc_config import BBcConfig, DEFAULT_WORKING_DIR
+from bbc_simple.core.data_handler import DataHandler, transaction_tbl_definition, asset_info_definition, \
+    topology_info_definition, ARCHIVE_SUFFIX
+
+DUMP_MAGIC = b'BBCL'
+DUMP_VERSION = 1
+DUMP_SUFFIX = ".bbcl"
+_DUMP_HEADER = struct.Struct('<4sHH')
+_CHUNK_HEADER = struct.Struct('<II')
+_INT64 = struct.Struct('<q')
+_UINT32 = struct.Struct('<I')
+_NULL = 0xFFFFFFFF
+
+# table name -> (definition, keyset pagination key)
+TABLES = {
+    "transaction_table": (transaction_tbl_definition, "transaction_id"),
+    "asset_info_table": (asset_info_definition, "id"),
+    "topology_table": (topology_info_definition, "id"),
+}
+
+
+def get_tables(handler):
+    """Return the names of the tables to dump in the schema version of the DB (the archive tables from version 3)"""
+    tables = list(TABLES)
+    if handler.schema_version >= 3:
+        tables += [table + ARCHIVE_SUFFIX for table in TABLES]
+    return tables
+
+
+def get_table_definition(handler, table):
+    """Return the definition in the dump and the pagination key of the table in the schema version of the DB"""
+    if table.endswith(ARCHIVE_SUFFIX):
+        table = table[:-len(ARCHIVE_SUFFIX)]
+    definition, key = TABLES[table]
+    if handler.schema_version >= 3:
+        definition = definition + [["timestamp", "INTEGER"]]
+    return definition, key
+
+
+def open_data_handler(workingdir, domain_id_str):
+    """Connect to the DB of the domain (the DB and the tables are created if not exist)"""
+    config = BBcConfig(workingdir)
+    domain_id = bbclib.convert_idstring_to_bytes(domain_id_str, 32)
+    conf = config.get_domain_config(domain_id)
+    return DataHandler(default_config=config.get_config()['db'], config=conf if conf is not None else dict(),
+                       workingdir=workingdir, domain_id=domain_id)
+
+
+def check_bulk_available(handler):
+    """Exit if the ledger of the domain is not all in the tables of the DB given by "db" (export and import use them)"""
+    if handler.segment_store is not None:
+        print("### export/import are not available with segment_store (the transaction data is in the segment files)")
+        sys.exit(1)
+    if len(handler.shards) > 1:
+        print("### export/import are not available with shards (they read and write the first shard only)")
+        sys.exit(1)
+
+
+def encode_rows(definition, rows):
+    """Encode rows into a chunk"""
+    dat = bytearray()
+    for row in rows:
+        for (name, coltype), val in zip(definition, row):
+            if coltype == "INTEGER":
+                dat.extend(_INT64.pack(val))
+            elif val is None:
+                dat.extend(_UINT32.pack(_NULL))
+            else:
+                dat.extend(_UINT32.pack(len(val)))
+                dat.extend(val)
+    payload = zlib.compress(bytes(dat), 1)
+    return _CHUNK_HEADER.pack(len(rows), len(payload)) + payload
+
+
+def decode_rows(definition, num, payload):
+    """Decode a chunk into rows"""
+    dat = zlib.decompress(payload)
+    rows = list()
+    ptr = 0
+    for i in range(num):
+        row = list()
+        for name, coltype in definition:
+            if coltype == "INTEGER":
+                row.append(_INT64.unpack_from(dat, ptr)[0])
+                ptr += _INT64.size
+                continue
+            size = _UINT32.unpack_from(dat, ptr)[0]
+            ptr += _UINT32.size
+            if size == _NULL:
+                row.append(None)
+            else:
+                row.append(dat[ptr:ptr+size])
+                ptr += size
+        rows.append(tuple(row))
+    return rows
+
+
+def read_chunks(path, definition):
+    """Iterate over the chunks in a dump file
+
+    Returns:
+        generator: list of rows in each chunk
+    """
+    with open(path, "rb") as f:
+        magic, version, ncols = _DUMP_HEADER.unpack(f.read(_DUMP_HEADER.size))
+        if magic != DUMP_MAGIC or version != DUMP_VERSION or ncols != len(definition):
+            raise ValueError("%s is not a dump of the table" % path)
+        while True:
+            num, size = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+            if num == 0:
+                return
+            yield decode_rows(definition, num, f.read(size))
+
+
+def export_table(workingdir, domain_id_str, table, directory, page_size):
+    """Dump a table with keyset pagination
+
+    Returns:
+        int: the number of exported rows
+    """
+    handler = open_data_handler(workingdir, domain_id_str)
+    definition, key = get_table_definition(handler, table)
+    key_idx = [d[0] for d in definition].index(key)
+    count = 0
+    last = None
+    with open(os.path.join(directory, table + DUMP_SUFFIX), "wb") as f:
+        f.write(_DUMP_HEADER.pack(DUMP_MAGIC, DUMP_VERSION, len(definition)))
+        while True:
+            if last is None:
+                rows = handler.exec_sql(sql="SELECT * FROM %s ORDER BY %s LIMIT %d" % (table, key, page_size))
+            else:
+                rows = handler.exec_sql(sql="SELECT * FROM %s WHERE %s > %s ORDER BY %s LIMIT %d" %
+                                            (table, key, handler.db_adaptor.placeholder, key, page_size),
+                                        args=(last,))
+            if rows is None:
+                raise IOError("failed to read %s" % table)
+            if len(rows) == 0:
+                break
+            f.write(encode_rows(definition, rows))
+            count += len(rows)
+            last = rows[-1][key_idx]
+        f.write(_CHUNK_HEADER.pack(0, 0))
+    return count
+
+
+def drop_secondary_indexes(handler, table):
+    """Drop the indexes other than PRIMARY and return their definitions for re-creation"""
+    indexes = dict()
+    for row in handler.exec_sql(sql="SHOW INDEX FROM %s" % table):
+        key_name, seq, column, sub_part = row[2], row[3], row[4], row[7]
+        if key_name == "PRIMARY":
+            continue
+        if sub_part is not None:
+            column = "%s(%d)" % (column, sub_part)
+        indexes.setdefault(key_name, list()).append((seq, column))
+    if len(indexes) > 0:
+        handler.exec_sql(sql="ALTER TABLE %s %s" % (table, ", ".join("DROP INDEX `%s`" % name for name in indexes)),
+                         commit=True)
+    return indexes
+
+
+def create_indexes(handler, table, indexes):
+    """Re-create the indexes dropped by drop_secondary_indexes() in a single ALTER TABLE"""
+    if len(indexes) == 0:
+        return
+    defs = ["ADD INDEX `%s` (%s)" % (name, ", ".join(col for seq, col in sorted(cols)))
+            for name, cols in indexes.items()]
+    handler.exec_sql(sql="ALTER TABLE %s %s" % (table, ", ".join(defs)), commit=True)
+
+
+def insert_rows(handler, table, definition, rows, batch_size):
+    """Insert rows with multi-row INSERT statements"""
+    columns = ",".join(d[0] for d in definition)
+    values = "(%s)" % ",".join([handler.db_adaptor.placeholder] * len(definition))
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i+batch_size]
+        args = [val for row in batch for val in row]
+        ret = handler.exec_sql(sql="INSERT INTO %s (%s) VALUES %s" % (table, columns, ",".join([values] * len(batch))),
+                               args=args, commit=True)
+        if ret is None:
+            raise IOError("failed to insert into %s" % table)
+
+
+def verify_transaction(row):
+    """Check the transaction_id and the signatures of a transaction_table row
+
+    Returns:
+        bool: True if valid
+    """
+    txid, txdata = row
+    idx = bbclib.scan_transaction(txdata)
+    if idx is None or idx.transaction_id != txid:
+        return False
+    return bbclib.validate_transaction_object(idx)[0]
+
+
+def import_table(workingdir, domain_id_str, table, directory, batch_size, verify_pool=None):
+    """Load a table from its dump
+
+    Returns:
+        int: the number of imported rows
+        list: transaction_ids rejected by the verification (transaction_table only)
+    """
+    handler = open_data_handler(workingdir, domain_id_str)
+    definition, key = get_table_definition(handler, table)
+    handler.exec_sql(sql="SET unique_checks=0", commit=True)
+    indexes = drop_secondary_indexes(handler, table)
+    count = 0
+    rejected = list()
+    try:
+        for rows in read_chunks(os.path.join(directory, table + DUMP_SUFFIX), definition):
+            if verify_pool is not None:
+                results = verify_pool.map(verify_transaction, rows)
+                rejected.extend(row[0] for row, ok in zip(rows, results) if not ok)
+                rows = [row for row, ok in zip(rows, results) if ok]
+            insert_rows(handler, table, definition, rows, batch_size)
+            count += len(rows)
+    finally:
+        create_indexes(handler, table, indexes)
+        handler.exec_sql(sql="SET unique_checks=1", commit=True)
+    return count, rejected
+
+
+def remove_rejected(handler, transaction_ids):
+    """Remove the asset_info and topology rows (and their archive) of the transactions rejected by the verification"""
+    suffixes = ["", ARCHIVE_SUFFIX] if handler.schema_version >= 3 else [""]
+    for txid in transaction_ids:
+        for suffix in suffixes:
+            handler.exec_sql(sql="DELETE FROM asset_info_table%s WHERE transaction_id = %s" %
+                                 (suffix, handler.db_adaptor.placeholder), args=(txid,), commit=True)
+            handler.exec_sql(sql="DELETE FROM topology_table%s WHERE base = %s" %
+                                 (suffix, handler.db_adaptor.placeholder), args=(txid,), commit=True)
+
+
+def command_export(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    check_bulk_available(handler)
+    os.makedirs(args.directory, exist_ok=True)
+    tables = get_tables(handler)
+    pool = multiprocessing.Pool(len(tables))
+    results = [(table, pool.apply_async(export_table, (args.workingdir, args.domain_id, table, args.directory,
+                                                       args.page_size))) for table in tables]
+    for table, result in results:
+        print("%s: exported %d rows" % (table, result.get()))
+    pool.close()
+    pool.join()
+
+
+def command_import(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    check_bulk_available(handler)
+    tx_tables = [table for table in get_tables(handler) if table.startswith("transaction_table")]
+    others = [table for table in get_tables(handler) if table not in tx_tables]
+    pool = multiprocessing.Pool(len(others))
+    results = [(table, pool.apply_async(import_table, (args.workingdir, args.domain_id, table, args.directory,
+                                                       args.batch_size))) for table in others]
+    verify_pool = multiprocessing.Pool(args.verify) if args.verify > 0 else None
+    rejected = list()
+    for table in tx_tables:
+        count, rejected_in_table = import_table(args.workingdir, args.domain_id, table, args.directory,
+                                                args.batch_size, verify_pool)
+        rejected.extend(rejected_in_table)
+        print("%s: imported %d rows" % (table, count))
+    if verify_pool is not None:
+        verify_pool.close()
+    for table, result in results:
+        print("%s: imported %d rows" % (table, result.get()[0]))
+    pool.close()
+    pool.join()
+    if len(rejected) > 0:
+        remove_rejected(handler, rejected)
+        print("rejected %d invalid transactions:" % len(rejected))
+        for txid in rejected:
+            print("  %s" % txid.hex())
+    command_rebuild_counters(args)
+    num = handler.rebuild_heads()
+    if num is None:
+        print("### Failed to rebuild the heads")
+        sys.exit(1)
+    print("head_table: rebuilt %d heads" % num)
+    if len(handler.body_index_fields) > 0:
+        command_backfill_body_index(args)
+
+
+def command_rebuild_counters(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    num = handler.rebuild_counters()
+    if num is None:
+        print("### Failed to rebuild the counters")
+        sys.exit(1)
+    print("counter_table: rebuilt %d counters" % num)
+
+
+def command_archive(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    num = handler.archive_transactions(int(time.time()) - args.retention, batch_size=args.page_size)
+    if num is None:
+        print("### Failed to archive the transactions")
+        sys.exit(1)
+    print("archived %d rows" % num)
+
+
+def command_backfill_body_index(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    num = handler.backfill_body_index(batch_size=args.page_size)
+    if num is None:
+        print("### Failed to backfill the body index")
+        sys.exit(1)
+    print("body_index_table: indexed %d transactions" % num)
+
+
+def command_rebalance(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    num = handler.rebalance_shards(batch_size=args.page_size)
+    if num is None:
+        print("### Failed to rebalance the shards")
+        sys.exit(1)
+    print("moved %d transactions among %d shards" % (num, len(handler.shards)))
+
+
+def parser():
+    usage = 'python {} {{export,import,rebuild_counters,archive,backfill_body_index,rebalance}} -d <domain_id> ' \
+            '[-w <dir>] [-o <dir>] [-p <number>] [-b <number>] [-r <sec>] ' \
+            '[--verify <number>] [--help]'.format(__file__)
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('command', type=str, choices=['export', 'import', 'rebuild_counters', 'archive',
+                                                         'backfill_body_index', 'rebalance'])
+    argparser.add_argument('-w', '--workingdir', type=str, default=DEFAULT_WORKING_DIR, help='working directory name')
+    argparser.add_argument('-d', '--domain_id', type=str, required=True, help='domain_id (hex string)')
+    argparser.add_argument('-o', '--directory', type=str, default="ledger_dump", help='directory of the dump files')
+    argparser.add_argument('-p', '--page_size', type=int, default=5000,
+                           help='rows per page in export, archive, backfill_body_index and rebalance')
+    argparser.add_argument('-b', '--batch_size', type=int, default=500, help='rows per INSERT statement in import')
+    argparser.add_argument('-r', '--retention', type=int, default=365*24*3600,
+                           help='transactions older than this (sec) are archived')
+    argparser.add_argument('--verify', type=int, default=0,
+                           help='number of processes to verify the signatures in import (0: no verification)')
+    args = argparser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    parsed_args = parser()
+    start = time.time()
+    if parsed_args.command == "export":
+        command_export(parsed_args)
+    elif parsed_args.command == "import":
+        command_import(parsed_args)
+    elif parsed_args.command == "archive":
+        command_archive(parsed_args)
+    elif parsed_args.command == "backfill_body_index":
+        command_backfill_body_index(parsed_args)
+    elif parsed_args.command == "rebalance":
+        command_rebalance(parsed_args)
+    else:
+        command_rebuild_counters(parsed_args)
+    print("elapsed: %.1f sec" % (time.time() - start))
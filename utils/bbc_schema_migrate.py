@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Online migration of the ledger tables of a domain to the current schema version (see table_schemas in
+data_handler.py)
+
+Version 1 (BLOB ids, MyISAM) to version 2 (VARBINARY ids, InnoDB, composite indexes). The core can keep running
+during the migration:
+  1. the version 2 tables are created as <table>_v2
+  2. rows are copied in keyset-paginated batches (INSERT IGNORE ... SELECT), so the old tables are never locked
+     for long. asset_info_table and topology_table are copied until the copy catches up with the inserts.
+  3. the tables are swapped with a single (atomic) RENAME TABLE. The old ones remain as <table>_v1.
+  4. the rows inserted into the old tables between the last copy and the swap are copied. The AUTO_INCREMENT of
+     the new tables is set ahead of the old ones by --id_margin so that these rows keep their ids.
+
+Transactions inserted during the copy are found through their asset_info rows, so a transaction without any asset
+inserted during the migration is not copied.
+
+Version 2 to version 3 (timestamp columns and the archive tables): the timestamp columns are added to the tables in
+all the shards with the default value 0. The rows with timestamp 0 are never archived, and --backfill fills the
+timestamps of the existing rows from the transaction data in batches.
+"""
+from argparse import ArgumentParser
+import time
+import sys
+
+sys.path.append("..")
+from bbc_simple.core.data_handler import table_schemas, SCHEMA_VERSION, ARCHIVE_SUFFIX
+from bbc_ledger_tool import open_data_handler
+
+NEW_SUFFIX = "_v2"
+OLD_SUFFIX = "_v1"
+
+
+def get_max_id(handler, table):
+    ret = handler.exec_sql(sql="SELECT MAX(id) FROM %s" % table)
+    if ret is None or len(ret) == 0 or ret[0][0] is None:
+        return 0
+    return ret[0][0]
+
+
+def copy_batch(handler, table, dst, key, last, batch_size):
+    """Copy the rows of which key is larger than last
+
+    Returns:
+        the largest key copied (None if no row is copied)
+    """
+    placeholder = handler.db_adaptor.placeholder
+    if last is None:
+        keys = handler.exec_sql(sql="SELECT %s FROM %s ORDER BY %s LIMIT %d" % (key, table, key, batch_size))
+    else:
+        keys = handler.exec_sql(sql="SELECT %s FROM %s WHERE %s > %s ORDER BY %s LIMIT %d" %
+                                    (key, table, key, placeholder, key, batch_size), args=(last,))
+    if keys is None:
+        raise IOError("failed to read %s" % table)
+    if len(keys) == 0:
+        return None
+    upper = keys[-1][0]
+    if last is None:
+        sql = "INSERT IGNORE INTO %s SELECT * FROM %s WHERE %s <= %s" % (dst, table, key, placeholder)
+        args = (upper,)
+    else:
+        sql = "INSERT IGNORE INTO %s SELECT * FROM %s WHERE %s > %s AND %s <= %s" % (dst, table, key, placeholder,
+                                                                                   key, placeholder)
+        args = (last, upper)
+    if handler.exec_sql(sql=sql, args=args, commit=True) is None:
+        raise IOError("failed to copy %s" % table)
+    return upper
+
+
+def copy_table(handler, table, dst, key, last, batch_size, sleep):
+    """Copy the rows of which key is larger than last until no row is left
+
+    Returns:
+        the largest key copied
+    """
+    count = 0
+    while True:
+        upper = copy_batch(handler, table, dst, key, last, batch_size)
+        if upper is None:
+            print("%s: %d batches copied" % (table, count))
+            return last
+        last = upper
+        count += 1
+        if sleep > 0:
+            time.sleep(sleep)
+
+
+def migrate_v2(handler, args):
+    """Migrate the tables from schema version 1 to 2"""
+    handler.db_adaptor.table_engine = args.engine
+    tables = [tbl for tbl, definition, primary_key, indices in table_schemas[2]]
+    for tbl, definition, primary_key, indices in table_schemas[2]:
+        handler.db_adaptor.create_table(tbl + NEW_SUFFIX, definition, primary_key=primary_key, indices=indices)
+        if definition[0][0] == "id":
+            handler.exec_sql(sql="ALTER TABLE %s AUTO_INCREMENT = %d" %
+                                 (tbl + NEW_SUFFIX, get_max_id(handler, tbl) + args.id_margin), commit=True)
+
+    mark = get_max_id(handler, "asset_info_table")
+    copy_table(handler, "transaction_table", "transaction_table" + NEW_SUFFIX, "transaction_id", None,
+               args.batch_size, args.sleep)
+    last_ids = dict()
+    for tbl in ["asset_info_table", "topology_table"]:
+        last_ids[tbl] = copy_table(handler, tbl, tbl + NEW_SUFFIX, "id", None, args.batch_size, args.sleep)
+
+    renames = ["%s TO %s, %s TO %s" % (tbl, tbl + OLD_SUFFIX, tbl + NEW_SUFFIX, tbl) for tbl in tables]
+    if handler.exec_sql(sql="RENAME TABLE %s" % ", ".join(renames), commit=True) is None:
+        print("### Failed to swap the tables")
+        return False
+    print("swapped the tables")
+
+    for tbl in ["asset_info_table", "topology_table"]:
+        copy_table(handler, tbl + OLD_SUFFIX, tbl, "id", last_ids[tbl], args.batch_size, 0)
+    handler.exec_sql(sql="INSERT IGNORE INTO transaction_table SELECT * FROM transaction_table%s "
+                         "WHERE transaction_id IN (SELECT transaction_id FROM asset_info_table%s WHERE id > %s)" %
+                         (OLD_SUFFIX, OLD_SUFFIX, handler.db_adaptor.placeholder), args=(mark,), commit=True)
+    if args.drop:
+        handler.exec_sql(sql="DROP TABLE %s" % ", ".join(tbl + OLD_SUFFIX for tbl in tables), commit=True)
+    print("migrated to schema version 2")
+    return True
+
+
+def migrate_v3(handler, adaptor):
+    """Migrate the tables in a shard from schema version 2 to 3"""
+    for tbl, index in [("transaction_table", ""), ("topology_table", ""),
+                       ("asset_info_table", ", ADD INDEX idx_asset_group_id_timestamp (asset_group_id, timestamp)")]:
+        if handler.exec_sql(sql="ALTER TABLE %s ADD COLUMN timestamp BIGINT DEFAULT 0, ADD INDEX (timestamp)%s" %
+                                (tbl, index), commit=True, db_adaptor=adaptor) is None:
+            print("### Failed to add the timestamp column to %s in %s" % (tbl, adaptor.db_name))
+            return False
+    for tbl, definition, primary_key, indices in table_schemas[3]:
+        adaptor.create_table(tbl + ARCHIVE_SUFFIX, definition, primary_key=primary_key, indices=indices)
+    print("migrated %s to schema version 3" % adaptor.db_name)
+    return True
+
+
+def backfill_timestamps(handler, batch_size, sleep):
+    """Fill the timestamp columns of the rows inserted before the migration to schema version 3
+
+    Returns:
+        int: the number of (table, transaction_id) of which the timestamps are filled
+    """
+    count = 0
+    for adaptor in handler.shards:
+        placeholder = adaptor.placeholder
+        for tbl, key in [("transaction_table", "transaction_id"), ("asset_info_table", "transaction_id"),
+                         ("topology_table", "base")]:
+            last = b''
+            while True:
+                rows = handler.exec_sql(sql="SELECT DISTINCT %s FROM %s WHERE timestamp = 0 AND %s > %s "
+                                            "ORDER BY %s LIMIT %d" % (key, tbl, key, placeholder, key, batch_size),
+                                        args=(last,), db_adaptor=adaptor)
+                if rows is None:
+                    raise IOError("failed to read %s" % tbl)
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    txid = bytes(row[0])
+                    ret = handler.search_transaction(transaction_id=txid)
+                    if ret is None or txid not in ret:
+                        print("### transaction %s is not found" % txid.hex())
+                        continue
+                    handler.exec_sql(sql="UPDATE %s SET timestamp = %s WHERE %s = %s" %
+                                         (tbl, placeholder, key, placeholder),
+                                     args=(ret[txid].timestamp, txid), commit=True, db_adaptor=adaptor)
+                    count += 1
+                last = bytes(rows[-1][0])
+                if sleep > 0:
+                    time.sleep(sleep)
+            print("%s in %s: timestamps filled" % (tbl, adaptor.db_name))
+    return count
+
+
+def migrate(args):
+    handler = open_data_handler(args.workingdir, args.domain_id)
+    if handler.schema_version >= SCHEMA_VERSION:
+        print("### The DB is in schema version %d" % handler.schema_version)
+        return False
+    if handler.schema_version == 1 and not migrate_v2(handler, args):
+        return False
+    for adaptor in handler.shards:
+        if not migrate_v3(handler, adaptor):
+            return False
+    if args.backfill:
+        print("%d timestamps filled" % backfill_timestamps(handler, args.batch_size, args.sleep))
+    return True
+
+
+def parser():
+    usage = 'python {} -d <domain_id> [-w <dir>] [-e <engine>] [-b <number>] [-s <sec>] [-m <number>] [--drop] ' \
+            '[--backfill] [--help]'.format(__file__)
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('-w', '--workingdir', type=str, default=".bbc_simple", help='working directory name')
+    argparser.add_argument('-d', '--domain_id', type=str, required=True, help='domain_id (hex string)')
+    argparser.add_argument('-e', '--engine', type=str, default="InnoDB", help='engine of the new tables')
+    argparser.add_argument('-b', '--batch_size', type=int, default=5000, help='rows copied at a time')
+    argparser.add_argument('-s', '--sleep', type=float, default=0, help='sleep between batches (sec)')
+    argparser.add_argument('-m', '--id_margin', type=int, default=1000000,
+                           help='ids reserved for the rows inserted during the migration')
+    argparser.add_argument('--drop', action='store_true', default=False, help='drop the old tables after migration')
+    argparser.add_argument('--backfill', action='store_true', default=False,
+                           help='fill the timestamps of the existing rows (schema version 3)')
+    args = argparser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    parsed_args = parser()
+    if not migrate(parsed_args):
+        sys.exit(1)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Preset dictionary (zdict) management tool for FORMAT_BSON_COMPRESS_ZDICT/FORMAT_MSGPACK_COMPRESS_ZDICT
+
+  train:      train a new dictionary from the transactions of a domain (or from files) and save it in the working dir
+  list:       list the dictionaries in the working dir
+  evaluate:   compare the sizes of zlib and zdict compressed transactions
+  distribute: push the dictionaries in the working dir to redis so that other cores can fetch them at startup
+  fetch:      pull the dictionaries from redis into the working dir
+
+A dictionary id is a version number. A dictionary is never modified once saved, because the transactions
+compressed with it need it for decoding. To refresh a dictionary, train a new one; it gets the next id and
+becomes the default one for new transactions.
+"""
+from argparse import ArgumentParser
+import hashlib
+import os
+import sys
+
+sys.path.append("..")
+import bbc_simple.core.bbclib as bbclib
+from bbc_simple.core.bbc_config import BBcConfig, DEFAULT_WORKING_DIR, ZDICT_DIR
+from bbc_simple.core.bbc_network import ZDICT_REDIS_KEY
+
+BASE_FORMATS = {
+    "bson": bbclib.BBcFormat.FORMAT_BSON,
+    "msgpack": bbclib.BBcFormat.FORMAT_MSGPACK,
+}
+
+
+def convert_format(txobj, format_type):
+    """Set format_type to the transaction and all of its parts"""
+    txobj.format_type = format_type
+    parts = list(txobj.events) + list(txobj.references) + list(txobj.relations) + list(txobj.signatures)
+    parts += [evt.asset for evt in txobj.events] + [rtn.asset for rtn in txobj.relations]
+    parts += [pt for rtn in txobj.relations for pt in rtn.pointers]
+    parts += [txobj.witness, txobj.cross_ref]
+    for part in parts:
+        if part is not None:
+            part.format_type = format_type
+    return txobj
+
+
+def read_samples_from_db(config, domain_id_str, count):
+    """Read transaction data from the transaction_table of the domain"""
+    import mysql.connector
+    dbconf = config.get_config()['db']
+    domain_conf = config.get_domain_config(bbclib.convert_idstring_to_bytes(domain_id_str, 32))
+    if domain_conf is not None and 'db' in domain_conf:
+        dbconf = domain_conf['db']
+    conn = mysql.connector.connect(host=dbconf.get("db_addr", "127.0.0.1"), port=dbconf.get("db_port", 3306),
+                                   user=dbconf.get("db_user", "user"), password=dbconf.get("db_pass", "pass"),
+                                   database="dom" + dbconf.get("db_name", domain_id_str[:16]))
+    cur = conn.cursor()
+    cur.execute("SELECT transaction_data FROM transaction_table LIMIT %s", (count,))
+    samples = [bytes(row[0]) for row in cur.fetchall()]
+    conn.close()
+    return samples
+
+
+def read_samples_from_files(files):
+    """Read transaction data (one serialized transaction per file)"""
+    samples = list()
+    for fname in files:
+        with open(fname, "rb") as f:
+            samples.append(f.read())
+    return samples
+
+
+def make_training_data(samples, format_type):
+    """Convert transaction data into uncompressed bson/msgpack data (i.e., what zlib actually sees)"""
+    dat = list()
+    for sample in samples:
+        txobj = bbclib.BBcTransaction()
+        if not txobj.deserialize(sample):
+            continue
+        convert_format(txobj, format_type)
+        dat.append(txobj.serialize_obj(no_header=True))
+    return dat
+
+
+def get_zdict_dir(args):
+    return os.path.join(args.workingdir, ZDICT_DIR)
+
+
+def get_redis(config):
+    import redis
+    conf = config.get_config()['redis']
+    if 'password' in conf:
+        return redis.StrictRedis(host=conf['host'], port=conf['port'], password=conf['password'],
+                                 ssl=conf.get('ssl', False))
+    return redis.StrictRedis(host=conf['host'], port=conf['port'], ssl=conf.get('ssl', False))
+
+
+def read_samples(args):
+    if args.files:
+        return read_samples_from_files(args.files)
+    if args.domain_id is None:
+        print("### -d <domain_id> or --files is required")
+        sys.exit(1)
+    return read_samples_from_db(BBcConfig(args.workingdir), args.domain_id, args.samples)
+
+
+def command_train(args):
+    samples = make_training_data(read_samples(args), BASE_FORMATS[args.base])
+    if len(samples) == 0:
+        print("### no sample transaction")
+        return
+    zdict = bbclib.train_zdict(samples, size=args.size)
+    dict_ids = bbclib.load_zdicts(get_zdict_dir(args))
+    dict_id = args.id if args.id is not None else (dict_ids[-1] + 1 if len(dict_ids) > 0 else 1)
+    if dict_id in dict_ids:
+        print("### dictionary %d already exists (dictionaries must not be modified)" % dict_id)
+        return
+    path = bbclib.save_zdict(get_zdict_dir(args), dict_id, zdict)
+    print("dictionary %d: %d bytes from %d samples -> %s" % (dict_id, len(zdict), len(samples), path))
+
+
+def command_list(args):
+    dict_ids = bbclib.load_zdicts(get_zdict_dir(args))
+    for dict_id in dict_ids:
+        zdict = bbclib.get_zdict(dict_id)
+        print("%d: %d bytes, sha256=%s%s" % (dict_id, len(zdict), hashlib.sha256(zdict).hexdigest()[:16],
+                                            " (default)" if dict_id == dict_ids[-1] else ""))
+
+
+def command_evaluate(args):
+    samples = read_samples(args)
+    dict_ids = bbclib.load_zdicts(get_zdict_dir(args))
+    if args.id is not None:
+        if args.id not in dict_ids:
+            print("### no dictionary %d" % args.id)
+            return
+        bbclib.register_zdict(args.id, bbclib.get_zdict(args.id))
+    elif len(dict_ids) == 0:
+        print("### no dictionary")
+        return
+    base = BASE_FORMATS[args.base]
+    formats = [(base, "plain")]
+    if base == bbclib.BBcFormat.FORMAT_BSON:
+        formats += [(bbclib.BBcFormat.FORMAT_BSON_COMPRESS_ZLIB, "zlib"),
+                    (bbclib.BBcFormat.FORMAT_BSON_COMPRESS_ZDICT, "zdict")]
+    else:
+        formats += [(bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZLIB, "zlib"),
+                    (bbclib.BBcFormat.FORMAT_MSGPACK_COMPRESS_ZDICT, "zdict")]
+    for fmt, name in formats:
+        total = 0
+        for sample in samples:
+            txobj = convert_format(bbclib.BBcTransaction(deserialize=sample), fmt)
+            total += len(txobj.serialize())
+        print("%-6s: %d bytes/tx" % (name, total / max(len(samples), 1)))
+
+
+def command_distribute(args):
+    dict_ids = bbclib.load_zdicts(get_zdict_dir(args))
+    r = get_redis(BBcConfig(args.workingdir))
+    for dict_id in dict_ids:
+        if r.hsetnx(ZDICT_REDIS_KEY, dict_id, bbclib.get_zdict(dict_id)):
+            print("distributed dictionary %d" % dict_id)
+
+
+def command_fetch(args):
+    r = get_redis(BBcConfig(args.workingdir))
+    for dict_id, zdict in r.hgetall(ZDICT_REDIS_KEY).items():
+        path = os.path.join(get_zdict_dir(args), "%d%s" % (int(dict_id), bbclib.ZDICT_SUFFIX))
+        if not os.path.exists(path):
+            bbclib.save_zdict(get_zdict_dir(args), int(dict_id), zdict)
+            print("fetched dictionary %d" % int(dict_id))
+
+
+def parser():
+    usage = 'python {} {{train,list,evaluate,distribute,fetch}} [-w <dir>] [-d <domain_id>] [--files <file> ...] ' \
+            '[-n <number>] [-b bson|msgpack] [-i <number>] [-s <number>] [--help]'.format(__file__)
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('command', type=str, choices=['train', 'list', 'evaluate', 'distribute', 'fetch'])
+    argparser.add_argument('-w', '--workingdir', type=str, default=DEFAULT_WORKING_DIR, help='working directory name')
+    argparser.add_argument('-d', '--domain_id', type=str, default=None, help='domain_id (hex string) to sample')
+    argparser.add_argument('--files', type=str, nargs='+', default=None, help='files of serialized transactions')
+    argparser.add_argument('-n', '--samples', type=int, default=1000, help='number of sample transactions')
+    argparser.add_argument('-b', '--base', type=str, choices=list(BASE_FORMATS.keys()), default="msgpack",
+                           help='serialization format the dictionary is trained for')
+    argparser.add_argument('-i', '--id', type=int, default=None, help='dictionary id (default: the next version)')
+    argparser.add_argument('-s', '--size', type=int, default=bbclib.ZDICT_MAX_SIZE, help='max dictionary size')
+    args = argparser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    parsed_args = parser()
+    {
+        'train': command_train,
+        'list': command_list,
+        'evaluate': command_evaluate,
+        'distribute': command_distribute,
+        'fetch': command_fetch,
+    }[parsed_args.command](parsed_args)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+bbclib serialization benchmark
+"""
+from argparse import ArgumentParser
+import time
+import tracemalloc
+import sys
+
+sys.path.append("..")
+import bbc_simple.core.bbclib as bbclib
+
+asset_group_id = bbclib.get_new_id("asset_group_1")[:bbclib.DEFAULT_ID_LEN]
+user_id = bbclib.get_new_id("user_id_1")[:bbclib.DEFAULT_ID_LEN]
+keypair = None
+
+
+def measure(func, *args, loop=1):
+    """Return the average elapsed time of func(*args) in seconds"""
+    start = time.time()
+    for i in range(loop):
+        func(*args)
+    return (time.time() - start) / loop
+
+
+def make_transaction(fmt, relation_num, pointer_num, body_size):
+    """Make a signed transaction having many relations/pointers and large asset bodies"""
+    txobj = bbclib.make_transaction(relation_num=relation_num, witness=True, format_type=fmt)
+    for i in range(relation_num):
+        bbclib.add_relation_asset(txobj, relation_idx=i, asset_group_id=asset_group_id, user_id=user_id,
+                                  asset_body=bytes(body_size))
+        for j in range(pointer_num):
+            bbclib.add_relation_pointer(txobj, relation_idx=i,
+                                        ref_transaction_id=bbclib.get_new_id("tx%d-%d" % (i, j)),
+                                        ref_asset_id=bbclib.get_new_id("as%d-%d" % (i, j)))
+    txobj.witness.add_witness(user_id)
+    sig = txobj.sign(keypair=keypair)
+    txobj.witness.add_signature(user_id=user_id, signature=sig)
+    return txobj
+
+
+def bench_encode(fmt, args):
+    txobj = make_transaction(fmt, args.relations, args.pointers, args.body_size)
+    elapsed = measure(txobj.serialize, loop=args.loop)
+    print("encode: format=%d, size=%d bytes, %.1f usec/tx" % (fmt, len(txobj.serialize()), elapsed * 1000000))
+    elapsed = measure(txobj.digest, loop=args.loop)
+    print("digest: format=%d, %.1f usec/tx" % (fmt, elapsed * 1000000))
+
+
+def bench_decode(fmt, args):
+    txdata = make_transaction(fmt, args.relations, args.pointers, args.body_size).serialize()
+    elapsed = measure(bbclib.BBcTransaction, 0, txdata, loop=args.loop)
+    print("decode: format=%d, size=%d bytes, %.1f usec/tx" % (fmt, len(txdata), elapsed * 1000000))
+    elapsed = measure(bbclib.scan_transaction, txdata, loop=args.loop)
+    print("scan:   format=%d, size=%d bytes, %.1f usec/tx" % (fmt, len(txdata), elapsed * 1000000))
+
+
+def bench_msgpack_keys(args):
+    """Compare the old recursive key stringification with the single-pass msgpack decoding"""
+    txdata = make_transaction(bbclib.BBcFormat.FORMAT_MSGPACK, args.relations, args.pointers, args.body_size).serialize()
+    legacy = lambda dat: bbclib.deep_copy_with_key_stringify(bbclib.msgpack.loads(dat))
+    elapsed = measure(legacy, txdata[2:], loop=args.loop)
+    print("msgpack loads+stringify: %d relations x %d pointers, %.1f usec/tx" %
+          (args.relations, args.pointers, elapsed * 1000000))
+    elapsed = measure(bbclib._msgpack_loads, txdata[2:], loop=args.loop)
+    print("msgpack single pass:     %d relations x %d pointers, %.1f usec/tx" %
+          (args.relations, args.pointers, elapsed * 1000000))
+
+
+def bench_memory(fmt, args):
+    txdata = make_transaction(fmt, args.relations, args.pointers, args.body_size).serialize()
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    txobjs = [bbclib.BBcTransaction(deserialize=txdata) for i in range(args.memory)]
+    stats = tracemalloc.take_snapshot().compare_to(start, 'filename')
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in stats)
+    print("memory: format=%d, %d transactions, %.1f MB (%d bytes/tx)" %
+          (fmt, len(txobjs), total / 1024 / 1024, total / len(txobjs)))
+
+
+def parser():
+    usage = 'python {} [-f <number>] [-l <number>] [-r <number>] [-p <number>] [-b <number>] [-m <number>] [-k] [--help]'.format(__file__)
+    argparser = ArgumentParser(usage=usage)
+    argparser.add_argument('-f', '--format', type=int, action='append', default=None, help='format_type (repeatable)')
+    argparser.add_argument('-l', '--loop', type=int, default=1000, help='loop count')
+    argparser.add_argument('-r', '--relations', type=int, default=20, help='number of relations in a transaction')
+    argparser.add_argument('-p', '--pointers', type=int, default=4, help='number of pointers in a relation')
+    argparser.add_argument('-b', '--body_size', type=int, default=4096, help='size of each asset_body')
+    argparser.add_argument('-m', '--memory', type=int, default=0, help='number of transactions to keep decoded')
+    argparser.add_argument('-k', '--msgpack_keys', action='store_true', default=False,
+                           help='compare msgpack key stringification methods')
+    args = argparser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    parsed_args = parser()
+    keypair = bbclib.KeyPair()
+    keypair.generate()
+    if parsed_args.msgpack_keys:
+        bench_msgpack_keys(parsed_args)
+    formats = parsed_args.format if parsed_args.format is not None else [bbclib.BBcFormat.FORMAT_BINARY]
+    for fmt in formats:
+        if parsed_args.memory > 0:
+            bench_memory(fmt, parsed_args)
+        else:
+            bench_encode(fmt, parsed_args)
+            bench_decode(fmt, parsed_args)